@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""日次リセットの組み合わせ（過去に組んだ相手と組まないマッチング）のベンチマーク
+
+使い方: python bench/bench_pairing.py [--users 100000] [--rounds 30] [--odd]
+
+毎回シャッフルしたユーザーを match_users で組み合わせ、1回ごとの所要時間・比較回数・
+組み替え／重複の件数と、履歴（Bloomフィルタ）の保存サイズを出力し、最後に別の1回でメモリのピークを測る。
+最後に、実際にどれだけ過去と同じペアが出たかを全ペアの集合で確かめる。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from matchmaking.pairing import PairHistory, match_users
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--odd", action="store_true", help="ユーザー数を奇数にする（余った人の持ち越しを確認）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    users = [f"user{i:07d}" for i in range(args.users + (1 if args.odd and args.users % 2 == 0 else 0))]
+    history = PairHistory()
+    # 実際の重複を数えるための全ペア（ベンチマーク専用。本番は持たない）
+    met = set()
+    true_repeats = 0
+    previous_odd = None
+    timings = []
+
+    print(f"users: {len(users)}, rounds: {args.rounds}")
+    print(f"{'round':>5} {'ms':>8} {'checks':>8} {'repaired':>8} {'repeats':>7} {'odd':>12} {'history KB':>10}")
+    for round_number in range(args.rounds):
+        rng.shuffle(users)
+        # 本番と同じく、保存した履歴を読み直してから組み合わせる
+        history = PairHistory.from_bytes(history.to_bytes())
+        started = time.perf_counter()
+        pairs, odd, stats = match_users(users, history, f"epoch{round_number}", rng=rng)
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+
+        if previous_odd is not None and previous_odd == odd:
+            print(f"  warning: {odd} was left over twice in a row")
+        previous_odd = odd
+        for pair in pairs:
+            key = tuple(sorted(pair))
+            if key in met:
+                true_repeats += 1
+            met.add(key)
+        print(f"{round_number:>5} {elapsed * 1000:>8.1f} {stats['checks']:>8} {stats['repaired']:>8} "
+              f"{stats['repeats']:>7} {str(odd):>12} {len(history.to_bytes()) / 1024:>10.0f}")
+
+    # tracemalloc は計測中の処理を数倍遅くするので、時間とは別にもう1回だけ測る
+    rng.shuffle(users)
+    tracemalloc.start()
+    match_users(users, PairHistory.from_bytes(history.to_bytes()), "memory", rng=rng)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    print(f"pairing time:    p50 {timings[len(timings) // 2] * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms")
+    print(f"peak memory:     {peak / 1024 / 1024:.1f} MB")
+    print(f"history:         {history.stats()}")
+    print(f"repeated pairs:  {true_repeats} of {len(met) + true_repeats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""ローカル前処理パイプラインのベンチマーク
+
+使い方: python bench/bench_prefilter.py [--iterations N] [--stages reaction,pii,trivial]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from moderation.prefilter import create_prefilter_pipeline
+
+# 実際のチャットに近い比率のサンプル（短い相槌が多く、長文と個人情報が混ざる）
+SAMPLE_MESSAGES = [
+    "いいねそれ", "すごいね！", "がち？", "美味しそう〜", "わかる", "草www", "それな", "😂😂",
+    "今日は朝から雨で、駅まで歩くのが大変だった。午後は友達とカフェでずっと話してた。",
+    "最近ハマってるゲームがあって、夜更かししがちなのが悩み",
+    "連絡先は 090-1234-5678 か foo.bar@example.com です",
+    "〒150-0001 神宮前1-2-3 に引っ越しました",
+    "週末は山に登る予定です。天気がいいといいな",
+    "ありがとう！",
+]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--stages", default=None)
+    args = parser.parse_args()
+
+    pipeline = create_prefilter_pipeline(args.stages)
+    messages = SAMPLE_MESSAGES * (args.iterations // len(SAMPLE_MESSAGES) + 1)
+    messages = messages[:args.iterations]
+
+    started = time.perf_counter()
+    for message in messages:
+        pipeline.run(message)
+    elapsed = time.perf_counter() - started
+
+    stats = pipeline.stats()
+    print(f"messages:        {stats['total']}")
+    print(f"total time:      {elapsed * 1000:.1f} ms")
+    print(f"per message:     {elapsed / stats['total'] * 1e6:.2f} us")
+    print(f"skipped Gemini:  {stats['skip_ratio'] * 100:.1f}% {stats['completed_by_stage']}")
+    print(f"PII masked:      {stats['masked']}")
+
+if __name__ == "__main__":
+    main()
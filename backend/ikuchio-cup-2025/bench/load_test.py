@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""アプリ全体の負荷試験（Firestore・Gemini・Redisなしで実行できる）
+
+使い方: python bench/load_test.py [--users 200] [--duration 30] [--poll-interval 3] [--send-interval 20]
+        [--reset-users N] [--firestore-latency-ms 5] [--gemini-latency-ms 800] [--gemini-error-rate 0.01]
+        [--pipeline async|sync] [--storage firestore|memory] [--redis memory|fakeredis] [--output result.json]
+        [--baseline baseline.json --tolerance 0.2]
+
+FastAPIアプリをASGIで直接呼び出し、FirestoreとGeminiは bench/standins.py の代替実装、
+Redisはアプリのインメモリ実装（--redis fakeredis ならfakeredis）を使う。
+--storage memory ならFirestoreの代わりにアプリのインメモリストレージで同じAPIを計測する。
+ユーザー登録 → 0時のリセット → 3秒ごとのポーリングとメッセージ送信・WebSocket配信 の順に流し、
+操作ごとのp50/p95/p99・rps・1リクエストあたりのFirestore操作数を出力する。
+--baseline を指定すると保存済みの結果と比較し、悪化していれば終了コード1で終わる。
+リセットが失敗した（ルームが作られなかった）場合は計測を続けず終了コード2で終わる。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from bench_prefilter import SAMPLE_MESSAGES
+from standins import FakeFirestore, FakeGenaiClient, FakeWebSocket, install_fake_redis
+
+def percentile(sorted_values, p: float) -> float:
+    """最近傍順位法のパーセンタイル（sorted_valuesは昇順）"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+def summarize(samples, errors: int, elapsed: float) -> dict:
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+class LatencyRecorder:
+    """操作名ごとの所要時間とエラー数"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name: str, seconds: float, ok: bool = True):
+        self.samples[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def total(self) -> int:
+        return sum(len(values) for values in self.samples.values())
+
+    def summary(self, elapsed: float) -> dict:
+        return {name: summarize(values, self.errors[name], elapsed) for name, values in sorted(self.samples.items())}
+
+class Phase:
+    """1フェーズ分のリクエストの計測・経過時間・Firestore操作数の差分"""
+
+    def __init__(self, name: str, fake_db: FakeFirestore):
+        self.name = name
+        self.fake_db = fake_db
+        self.recorder = LatencyRecorder()
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        self._counters = self.fake_db.counters.snapshot()
+        self.elapsed = None
+        return self
+
+    def stop_clock(self):
+        """経過時間（rpsの分母）をここで確定する。以降の処理はFirestore操作数にだけ数える"""
+        self.elapsed = time.perf_counter() - self._started_at
+
+    def __exit__(self, *exc):
+        if self.elapsed is None:
+            self.stop_clock()
+        counters = self.fake_db.counters.snapshot()
+        self.requests = self.recorder.total()
+        self.firestore = {key: counters[key] - self._counters[key] for key in counters}
+        return False
+
+    def result(self) -> dict:
+        per_request = {
+            f"{key}_per_request": round(value / self.requests, 3) if self.requests else 0.0
+            for key, value in self.firestore.items()
+        }
+        return {"elapsed_seconds": round(self.elapsed, 3), "requests": self.requests,
+                "firestore": self.firestore, **per_request, "operations": self.recorder.summary(self.elapsed)}
+
+async def _request(client, recorder: LatencyRecorder, name: str, method: str, url: str, **kwargs):
+    """1リクエストを計測する。失敗（4xx/5xx・{"error": ...}）ならNoneを返す"""
+    started_at = time.perf_counter()
+    body = None
+    try:
+        response = await client.request(method, url, **kwargs)
+        body = response.json()
+        ok = response.status_code < 400 and not (isinstance(body, dict) and "error" in body)
+    except Exception:
+        ok = False
+    recorder.record(name, time.perf_counter() - started_at, ok)
+    return body if ok else None
+
+class LoadTestAborted(Exception):
+    """計測を続けても意味のない状態になった（以降のフェーズを流さずに終了する）"""
+
+def check_reset(reset, users: int):
+    """リセットの応答に問題があれば説明を返す（Noneなら問題なし）
+
+    失敗した応答（{"error": ...} や4xx/5xx）は _request がNoneにする。2人以上いるのに
+    ルームが0件なら、以降のフェーズは何も送らず、どの計測値も比較の意味がなくなる。
+    """
+    if reset is None:
+        return "POST /api/rooms/refresh failed (run with --verbose to see the error)"
+    if users > 1 and not reset.get("created_rooms"):
+        return f"POST /api/rooms/refresh created no rooms for {users} users: {reset}"
+    return None
+
+def _auth(uid: str) -> dict:
+    return {"Authorization": f"Bearer {uid}"}
+
+def _configure_environment(args):
+    """アプリのモジュールを読み込む前に環境変数と代替Redisを設定する"""
+    os.environ.pop('DISABLE_FIRESTORE', None)
+    os.environ['MESSAGE_PIPELINE'] = args.pipeline
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ.setdefault('TRACE_EXPORTER', 'none')
+    if args.redis == 'fakeredis':
+        url = install_fake_redis()
+        if url is None:
+            raise SystemExit("fakeredis is not installed (pip install fakeredis)")
+        os.environ['REDIS_URL'] = url
+    else:
+        os.environ.pop('REDIS_URL', None)
+
+def _install_standins(args):
+    from clients import clients
+    import gcp.gemini as gemini
+    fake_db = FakeFirestore(rpc_latency=args.firestore_latency_ms / 1000)
+    fake_gemini = FakeGenaiClient(
+        median_latency=args.gemini_latency_ms / 1000,
+        sigma=args.gemini_latency_sigma,
+        error_rate=args.gemini_error_rate,
+        seed=args.seed,
+    )
+    clients._firestore = fake_db
+    gemini._client = fake_gemini
+    return fake_db, fake_gemini
+
+async def _seed_idle_users(fake_db: FakeFirestore, count: int):
+    """リセット対象だけのユーザー（トラフィックは流さない）をRPCなしで投入する"""
+    import datetime
+    from db.storage import storage
+    created_at = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
+    users = [{"firebase_uid": f"idle{i}", "created_at": created_at, "room_id": None} for i in range(count)]
+    if storage.name == "firestore":
+        epoch = await storage.get_current_epoch()
+        fake_db.seed("users", {f"user_{user['firebase_uid']}": {"firebase_uid": user["firebase_uid"], "created_at": created_at} for user in users})
+        fake_db.seed("assignments", {f"{epoch}_user_{user['firebase_uid']}": {**user, "epoch": epoch} for user in users})
+    else:
+        for user in users:
+            await storage.create_user(user)
+
+async def _signup(client, recorder, uids, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def signup(uid):
+        async with semaphore:
+            await _request(client, recorder, "POST /api/users", "POST", "/api/users",
+                           json={"firebase_uid": uid}, headers=_auth(uid))
+    await asyncio.gather(*(signup(uid) for uid in uids))
+
+async def _sleep_until(deadline: float, seconds: float):
+    """seconds秒待つ（deadlineを過ぎては待たない。フェーズの経過時間が延びないように）"""
+    await asyncio.sleep(max(0.0, min(seconds, deadline - time.perf_counter())))
+
+class TrafficDriver:
+    """ユーザーごとのポーリングとメッセージ送信、WebSocket受信の記録"""
+
+    def __init__(self, client, args, rng: random.Random):
+        self.client = client
+        self.recorder = None
+        self.args = args
+        self.rng = rng
+        self.rooms = {}
+        self.sent = {}
+        self.received = {}
+        self.sockets = []
+        self._message_count = 0
+
+    def _on_message(self, websocket: FakeWebSocket, frame: dict, received_at: float):
+        if frame.get("type") == "new_message":
+            self.received.setdefault((websocket.name, frame.get("message_id")), received_at)
+
+    async def connect(self, uids, recorder: LatencyRecorder):
+        """割り当てられたルームを取得し、各ユーザーのWebSocketを接続する"""
+        from websocket_manager import websocket_manager
+        for uid in uids:
+            user = await _request(self.client, recorder, "GET /api/users", "GET", "/api/users",
+                                  params={"firebase_uid": uid}, headers=_auth(uid))
+            if user and user.get("room_id"):
+                self.rooms[uid] = user["room_id"]
+        for uid, room_id in self.rooms.items():
+            websocket = FakeWebSocket(uid, on_message=self._on_message)
+            await websocket_manager.connect(websocket, room_id)
+            self.sockets.append((websocket, room_id))
+
+    def _partners(self, uid: str):
+        room_id = self.rooms[uid]
+        return [other for other, other_room in self.rooms.items() if other_room == room_id and other != uid]
+
+    def _next_text(self) -> str:
+        self._message_count += 1
+        text = self.rng.choice(SAMPLE_MESSAGES)
+        # 長文は毎回変えて生成キャッシュに当たらないようにする（相槌はそのまま）
+        return text if len(text) <= 10 else f"{text} ({self._message_count})"
+
+    async def _poll_loop(self, uid: str, deadline: float):
+        cursor = None
+        await _sleep_until(deadline, self.rng.uniform(0, self.args.poll_interval))
+        while time.perf_counter() < deadline:
+            await _request(self.client, self.recorder, "GET /api/users", "GET", "/api/users",
+                           params={"firebase_uid": uid}, headers=_auth(uid))
+            params = {"since": cursor} if cursor else {}
+            name = "GET /api/room (since)" if cursor else "GET /api/room"
+            messages = await _request(self.client, self.recorder, name, "GET", f"/api/room/{self.rooms[uid]}", params=params)
+            if messages:
+                cursor = messages[-1].get("cursor", cursor)
+            await _sleep_until(deadline, self.args.poll_interval)
+
+    async def _send_loop(self, uid: str, deadline: float):
+        partners = self._partners(uid)
+        while True:
+            await _sleep_until(deadline, self.rng.expovariate(1 / self.args.send_interval))
+            if time.perf_counter() >= deadline:
+                return
+            started_at = time.perf_counter()
+            turn = await _request(self.client, self.recorder, "POST /api/room", "POST", f"/api/room/{self.rooms[uid]}",
+                                  json={"original_text": self._next_text(), "sender_id": uid})
+            if turn and turn.get("id"):
+                self.sent[turn["id"]] = (started_at, partners)
+
+    async def run(self, duration: float, recorder: LatencyRecorder):
+        self.recorder = recorder
+        deadline = time.perf_counter() + duration
+        tasks = []
+        for uid in self.rooms:
+            tasks.append(asyncio.create_task(self._poll_loop(uid, deadline)))
+            tasks.append(asyncio.create_task(self._send_loop(uid, deadline)))
+        await asyncio.gather(*tasks)
+
+    def _pending_deliveries(self) -> int:
+        return sum(1 for message_id, (_, partners) in self.sent.items()
+                   for partner in partners if (partner, message_id) not in self.received)
+
+    async def drain(self, timeout: float):
+        """送信済みメッセージが相手に届くまで（最大timeout秒）待つ"""
+        deadline = time.perf_counter() + timeout
+        while self._pending_deliveries() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    def delivery_summary(self) -> dict:
+        """送信開始から相手のWebSocketに new_message が届くまでの時間"""
+        latencies = []
+        for message_id, (started_at, partners) in self.sent.items():
+            for partner in partners:
+                received_at = self.received.get((partner, message_id))
+                if received_at is not None:
+                    latencies.append(received_at - started_at)
+        expected = sum(len(partners) for _, partners in self.sent.values())
+        summary = summarize(latencies, expected - len(latencies), 0)
+        summary.pop("rps")
+        summary["expected"] = expected
+        return summary
+
+    async def close(self):
+        from websocket_manager import websocket_manager
+        for websocket, room_id in self.sockets:
+            await websocket_manager.disconnect(websocket, room_id)
+
+async def _shutdown(get_current_user):
+    from main import app
+    from messaging.worker import message_worker_pool
+    from websocket_manager import websocket_manager
+    await message_worker_pool.stop()
+    await websocket_manager.stop_subscriber()
+    app.dependency_overrides.pop(get_current_user, None)
+
+async def run_load_test(args) -> dict:
+    import httpx
+    from fastapi import Request
+    from main import app
+    from auth.firebase_auth import get_current_user
+    from messaging.worker import message_worker_pool
+    from websocket_manager import websocket_manager
+
+    fake_db, fake_gemini = _install_standins(args)
+
+    # Bearerトークンをそのままfirebase_uidとして扱う（Firebaseの検証は計測対象外）
+    async def bench_current_user(request: Request):
+        return {"firebase_uid": request.headers["Authorization"].split(" ", 1)[1]}
+    app.dependency_overrides[get_current_user] = bench_current_user
+
+    rng = random.Random(args.seed)
+    uids = [f"bench{i}" for i in range(args.users)]
+    phases = {}
+
+    await message_worker_pool.start()
+    await websocket_manager.start_subscriber()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        with Phase("signup", fake_db) as phase:
+            await _signup(client, phase.recorder, uids, args.concurrency)
+        phases["signup"] = phase.result()
+
+        await _seed_idle_users(fake_db, max(0, args.reset_users - args.users))
+        with Phase("reset", fake_db) as phase:
+            reset = await _request(client, phase.recorder, "POST /api/rooms/refresh", "POST", "/api/rooms/refresh")
+        phases["reset"] = {**phase.result(), "users": args.users + max(0, args.reset_users - args.users),
+                           "created_rooms": (reset or {}).get("created_rooms", 0)}
+        problem = check_reset(reset, phases["reset"]["users"])
+        if problem is not None:
+            await _shutdown(get_current_user)
+            raise LoadTestAborted(problem)
+
+        driver = TrafficDriver(client, args, rng)
+        with Phase("connect", fake_db) as phase:
+            await driver.connect(uids, phase.recorder)
+        phases["connect"] = phase.result()
+        with Phase("steady", fake_db) as phase:
+            await driver.run(args.duration, phase.recorder)
+            # rpsは送信していた間だけで割る（配信待ちの時間は含めない）
+            phase.stop_clock()
+            drain_started_at = time.perf_counter()
+            await driver.drain(args.drain)
+        phases["steady"] = {**phase.result(), "drain_seconds": round(time.perf_counter() - drain_started_at, 3)}
+        await driver.close()
+
+    await _shutdown(get_current_user)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "verbose")},
+        "operations": phases["steady"]["operations"],
+        "phases": phases,
+        "delivery": driver.delivery_summary(),
+        "gemini": fake_gemini.stats(),
+    }
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float, min_delta_ms: float = 1.0):
+    """保存済みの結果より悪化した項目の説明のリストを返す（空なら合格）
+
+    レイテンシは p95/p99 が (1+tolerance) 倍かつ min_delta_ms 以上遅くなった場合、
+    スループットは rps が (1-tolerance) 倍を下回った場合、
+    Firestore操作数は1リクエストあたりの値が (1+tolerance) 倍を超えた場合に悪化とする。
+    """
+    regressions = []
+
+    def check_latency(label, current, base):
+        for key in ("p95_ms", "p99_ms"):
+            if key in base and current.get(key, 0.0) > base[key] * (1 + tolerance) and current.get(key, 0.0) - base[key] >= min_delta_ms:
+                regressions.append(f"{label} {key}: {base[key]:.1f} -> {current[key]:.1f}")
+
+    for name, base in baseline.get("operations", {}).items():
+        current = result.get("operations", {}).get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        check_latency(name, current, base)
+        if base.get("rps") and current.get("rps", 0.0) < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name} rps: {base['rps']:.1f} -> {current.get('rps', 0.0):.1f}")
+
+    if "delivery" in baseline:
+        check_latency("delivery", result.get("delivery", {}), baseline["delivery"])
+
+    for name, base in baseline.get("phases", {}).items():
+        current = result.get("phases", {}).get(name, {})
+        for key, value in base.items():
+            if key.endswith("_per_request") and current.get(key, 0.0) > value * (1 + tolerance) + 1e-9:
+                regressions.append(f"{name} {key}: {value} -> {current.get(key)}")
+    reset_base = baseline.get("phases", {}).get("reset", {}).get("elapsed_seconds")
+    reset_current = result.get("phases", {}).get("reset", {}).get("elapsed_seconds")
+    if reset_base and reset_current and reset_current > reset_base * (1 + tolerance) and (reset_current - reset_base) * 1000 >= min_delta_ms:
+        regressions.append(f"reset elapsed_seconds: {reset_base} -> {reset_current}")
+    return regressions
+
+def print_report(result: dict):
+    print(f"{'operation':<28} {'count':>7} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in result["operations"].items():
+        print(f"{name:<28} {stats['count']:>7} {stats['errors']:>6} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    delivery = result["delivery"]
+    print(f"{'ws delivery (send->partner)':<28} {delivery['count']:>7} {delivery['errors']:>6} {'':>8} "
+          f"{delivery['p50_ms']:>9.1f} {delivery['p95_ms']:>9.1f} {delivery['p99_ms']:>9.1f}")
+    print()
+    for name, phase in result["phases"].items():
+        drain = f" (+{phase['drain_seconds']:.2f}s drain)" if "drain_seconds" in phase else ""
+        print(f"[{name}] {phase['elapsed_seconds']:.2f}s{drain}, {phase['requests']} requests, "
+              f"firestore/request: {phase['rpcs_per_request']} rpcs, {phase['reads_per_request']} reads, "
+              f"{phase['writes_per_request']} writes")
+    print(f"[gemini] {result['gemini']['calls']} calls, {result['gemini']['errors']} simulated errors")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--poll-interval", type=float, default=3.0)
+    parser.add_argument("--send-interval", type=float, default=20.0, help="1ユーザーあたりの平均送信間隔（秒）")
+    parser.add_argument("--drain", type=float, default=10.0, help="送信終了後に配信を待つ最大秒数")
+    parser.add_argument("--reset-users", type=int, default=0, help="リセット時のユーザー数（--usersより多い分は待機ユーザーとして投入）")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--firestore-latency-ms", type=float, default=5.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0, help="Gemini応答時間の中央値")
+    parser.add_argument("--gemini-latency-sigma", type=float, default=0.5, help="対数正規分布のσ")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--pipeline", choices=("async", "sync"), default="async")
+    parser.add_argument("--storage", choices=("firestore", "memory"), default="firestore")
+    parser.add_argument("--redis", choices=("memory", "fakeredis"), default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="結果をJSONで保存する（次回の--baselineに使う）")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="アプリのログを表示する")
+    args = parser.parse_args()
+
+    _configure_environment(args)
+    # アプリのデバッグ出力は量が多いので、指定がなければ捨てる
+    with open(os.devnull, "w") as devnull, contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        try:
+            result = asyncio.run(run_load_test(args))
+        except LoadTestAborted as e:
+            print(f"Load test aborted: {e}", file=sys.stderr)
+            sys.exit(2)
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""負荷試験用のローカル代替実装（Firestore・Gemini・WebSocket）
+
+アプリのコードが使っているAPIの範囲だけを実装し、RPC・読み取り・書き込みの回数を数える。
+Redisは REDIS_URL を設定しなければアプリ側のインメモリ実装が使われ、
+fakeredis がインストールされていれば install_fake_redis で差し替えられる。
+"""
+import asyncio
+import copy
+import itertools
+import json
+import math
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+DOCUMENT_ID = "__name__"
+
+def _sort_value(value):
+    """Noneと値を比較できるようにする（FirestoreでもNullは最小）"""
+    return (0, "") if value is None else (1, value)
+
+class FirestoreCounters:
+    """RPC数・読み取りドキュメント数・書き込みドキュメント数"""
+
+    def __init__(self):
+        self.rpcs = 0
+        self.reads = 0
+        self.writes = 0
+        self.aborted = 0
+
+    def snapshot(self) -> dict:
+        return {"rpcs": self.rpcs, "reads": self.reads, "writes": self.writes, "aborted": self.aborted}
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data: Optional[dict], fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self._fields = fields
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._fields is not None:
+            return {key: copy.deepcopy(self._data[key]) for key in self._fields if key in self._data}
+        return copy.deepcopy(self._data)
+
+    def get(self, field: str):
+        return (self._data or {}).get(field)
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_id: str, document_id: str):
+        self._client = client
+        self.collection_id = collection_id
+        self.id = document_id
+
+    @property
+    def path(self) -> str:
+        return f"{self.collection_id}/{self.id}"
+
+    def _key(self):
+        return (self.collection_id, self.id)
+
+    async def get(self, transaction=None):
+        await self._client._rpc()
+        self._client.counters.reads += 1
+        if transaction is not None:
+            transaction._observe(self)
+        return FakeDocumentSnapshot(self, self._client._docs(self.collection_id).get(self.id))
+
+    async def set(self, data: dict, merge: bool = False):
+        await self._client._commit([("set", self, data, merge)])
+
+    async def update(self, data: dict):
+        await self._client._commit([("update", self, data, False)])
+
+    async def delete(self):
+        await self._client._commit([("delete", self, None, False)])
+
+    async def create(self, data: dict):
+        await self._client._commit([("create", self, data, False)])
+
+class FakeQuery:
+    def __init__(self, client, collection_id: str, filters=(), orders=(), cursor=None, limit_count=None, fields=None):
+        self._client = client
+        self._collection_id = collection_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._cursor = cursor
+        self._limit = limit_count
+        self._fields = fields
+
+    def _copy(self, **changes):
+        params = {
+            "filters": self._filters, "orders": self._orders, "cursor": self._cursor,
+            "limit_count": self._limit, "fields": self._fields,
+        }
+        params.update(changes)
+        return FakeQuery(self._client, self._collection_id, **params)
+
+    def where(self, field: str, op: str, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING"):
+        descending = str(direction).upper().startswith("DESC")
+        return self._copy(orders=self._orders + ((field, descending),))
+
+    def start_after(self, cursor):
+        return self._copy(cursor=cursor)
+
+    def limit(self, count: int):
+        return self._copy(limit_count=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=tuple(field_paths))
+
+    def _matches(self, data: dict) -> bool:
+        for field, op, value in self._filters:
+            actual = data.get(field)
+            if op == "==":
+                ok = actual == value
+            elif op == "in":
+                ok = actual in value
+            elif op == "array_contains":
+                ok = isinstance(actual, list) and value in actual
+            elif actual is None:
+                ok = False
+            elif op == "<":
+                ok = actual < value
+            elif op == "<=":
+                ok = actual <= value
+            elif op == ">":
+                ok = actual > value
+            elif op == ">=":
+                ok = actual >= value
+            elif op == "!=":
+                ok = actual != value
+            else:
+                raise ValueError(f"Unsupported operator: {op}")
+            if not ok:
+                return False
+        return True
+
+    def _orders_with_id(self):
+        # Firestoreと同じく、最後にドキュメントIDで順序を確定させる
+        orders = list(self._orders)
+        if not any(field == DOCUMENT_ID for field, _ in orders):
+            orders.append((DOCUMENT_ID, orders[-1][1] if orders else False))
+        return orders
+
+    @staticmethod
+    def _field(document_id: str, data: dict, field: str):
+        return document_id if field == DOCUMENT_ID else data.get(field)
+
+    def _cursor_values(self, orders):
+        cursor = self._cursor
+        if isinstance(cursor, FakeDocumentSnapshot):
+            data = cursor._data or {}
+            return [self._field(cursor.id, data, field) for field, _ in orders]
+        # dictのカーソルは並び順のフィールドの値（IDの列は含まれない場合がある）
+        return [cursor.get(field) for field, _ in orders if field in cursor or field != DOCUMENT_ID]
+
+    def _after_cursor(self, document_id: str, data: dict, orders, cursor_values) -> bool:
+        for (field, descending), cursor_value in zip(orders, cursor_values):
+            value = _sort_value(self._field(document_id, data, field))
+            cursor_key = _sort_value(cursor_value)
+            if value == cursor_key:
+                continue
+            return value < cursor_key if descending else value > cursor_key
+        return False
+
+    def _run(self):
+        orders = self._orders_with_id()
+        docs = [(doc_id, data) for doc_id, data in self._client._docs(self._collection_id).items() if self._matches(data)]
+        for field, descending in reversed(orders):
+            docs.sort(key=lambda item: _sort_value(self._field(item[0], item[1], field)), reverse=descending)
+        if self._cursor is not None:
+            cursor_values = self._cursor_values(orders)
+            docs = [(doc_id, data) for doc_id, data in docs if self._after_cursor(doc_id, data, orders, cursor_values)]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        return [
+            FakeDocumentSnapshot(FakeDocumentReference(self._client, self._collection_id, doc_id), data, self._fields)
+            for doc_id, data in docs
+        ]
+
+    async def get(self, transaction=None):
+        await self._client._rpc()
+        results = self._run()
+        # 結果が0件でも1読み取りとして課金される
+        self._client.counters.reads += max(1, len(results))
+        return results
+
+    async def stream(self, transaction=None):
+        for snapshot in await self.get(transaction=transaction):
+            yield snapshot
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, collection_id: str):
+        super().__init__(client, collection_id)
+        self.id = collection_id
+
+    def document(self, document_id: Optional[str] = None):
+        return FakeDocumentReference(self._client, self._collection_id, document_id or uuid.uuid4().hex[:20])
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data: dict, merge: bool = False):
+        self._ops.append(("set", reference, data, merge))
+
+    def update(self, reference, data: dict):
+        self._ops.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None, False))
+
+    def create(self, reference, data: dict):
+        self._ops.append(("create", reference, data, False))
+
+    async def commit(self):
+        ops, self._ops = self._ops, []
+        await self._client._commit(ops)
+
+class FakeTransaction(FakeWriteBatch):
+    """google.cloud.firestore.async_transactional から呼ばれる内部メソッドを実装したトランザクション
+
+    読んだドキュメントのバージョンを覚えておき、コミット時に変わっていればAbortedを送出する
+    （async_transactionalが関数ごと再実行する）。
+    """
+
+    def __init__(self, client, max_attempts: int = 5):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _observe(self, reference):
+        self._read_versions.setdefault(reference._key(), self._client._versions.get(reference._key(), 0))
+
+    def _clean_up(self):
+        self._ops = []
+        self._read_versions = {}
+        self._id = None
+
+    async def _begin(self, retry_id=None):
+        await self._client._rpc()
+        self._id = uuid.uuid4().bytes
+
+    async def _rollback(self):
+        await self._client._rpc()
+        self._clean_up()
+
+    async def _commit(self):
+        from google.api_core.exceptions import Aborted
+        for key, version in self._read_versions.items():
+            if self._client._versions.get(key, 0) != version:
+                self._client.counters.aborted += 1
+                self._clean_up()
+                raise Aborted("Transaction contention (stand-in)")
+        ops, self._ops = self._ops, []
+        await self._client._commit(ops)
+        self._clean_up()
+        return []
+
+class FakeFirestore:
+    """Firestore AsyncClientのインメモリ代替
+
+    rpc_latencyを指定すると1RPCごとにその秒数だけ待つ（ネットワーク往復の模擬）。
+    """
+
+    def __init__(self, rpc_latency: float = 0.0):
+        self.rpc_latency = rpc_latency
+        self.counters = FirestoreCounters()
+        self._collections: Dict[str, Dict[str, dict]] = {}
+        self._versions: Dict[tuple, int] = {}
+        self._commit_lock = asyncio.Lock()
+
+    def _docs(self, collection_id: str) -> Dict[str, dict]:
+        return self._collections.setdefault(collection_id, {})
+
+    async def _rpc(self):
+        self.counters.rpcs += 1
+        if self.rpc_latency > 0:
+            await asyncio.sleep(self.rpc_latency)
+        else:
+            # 実際のRPCと同じく他のタスクに実行を譲る
+            await asyncio.sleep(0)
+
+    async def _commit(self, ops):
+        """書き込みをアトミックに適用する（1つでも失敗すれば何も書かない）"""
+        from google.api_core.exceptions import Conflict, NotFound
+        await self._rpc()
+        async with self._commit_lock:
+            for kind, reference, _, _ in ops:
+                exists = reference.id in self._docs(reference.collection_id)
+                if kind == "update" and not exists:
+                    raise NotFound(f"No document to update: {reference.path}")
+                if kind == "create" and exists:
+                    raise Conflict(f"Document already exists: {reference.path}")
+            for kind, reference, data, merge in ops:
+                docs = self._docs(reference.collection_id)
+                if kind == "delete":
+                    docs.pop(reference.id, None)
+                elif kind == "update" or merge:
+                    # 既存のスナップショットが変わらないよう、辞書は置き換える
+                    docs[reference.id] = {**docs.get(reference.id, {}), **copy.deepcopy(data)}
+                else:
+                    docs[reference.id] = copy.deepcopy(data)
+                self._versions[reference._key()] = self._versions.get(reference._key(), 0) + 1
+            self.counters.writes += len(ops)
+
+    def collection(self, collection_id: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, collection_id)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    async def get_all(self, references, transaction=None):
+        """複数ドキュメントの取得（1RPCでまとめて読む）"""
+        await self._rpc()
+        for reference in references:
+            self.counters.reads += 1
+            if transaction is not None:
+                transaction._observe(reference)
+            yield FakeDocumentSnapshot(reference, self._docs(reference.collection_id).get(reference.id))
+
+    def transaction(self, max_attempts: int = 5) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts)
+
+    def seed(self, collection_id: str, documents: Dict[str, dict]):
+        """RPCを数えずにドキュメントを直接投入する（大規模リセットの事前データ用）"""
+        self._docs(collection_id).update(documents)
+
+    def count(self, collection_id: str) -> int:
+        return len(self._docs(collection_id))
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeGeminiModels:
+    """client.aio.models の代替。レイテンシは対数正規分布、一定割合で失敗する"""
+
+    def __init__(self, median_latency: float, sigma: float, error_rate: float, chunks: int, rng: random.Random):
+        self.median_latency = median_latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.chunks = max(1, chunks)
+        self.rng = rng
+        self.calls = 0
+        self.errors = 0
+
+    def _latency(self) -> float:
+        if self.median_latency <= 0:
+            return 0.0
+        return self.rng.lognormvariate(math.log(self.median_latency), self.sigma)
+
+    def _maybe_fail(self):
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("Simulated Gemini error")
+
+    @staticmethod
+    def _input_text(contents) -> str:
+        return contents[0].parts[0].text
+
+    @staticmethod
+    def _transform(text: str) -> str:
+        return f"{text}（やさしく言い換え）"
+
+    async def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        text = self._input_text(contents)
+        from gcp.gemini import BATCH_GENERATE_CONTENT_CONFIG
+        if config is BATCH_GENERATE_CONTENT_CONFIG:
+            return _FakeResponse(json.dumps([self._transform(item) for item in json.loads(text)], ensure_ascii=False))
+        return _FakeResponse(self._transform(text))
+
+    async def generate_content_stream(self, model, contents, config=None):
+        self.calls += 1
+        # 最初のチャンクまでに全体の半分、残りを均等に分けて返す
+        total = self._latency()
+        await asyncio.sleep(total / 2)
+        self._maybe_fail()
+        output = self._transform(self._input_text(contents))
+        size = max(1, math.ceil(len(output) / self.chunks))
+        pieces = [output[i:i + size] for i in range(0, len(output), size)]
+
+        async def stream():
+            for index, piece in enumerate(pieces):
+                if index:
+                    await asyncio.sleep(total / 2 / len(pieces))
+                yield _FakeResponse(piece)
+        return stream()
+
+class _FakeAio:
+    def __init__(self, models: FakeGeminiModels):
+        self.models = models
+
+class FakeGenaiClient:
+    """gcp.gemini._client に入れて使う genai.Client の代替"""
+
+    def __init__(self, median_latency: float = 0.8, sigma: float = 0.5, error_rate: float = 0.0,
+                 chunks: int = 4, seed: Optional[int] = None):
+        self.aio = _FakeAio(FakeGeminiModels(median_latency, sigma, error_rate, chunks, random.Random(seed)))
+
+    def stats(self) -> dict:
+        models = self.aio.models
+        return {"calls": models.calls, "errors": models.errors}
+
+class FakeWebSocket:
+    """websocket_manager.connect に渡す接続。受信したフレームと時刻を記録する"""
+    _ids = itertools.count()
+
+    def __init__(self, name: str = "", on_message=None, send_latency: float = 0.0):
+        self.name = name or f"ws{next(self._ids)}"
+        self.send_latency = send_latency
+        self.received = 0
+        self.closed = False
+        self._on_message = on_message
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, text: str):
+        if self.send_latency > 0:
+            await asyncio.sleep(self.send_latency)
+        self.received += 1
+        if self._on_message is not None:
+            self._on_message(self, json.loads(text), time.perf_counter())
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+
+def install_fake_redis(url: str = "redis://bench-standin/0"):
+    """fakeredisのクライアントを共有レジストリに登録する（未インストールならNone）
+
+    アプリのモジュールを読み込む前に呼び、返ったURLを REDIS_URL に設定して使う。
+    """
+    try:
+        from fakeredis import aioredis as fake_aioredis
+    except ImportError:
+        return None
+    from clients import clients
+    clients._redis[url] = fake_aioredis.FakeRedis(decode_responses=True)
+    return url
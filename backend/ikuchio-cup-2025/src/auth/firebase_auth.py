@@ -1,18 +1,128 @@
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import HTTPBearer
-from firebase_admin import auth, initialize_app, credentials
+from firebase_admin import auth
+from cache.tiered_cache import LRUCache
+from clients import clients
+import asyncio
+import hashlib
 import os
+import time
 
-# Firebase Admin初期化
-try:
-    initialize_app()
-    print("[Firebase] Admin SDK initialized successfully")
-except Exception as e:
-    print(f"[Firebase] Admin SDK initialization failed: {e}")
-    raise e  # Firebaseは必須なのでエラーで停止
-
+# Firebase Adminはlifespanのwarmup（または最初の検証時）に初期化する
 security = HTTPBearer()
 
+# 検証済みトークンのキャッシュ（プロセス内のみ。トークン自体ではなくダイジェストをキーにする）
+FIREBASE_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('FIREBASE_TOKEN_CACHE_MAX_ENTRIES', '10000'))
+# exp直前のトークンを使い続けないよう、有効期限より少し早めにキャッシュから外す
+FIREBASE_TOKEN_EXPIRY_SKEW_SECONDS = float(os.environ.get('FIREBASE_TOKEN_EXPIRY_SKEW_SECONDS', '30'))
+# Googleの署名用証明書を取り直す間隔（秒）
+FIREBASE_CERT_REFRESH_SECONDS = float(os.environ.get('FIREBASE_CERT_REFRESH_SECONDS', '3600'))
+# firebase_adminがIDトークンの検証に使う証明書のURL
+ID_TOKEN_CERT_URI = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+_token_cache = LRUCache(FIREBASE_TOKEN_CACHE_MAX_ENTRIES, ttl_seconds=3600)
+_token_cache_hits = 0
+_token_cache_misses = 0
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+async def _verify_token_cached(token: str) -> dict:
+    """キャッシュにあればそれを返し、なければスレッドで検証してexpまでキャッシュする"""
+    global _token_cache_hits, _token_cache_misses
+    key = _token_digest(token)
+    user_info = _token_cache.get(key)
+    if user_info is not None:
+        _token_cache_hits += 1
+        return dict(user_info)
+    _token_cache_misses += 1
+
+    # 署名検証と証明書の取得はブロッキングなのでイベントループの外で行う
+    app = await asyncio.to_thread(clients.firebase_app)
+    decoded_token = await asyncio.to_thread(auth.verify_id_token, token, app)
+    user_info = {
+        'firebase_uid': decoded_token['uid'],
+        'email': decoded_token.get('email'),
+        'email_verified': decoded_token.get('email_verified', False)
+    }
+    ttl = decoded_token.get('exp', 0) - time.time() - FIREBASE_TOKEN_EXPIRY_SKEW_SECONDS
+    if ttl > 0:
+        _token_cache.set(key, user_info, ttl_seconds=ttl)
+    print(f"[Firebase] Token verified successfully for UID: {decoded_token['uid']}")
+    return dict(user_info)
+
+def get_token_cache_stats() -> dict:
+    lookups = _token_cache_hits + _token_cache_misses
+    return {
+        "entries": len(_token_cache),
+        "hits": _token_cache_hits,
+        "misses": _token_cache_misses,
+        "hit_ratio": _token_cache_hits / lookups if lookups else 0.0,
+    }
+
+class CertificateRefresher:
+    """Googleの署名用証明書を定期的に取り直し、検証時に証明書の取得を待たないようにする"""
+
+    def __init__(self, interval_seconds: float = FIREBASE_CERT_REFRESH_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.running = False
+        self._task = None
+
+    def _get_request(self):
+        """firebase_adminのトークン検証器が持つHTTPリクエスト（証明書はこのセッションにキャッシュされる）
+
+        公開APIではないので、SDKの更新で見つからなくなった場合はNoneを返す。
+        """
+        try:
+            client = auth._get_client(clients.firebase_app())
+            request = client._token_verifier.request
+        except AttributeError:
+            return None
+        return request if callable(request) else None
+
+    def refresh(self) -> bool:
+        """キャッシュを無視して証明書を取得し、セッションのキャッシュを更新する
+
+        検証器のセッションが見つからない場合は何もせずFalseを返す。
+        """
+        request = self._get_request()
+        if request is None:
+            return False
+        response = request(ID_TOKEN_CERT_URI, method='GET', headers={'Cache-Control': 'no-cache'})
+        if response.status != 200:
+            raise RuntimeError(f"certificate fetch returned {response.status}")
+        return True
+
+    async def _loop(self):
+        while self.running:
+            try:
+                if not await asyncio.to_thread(self.refresh):
+                    # 取り直せなくても検証自体は証明書をその場で取得して動くので、更新だけ止める
+                    print("[Firebase] Warning: token verifier session is not available in this firebase_admin version, "
+                          "disabling certificate refresh")
+                    self.running = False
+                    self._task = None
+                    return
+                print("[Firebase] Signing certificates refreshed")
+            except Exception as e:
+                print(f"[Firebase] Failed to refresh signing certificates: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        self.running = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# グローバルインスタンス
+certificate_refresher = CertificateRefresher()
+
 async def verify_firebase_token(request: Request) -> dict:
     """Firebase IDトークンを検証してユーザー情報を返す"""
     auth_header = request.headers.get('Authorization')
@@ -21,17 +131,10 @@ async def verify_firebase_token(request: Request) -> dict:
         raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
     
     token = auth_header.split(' ')[1]
-    print(f"[Firebase] Attempting to verify token: {token[:20]}...")
     
     try:
         # Firebase IDトークンを検証
-        decoded_token = auth.verify_id_token(token)
-        print(f"[Firebase] Token verified successfully for UID: {decoded_token['uid']}")
-        return {
-            'firebase_uid': decoded_token['uid'],
-            'email': decoded_token.get('email'),
-            'email_verified': decoded_token.get('email_verified', False)
-        }
+        return await _verify_token_cached(token)
     except Exception as e:
         print(f"[Firebase] Token verification failed: {type(e).__name__}: {str(e)}")
         import traceback
@@ -44,4 +147,4 @@ async def get_current_user(request: Request) -> dict:
         return await verify_firebase_token(request)
     except HTTPException as e:
         print(f"[Firebase] Authentication failed: {e.detail}")
-        raise e
\ No newline at end of file
+        raise e
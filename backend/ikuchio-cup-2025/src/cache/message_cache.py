@@ -0,0 +1,82 @@
+import os
+from typing import List, Optional, Tuple
+from cache.tiered_cache import TieredCache, json_size
+
+# ルームごとに保持する直近ターン数（GET /api/room/{room_id} の1ページ分）
+MESSAGE_CACHE_WINDOW = int(os.environ.get('MESSAGE_CACHE_WINDOW', '100'))
+MESSAGE_CACHE_MAX_ROOMS = int(os.environ.get('MESSAGE_CACHE_MAX_ROOMS', '5000'))
+# プロセス内の値は他Podの書き込みを知らないので短めに保持し、Redisから取り直す
+MESSAGE_CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('MESSAGE_CACHE_LOCAL_TTL_SECONDS', '2'))
+MESSAGE_CACHE_REDIS_TTL_SECONDS = float(os.environ.get('MESSAGE_CACHE_REDIS_TTL_SECONDS', '3600'))
+
+def _turn_key(turn: dict) -> Tuple[str, str]:
+    return (turn.get("created_at", ""), turn.get("id", ""))
+
+class RoomMessageCache:
+    """ルームごとの直近ターン一覧（シリアライズ済み・created_at順）のキャッシュ
+
+    エントリは {"turns": [...], "complete": bool}。turnsは常に履歴の末尾（最新側）の
+    連続した範囲で、completeはルームの全履歴が入っていることを表す。エントリが
+    ない時に保存されたターンは1件だけのエントリを作り、Firestoreからの読み込み
+    結果とマージする（読み込みと保存が競合しても新しいターンを取りこぼさない）。
+    """
+
+    def __init__(self, window: int = MESSAGE_CACHE_WINDOW):
+        self.window = window
+        self.cache = TieredCache(
+            "room_messages",
+            max_entries=MESSAGE_CACHE_MAX_ROOMS,
+            ttl_seconds=MESSAGE_CACHE_LOCAL_TTL_SECONDS,
+            redis_ttl_seconds=MESSAGE_CACHE_REDIS_TTL_SECONDS,
+            sizeof=json_size,
+        )
+
+    async def get_latest(self, room_id: str, limit: int) -> Optional[List[dict]]:
+        """最新limit件（キャッシュで答えられない場合はNone）"""
+        entry = await self.cache.get(room_id)
+        if entry is None:
+            return None
+        turns = entry["turns"]
+        if limit > len(turns) and not entry["complete"]:
+            return None
+        return turns[-limit:]
+
+    async def get_since(self, room_id: str, since: dict, limit: int) -> Optional[List[dict]]:
+        """カーソルより後のターンを古い順にlimit件（キャッシュで答えられない場合はNone）"""
+        entry = await self.cache.get(room_id)
+        if entry is None:
+            return None
+        turns = entry["turns"]
+        cursor = (since["created_at"], since["id"])
+        # ウィンドウより古いカーソルは、全履歴を持っている時だけ答えられる
+        if turns and cursor < _turn_key(turns[0]) and not entry["complete"]:
+            return None
+        return [turn for turn in turns if _turn_key(turn) > cursor][:limit]
+
+    def _merge(self, entry: Optional[dict], turns: List[dict], complete: bool) -> dict:
+        merged = {turn.get("id"): turn for turn in (entry["turns"] if entry else [])}
+        for turn in turns:
+            merged[turn.get("id")] = turn
+        # 非同期ワーカーの完了順はcreated_at順とは限らない
+        ordered = sorted(merged.values(), key=_turn_key)
+        return {"turns": ordered[-self.window:], "complete": complete and len(ordered) <= self.window}
+
+    async def fill(self, room_id: str, turns: List[dict], complete: bool):
+        """Firestoreから読んだ最新ウィンドウをエントリにマージする"""
+        await self.cache.update(room_id, lambda entry: self._merge(entry, turns, complete))
+
+    async def append(self, room_id: str, turn: dict):
+        """保存したターンを反映する（ライトスルー）"""
+        await self.cache.update(room_id, lambda entry: self._merge(entry, [turn], entry is not None and entry["complete"]))
+
+    async def invalidate(self, room_id: str):
+        await self.cache.delete(room_id)
+
+    async def clear(self) -> int:
+        return await self.cache.clear()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+# グローバルインスタンス
+room_message_cache = RoomMessageCache()
@@ -0,0 +1,227 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+def json_size(value: Any) -> int:
+    """JSONにした時のバイト数（キャッシュのメモリ使用量の目安）"""
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+class LRUCache:
+    """TTL付きのプロセス内LRUキャッシュ
+
+    sizeofを渡すと各エントリのサイズを記録し、合計をsize_bytesで返す。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, _ = entry
+        if expires_at < time.monotonic():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        self.delete(key)
+        self._entries[key] = (time.monotonic() + ttl, value, size)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+class TieredCache:
+    """プロセス内LRU + Redisの2段キャッシュ
+
+    値はJSONでRedisに保存する。REDIS_URLが未設定、またはRedisが落ちている場合は
+    プロセス内キャッシュだけで動作する（Redisのエラーはミス扱い）。
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 10000, ttl_seconds: float = 3600,
+                 redis_ttl_seconds: Optional[float] = None, redis_url: Optional[str] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.namespace = namespace
+        self.local = LRUCache(max_entries, ttl_seconds, sizeof=sizeof)
+        self.redis_ttl_seconds = redis_ttl_seconds if redis_ttl_seconds is not None else ttl_seconds
+        self._redis_url = redis_url if redis_url is not None else os.environ.get('REDIS_URL')
+        self._redis = None
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    def _get_redis(self):
+        if self._redis is None and self._redis_url:
+            from clients import clients
+            self._redis = clients.redis(self._redis_url)
+        return self._redis
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                raw = await redis_client.get(self._redis_key(key))
+                if raw is not None:
+                    value = json.loads(raw)
+                    self.local.set(key, value)
+                    self.redis_hits += 1
+                    return value
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[Cache:{self.namespace}] Redis get failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        self.local.set(key, value)
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                await redis_client.set(self._redis_key(key), json.dumps(value, ensure_ascii=False),
+                                       ex=int(self.redis_ttl_seconds))
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[Cache:{self.namespace}] Redis set failed: {e}")
+
+    async def add(self, key: str, value: Any) -> bool:
+        """まだ値がない場合だけ保存する（読み込み結果で、並行した書き込みを上書きしないため）"""
+        redis_client = self._get_redis()
+        if redis_client is None:
+            if self.local.get(key) is not None:
+                return False
+            self.local.set(key, value)
+            return True
+        try:
+            added = await redis_client.set(self._redis_key(key), json.dumps(value, ensure_ascii=False),
+                                           ex=int(self.redis_ttl_seconds), nx=True)
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"[Cache:{self.namespace}] Redis add failed: {e}")
+            return False
+        if added:
+            self.local.set(key, value)
+        return bool(added)
+
+    async def set_many(self, items: dict):
+        """複数の値をまとめて保存する（Redisへは1回のパイプラインで送る）"""
+        for key, value in items.items():
+            self.local.set(key, value)
+        redis_client = self._get_redis()
+        if redis_client is None or not items:
+            return
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(self._redis_key(key), json.dumps(value, ensure_ascii=False), ex=int(self.redis_ttl_seconds))
+                await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"[Cache:{self.namespace}] Redis set_many failed: {e}")
+
+    async def update(self, key: str, updater: Callable[[Optional[Any]], Optional[Any]], retries: int = 3):
+        """現在値をupdaterで書き換える（Redis側はWATCHで他Podとの競合を検出して再試行）
+
+        updaterがNoneを返した場合は何もしない。競合が続いた場合はエントリを削除し、
+        次の読み込みで作り直させる。
+        """
+        redis_client = self._get_redis()
+        if redis_client is None:
+            value = updater(self.local.get(key))
+            if value is not None:
+                self.local.set(key, value)
+            return
+
+        from redis.exceptions import WatchError
+        redis_key = self._redis_key(key)
+        try:
+            for _ in range(retries):
+                try:
+                    async with redis_client.pipeline(transaction=True) as pipe:
+                        await pipe.watch(redis_key)
+                        raw = await pipe.get(redis_key)
+                        value = updater(json.loads(raw) if raw is not None else None)
+                        if value is None:
+                            self.local.delete(key)
+                            return
+                        pipe.multi()
+                        pipe.set(redis_key, json.dumps(value, ensure_ascii=False), ex=int(self.redis_ttl_seconds))
+                        await pipe.execute()
+                    self.local.set(key, value)
+                    return
+                except WatchError:
+                    continue
+            print(f"[Cache:{self.namespace}] Update of {key} kept conflicting, invalidating")
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"[Cache:{self.namespace}] Redis update failed: {e}")
+        await self.delete(key)
+
+    async def delete(self, key: str):
+        self.local.delete(key)
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                await redis_client.delete(self._redis_key(key))
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[Cache:{self.namespace}] Redis delete failed: {e}")
+
+    async def clear(self) -> int:
+        """このネームスペースのエントリを全て削除し、Redisから消した件数を返す"""
+        self.local.clear()
+        deleted = 0
+        redis_client = self._get_redis()
+        if redis_client is not None:
+            try:
+                async for redis_key in redis_client.scan_iter(match=self._redis_key("*"), count=1000):
+                    deleted += await redis_client.delete(redis_key)
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[Cache:{self.namespace}] Redis clear failed: {e}")
+        return deleted
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "local_entries": len(self.local),
+            "local_bytes": self.local.size_bytes,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "redis_errors": self.redis_errors,
+            "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,61 @@
+import os
+from typing import Iterable, Optional
+from cache.tiered_cache import TieredCache
+
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '20000'))
+# プロセス内の値は他Podでの割り当てを知らないので短めに保持し、Redisから取り直す
+USER_CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('USER_CACHE_LOCAL_TTL_SECONDS', '2'))
+USER_CACHE_REDIS_TTL_SECONDS = float(os.environ.get('USER_CACHE_REDIS_TTL_SECONDS', '86400'))
+
+def _to_cacheable(user_data: dict) -> dict:
+    # created_atはJSONにできないので文字列にしておく（APIの応答も同じ形になる）
+    data = dict(user_data)
+    if hasattr(data.get("created_at"), "isoformat"):
+        data["created_at"] = data["created_at"].isoformat()
+    return data
+
+class UserCache:
+    """エポックごとのユーザー（firebase_uid・room_id・created_at）のキャッシュ
+
+    キーにエポックを含めるので、エポックが切り替わると前のエポックの割り当ては
+    読まれなくなる（TTLで消える）。日次リセットは新しいエポックの割り当てを切り替え前に
+    put_manyで載せておく。ルームの割り当て・解除は書き込み後にput/put_manyで上書きする
+    （ライトスルー）。Firestoreから読んだ値はfillで「まだ値がない場合だけ」載せるので、
+    読み込み中に割り当てが行われても古いroom_idで上書きすることはない。
+    """
+
+    def __init__(self):
+        self.cache = TieredCache(
+            "users",
+            max_entries=USER_CACHE_MAX_ENTRIES,
+            ttl_seconds=USER_CACHE_LOCAL_TTL_SECONDS,
+            redis_ttl_seconds=USER_CACHE_REDIS_TTL_SECONDS,
+        )
+
+    @staticmethod
+    def _key(firebase_uid: str, epoch: str) -> str:
+        return f"{epoch}:{firebase_uid}"
+
+    async def get(self, firebase_uid: str, epoch: str) -> Optional[dict]:
+        return await self.cache.get(self._key(firebase_uid, epoch))
+
+    async def fill(self, user_data: dict, epoch: str):
+        await self.cache.add(self._key(user_data["firebase_uid"], epoch), _to_cacheable(user_data))
+
+    async def put(self, user_data: dict, epoch: str):
+        await self.cache.set(self._key(user_data["firebase_uid"], epoch), _to_cacheable(user_data))
+
+    async def put_many(self, users: Iterable[dict], epoch: str):
+        await self.cache.set_many({self._key(user["firebase_uid"], epoch): _to_cacheable(user) for user in users})
+
+    async def invalidate(self, firebase_uid: str, epoch: str):
+        await self.cache.delete(self._key(firebase_uid, epoch))
+
+    async def clear(self) -> int:
+        return await self.cache.clear()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+# グローバルインスタンス
+user_cache = UserCache()
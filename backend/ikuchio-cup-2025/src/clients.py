@@ -0,0 +1,141 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# プロセス起動（このモジュールの読み込み）からの経過時間で起動時間を測る
+PROCESS_STARTED_AT = time.monotonic()
+
+# 起動からreadyになるまでの目標時間（秒）。超えた場合は警告を出す
+STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '10'))
+# ウォームアップに失敗した依存先を再試行する間隔（秒）
+WARMUP_RETRY_SECONDS = float(os.environ.get('WARMUP_RETRY_SECONDS', '2'))
+
+FIRESTORE_PROJECT_ID = os.environ.get('GOOGLE_CLOUD_PROJECT', 'ikuchio-cup-2025')
+FIRESTORE_DATABASE_ID = 'ikuchio-cup-2025-dev'
+
+class ClientRegistry:
+    """外部サービスのクライアントをプロセスで1つずつ、最初に使う時に生成して共有する
+
+    モジュールの読み込み時にはクライアントを作らないので、認証情報がなくても
+    importできる。接続の確立はlifespanのwarmupで行い、完了するまでreadyにしない。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._firestore = None
+        self._sync_firestore = None
+        self._firebase_app = None
+        self._redis: Dict[str, object] = {}
+        self.ready = False
+        self.startup_seconds: Optional[float] = None
+        self.warmup_steps: Dict[str, dict] = {}
+
+    def firestore(self):
+        """共有のFirestore AsyncClient"""
+        if self._firestore is None:
+            with self._lock:
+                if self._firestore is None:
+                    from gcp.firestore import get_async_firestore_client
+                    self._firestore = get_async_firestore_client()
+        return self._firestore
+
+    def sync_firestore(self):
+        """同期版のFirestoreクライアント（スクリプト・テスト用）"""
+        if self._sync_firestore is None:
+            with self._lock:
+                if self._sync_firestore is None:
+                    from gcp.firestore import get_firestore_client
+                    self._sync_firestore = get_firestore_client()
+        return self._sync_firestore
+
+    def firebase_app(self):
+        """Firebase Admin SDKのデフォルトアプリ"""
+        if self._firebase_app is None:
+            with self._lock:
+                if self._firebase_app is None:
+                    import firebase_admin
+                    try:
+                        self._firebase_app = firebase_admin.get_app()
+                    except ValueError:
+                        self._firebase_app = firebase_admin.initialize_app()
+                        print("[Firebase] Admin SDK initialized successfully")
+        return self._firebase_app
+
+    def redis(self, url: Optional[str] = None):
+        """URLごとに1つの redis.asyncio クライアント（コネクションプールを共有）。URLがなければNone"""
+        url = url if url is not None else os.environ.get('REDIS_URL')
+        if not url:
+            return None
+        client = self._redis.get(url)
+        if client is None:
+            import redis.asyncio as aioredis
+            client = self._redis.setdefault(url, aioredis.from_url(url, decode_responses=True))
+        return client
+
+    async def _warm_firestore(self):
+        # 最初のRPCでgRPCチャネルと認証トークンが用意される
+        await self.firestore().collection("users").limit(1).get()
+
+    async def _warm_firebase(self):
+        await asyncio.to_thread(self.firebase_app)
+
+    async def _warm_redis(self):
+        client = self.redis()
+        if client is not None:
+            await client.ping()
+
+    async def _warm_gemini(self):
+        # Secret Manager参照はブロッキングなのでスレッドで実行
+        from gcp.gemini import warmup as gemini_warmup
+        await asyncio.to_thread(gemini_warmup)
+
+    async def _run_step(self, name: str, step):
+        """1つの依存先を成功するまで再試行する"""
+        attempts = 0
+        while True:
+            attempts += 1
+            started_at = time.monotonic()
+            try:
+                await step()
+                self.warmup_steps[name] = {"ok": True, "seconds": round(time.monotonic() - started_at, 3), "attempts": attempts}
+                return
+            except Exception as e:
+                self.warmup_steps[name] = {"ok": False, "error": str(e), "attempts": attempts}
+                print(f"[Startup] Warm-up of {name} failed (attempt {attempts}): {e}")
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+    async def warmup(self):
+        """全クライアントを並行して準備し、揃ったらreadyにする"""
+        from db.storage import storage
+        if storage.name != 'firestore':
+            steps = {}
+        else:
+            steps = {"firestore": self._warm_firestore}
+        steps.update({"firebase": self._warm_firebase, "redis": self._warm_redis, "gemini": self._warm_gemini})
+        await asyncio.gather(*(self._run_step(name, step) for name, step in steps.items()))
+
+        self.startup_seconds = time.monotonic() - PROCESS_STARTED_AT
+        self.ready = True
+        if self.startup_seconds > STARTUP_BUDGET_SECONDS:
+            print(f"[Startup] Ready after {self.startup_seconds:.2f}s, over the {STARTUP_BUDGET_SECONDS:.0f}s budget: {self.warmup_steps}")
+        else:
+            print(f"[Startup] Ready after {self.startup_seconds:.2f}s (budget {STARTUP_BUDGET_SECONDS:.0f}s)")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "startup_seconds": round(self.startup_seconds, 3) if self.startup_seconds is not None else None,
+            "startup_budget_seconds": STARTUP_BUDGET_SECONDS,
+            "steps": self.warmup_steps,
+        }
+
+class LazyFirestore:
+    """属性アクセス時に共有クライアントへ委譲する（モジュールレベルの db を遅延させる）"""
+
+    def __getattr__(self, name):
+        return getattr(clients.firestore(), name)
+
+# グローバルインスタンス
+clients = ClientRegistry()
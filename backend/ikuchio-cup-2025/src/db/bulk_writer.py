@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Firestoreの1コミットあたりの書き込み上限
+MAX_BATCH_SIZE = 500
+
+# 一括処理の既定値（環境変数で調整可能）
+BULK_PAGE_SIZE = int(os.environ.get('FIRESTORE_BULK_PAGE_SIZE', '500'))
+BULK_CONCURRENCY = int(os.environ.get('FIRESTORE_BULK_CONCURRENCY', '8'))
+BULK_PROGRESS_INTERVAL = float(os.environ.get('FIRESTORE_BULK_PROGRESS_INTERVAL', '2.0'))
+
+async def iter_pages(query, page_size: int = BULK_PAGE_SIZE):
+    """クエリ結果をドキュメントID順のページ単位で取得する（全件をメモリに載せない）"""
+    query = query.order_by(FieldPath.document_id()).limit(page_size)
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        docs = await page_query.get()
+        if not docs:
+            return
+        yield docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+class BatchWriter:
+    """書き込みをバッチにまとめ、同時コミット数を制限して並列に流す
+
+    コミット待ちのバッチがconcurrencyに達すると書き込み側が待たされるため、
+    メモリ使用量はconcurrency * batch_size件分で頭打ちになる。
+    """
+
+    def __init__(self, db, label: str, batch_size: int = MAX_BATCH_SIZE, concurrency: int = BULK_CONCURRENCY):
+        self.db = db
+        self.label = label
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._batch = db.batch()
+        self._pending_ops = 0
+        self._tasks = set()
+        self._started_at = time.monotonic()
+        self._last_report = self._started_at
+        self.committed_ops = 0
+        self.failed_ops = 0
+        self.commits = 0
+
+    async def set(self, ref, data: dict):
+        await self.write_group([("set", ref, data)])
+
+    async def update(self, ref, data: dict):
+        await self.write_group([("update", ref, data)])
+
+    async def create(self, ref, data: dict):
+        """存在しない場合だけ書く（既にあればそのバッチ全体が失敗し、failed_opsに数えられる）"""
+        await self.write_group([("create", ref, data)])
+
+    async def delete(self, ref):
+        await self.write_group([("delete", ref, None)])
+
+    async def write_group(self, ops):
+        """同じバッチで（=アトミックに）コミットされるべき書き込みをまとめて追加"""
+        if self._pending_ops + len(ops) > self.batch_size:
+            await self._flush()
+        for op, ref, data in ops:
+            if op == "set":
+                self._batch.set(ref, data)
+            elif op == "update":
+                self._batch.update(ref, data)
+            elif op == "create":
+                self._batch.create(ref, data)
+            elif op == "delete":
+                self._batch.delete(ref)
+            else:
+                raise ValueError(f"Unknown write operation: {op}")
+        self._pending_ops += len(ops)
+        if self._pending_ops >= self.batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending_ops:
+            return
+        batch, count = self._batch, self._pending_ops
+        self._batch = self.db.batch()
+        self._pending_ops = 0
+
+        # 同時コミット数の上限に達していればここで待つ（バックプレッシャー）
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._commit(batch, count))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _commit(self, batch, count: int):
+        try:
+            await batch.commit()
+            self.committed_ops += count
+            self.commits += 1
+        except Exception as e:
+            self.failed_ops += count
+            print(f"[BulkWrite:{self.label}] Batch commit failed ({count} ops): {e}")
+        finally:
+            self._semaphore.release()
+        self._report_progress()
+
+    def _report_progress(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_report < BULK_PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        stats = self.stats()
+        print(f"[BulkWrite:{self.label}] {stats['committed_ops']} ops committed, {stats['failed_ops']} failed, "
+              f"{stats['ops_per_second']:.0f} ops/s, {stats['elapsed_seconds']:.1f}s elapsed")
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started_at
+        return {
+            "committed_ops": self.committed_ops,
+            "failed_ops": self.failed_ops,
+            "commits": self.commits,
+            "elapsed_seconds": round(elapsed, 3),
+            "ops_per_second": self.committed_ops / elapsed if elapsed > 0 else 0.0,
+        }
+
+    async def close(self) -> dict:
+        """残りのバッチをコミットし、全コミットの完了を待って統計を返す"""
+        await self._flush()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        self._report_progress(force=True)
+        return self.stats()
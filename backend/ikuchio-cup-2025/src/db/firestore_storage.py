@@ -0,0 +1,484 @@
+import asyncio
+import os
+import time
+from clients import LazyFirestore
+from typing import List, Optional, Tuple
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
+from db.bulk_writer import BatchWriter, iter_pages
+from db.storage import Storage, serialize_turn, MESSAGE_PAGE_SIZE, INITIAL_EPOCH
+from cache.message_cache import room_message_cache
+from cache.tiered_cache import LRUCache
+from cache.user_cache import user_cache
+from metrics import observe_db
+
+# 他Podでのエポック切り替えに気付くまでの最大秒数（ポインタのドキュメントを読み直す間隔）
+EPOCH_CACHE_SECONDS = float(os.environ.get('EPOCH_CACHE_SECONDS', '1'))
+
+# ルームIDと所属エポックの対応をプロセス内に持つ件数（ルームのエポックは後から変わらない）
+ROOM_EPOCH_CACHE_MAX_ENTRIES = int(os.environ.get('ROOM_EPOCH_CACHE_MAX_ENTRIES', '50000'))
+
+# 組み合わせの索引を分割して保存する1ドキュメントあたりのバイト数（Firestoreの上限は1MiB）
+PAIR_HISTORY_CHUNK_BYTES = int(os.environ.get('PAIR_HISTORY_CHUNK_BYTES', '900000'))
+
+# 共有クライアントは最初のアクセス時に生成される
+db = LazyFirestore()
+
+def _user_doc_id(firebase_uid: str) -> str:
+    return f"user_{firebase_uid}"
+
+def _assignment_ref(epoch: str, firebase_uid: str):
+    return db.collection("assignments").document(f"{epoch}_{_user_doc_id(firebase_uid)}")
+
+def _assignment(epoch: str, user: dict, room_id: Optional[str]) -> dict:
+    """エポックでの割り当て（ユーザーの辞書をそのまま返せるようcreated_atも持つ）"""
+    return {"firebase_uid": user["firebase_uid"], "created_at": user.get("created_at"), "room_id": room_id, "epoch": epoch}
+
+def _user_view(data: dict, room_id: Optional[str]) -> dict:
+    return {"firebase_uid": data.get("firebase_uid"), "created_at": data.get("created_at"), "room_id": room_id}
+
+def _legacy_room_id(epoch: str, user_data: dict) -> Optional[str]:
+    """エポック導入前に users.room_id に書かれた割り当て
+
+    導入前のデータは初期エポックのものなので、初期エポックの間だけ有効（移行が済むまでの代わり）。
+    """
+    return user_data.get("room_id") if epoch == INITIAL_EPOCH else None
+
+@firestore.async_transactional
+async def _assign_pair_in_transaction(transaction, epoch: str, user_ids: Tuple[str, str], room_data: dict):
+    # 削除済み・割り当て済みのユーザーはマッチング対象外
+    available = []
+    for firebase_uid in user_ids:
+        assignment_doc = await _assignment_ref(epoch, firebase_uid).get(transaction=transaction)
+        if assignment_doc.exists:
+            assignment = assignment_doc.to_dict() or {}
+            if not assignment.get("room_id"):
+                available.append(_user_view(assignment, None))
+            continue
+        # このエポックの割り当てがないユーザー（エポック導入前の登録）はユーザーのドキュメントで確認する
+        user_doc = await db.collection("users").document(_user_doc_id(firebase_uid)).get(transaction=transaction)
+        user_data = user_doc.to_dict() or {} if user_doc.exists else {}
+        if user_data.get("firebase_uid") and not _legacy_room_id(epoch, user_data):
+            available.append(_user_view(user_data, None))
+    if len(available) < 2:
+        return None, available
+
+    transaction.set(db.collection("rooms").document(room_data["id"]), {**room_data, "epoch": epoch})
+    for user in available:
+        transaction.set(_assignment_ref(epoch, user["firebase_uid"]), _assignment(epoch, user, room_data["id"]))
+    return room_data, [{**user, "room_id": room_data["id"]} for user in available]
+
+class FirestoreStorage(Storage):
+    """Firestore上のusers・assignments・rooms・turns・pending_turnsコレクション
+
+    ユーザーのルーム割り当てはエポックごとのassignmentsドキュメント、現在のエポックは
+    meta/epochs ドキュメント1件で持つ。ユーザーとルームの直近ターンはキャッシュ
+    （プロセス内＋Redis）から返し、書き込み時にキャッシュへも反映する。
+    """
+    name = "firestore"
+
+    def __init__(self):
+        self._epochs: Optional[dict] = None
+        self._epochs_loaded_at = 0.0
+        self._legacy_migrated = False
+        self._room_epochs = LRUCache(ROOM_EPOCH_CACHE_MAX_ENTRIES, ttl_seconds=86400)
+
+    # エポック
+    async def _load_epochs(self, force: bool = False) -> dict:
+        if force or self._epochs is None or time.monotonic() - self._epochs_loaded_at >= EPOCH_CACHE_SECONDS:
+            epoch_doc = await db.collection("meta").document("epochs").get()
+            self._epochs = {"current": INITIAL_EPOCH, "next": None, "retired": [], **(epoch_doc.to_dict() or {})}
+            self._epochs_loaded_at = time.monotonic()
+        return self._epochs
+
+    async def _save_epochs(self, epochs: dict):
+        await db.collection("meta").document("epochs").set(epochs)
+        self._epochs = epochs
+        self._epochs_loaded_at = time.monotonic()
+
+    async def get_current_epoch(self) -> str:
+        return (await self._load_epochs())["current"]
+
+    async def get_epochs(self) -> dict:
+        epochs = await self._load_epochs()
+        return {**epochs, "retired": list(epochs["retired"])}
+
+    async def prepare_epoch(self, epoch: str):
+        epochs = await self._load_epochs(force=True)
+        await self._save_epochs({**epochs, "next": epoch})
+
+    async def activate_epoch(self, epoch: str) -> dict:
+        epochs = await self._load_epochs(force=True)
+        retired = list(epochs["retired"])
+        if epochs["current"] != epoch and epochs["current"] not in retired:
+            retired.append(epochs["current"])
+        # 切り替えはこのドキュメント1件の書き込みだけ（データ量に関係なく一定時間）
+        await self._save_epochs({
+            "current": epoch,
+            "next": None if epochs["next"] == epoch else epochs["next"],
+            "retired": retired,
+        })
+        return await self.get_epochs()
+
+    async def collect_epoch(self, epoch: str, pause_seconds: float = 0.0) -> dict:
+        epochs = await self._load_epochs(force=True)
+        if epoch == epochs["current"]:
+            raise ValueError(f"Cannot collect the current epoch: {epoch}")
+        if epoch == INITIAL_EPOCH:
+            # epochのないルーム・ターンは移行で初期エポックにしてからでないと削除できない
+            await self.migrate_legacy_data()
+        stats = {}
+        for collection_name in ("rooms", "turns", "assignments"):
+            # 削除するルームの履歴キャッシュも捨てる
+            on_delete = self._forget_room if collection_name == "rooms" else None
+            stats[collection_name] = await _delete_epoch_documents(collection_name, epoch, pause_seconds, on_delete)
+        epochs = await self._load_epochs(force=True)
+        await self._save_epochs({**epochs, "retired": [retired for retired in epochs["retired"] if retired != epoch]})
+        return stats
+
+    # ユーザー
+    async def get_user(self, firebase_uid: str) -> Optional[dict]:
+        epoch = await self.get_current_epoch()
+        cached_user = await user_cache.get(firebase_uid, epoch)
+        if cached_user:
+            return cached_user
+
+        assignment_doc = await _assignment_ref(epoch, firebase_uid).get()
+        if assignment_doc.exists:
+            assignment = assignment_doc.to_dict()
+            user_data = _user_view(assignment, assignment.get("room_id"))
+        else:
+            user_doc = await db.collection("users").document(_user_doc_id(firebase_uid)).get()
+            if not user_doc.exists:
+                print(f"Debug: User {_user_doc_id(firebase_uid)} not found")
+                return None
+            user_data = user_doc.to_dict() or {}
+            user_data = _user_view(user_data, _legacy_room_id(epoch, user_data))
+        print(f"Debug: Retrieved user {_user_doc_id(firebase_uid)} with room_id: {user_data['room_id']} in epoch {epoch}")
+        if user_data.get("firebase_uid"):
+            await user_cache.fill(user_data, epoch)
+        return user_data
+
+    async def get_cached_user(self, firebase_uid: str) -> Optional[dict]:
+        return await user_cache.get(firebase_uid, await self.get_current_epoch())
+
+    async def create_user(self, user_data: dict) -> bool:
+        # 存在しない場合だけ成功するユーザー作成と、現在・準備中のエポックの割り当てを1回のコミットで行う
+        epochs = await self._load_epochs()
+        batch = db.batch()
+        batch.create(db.collection("users").document(_user_doc_id(user_data["firebase_uid"])),
+                     {"firebase_uid": user_data["firebase_uid"], "created_at": user_data.get("created_at")})
+        batch.set(_assignment_ref(epochs["current"], user_data["firebase_uid"]),
+                  _assignment(epochs["current"], user_data, user_data.get("room_id")))
+        if epochs["next"]:
+            batch.set(_assignment_ref(epochs["next"], user_data["firebase_uid"]), _assignment(epochs["next"], user_data, None))
+        try:
+            await batch.commit()
+        except Conflict:
+            return False
+        await user_cache.put(user_data, epochs["current"])
+        return True
+
+    async def list_users(self) -> List[dict]:
+        epoch = await self.get_current_epoch()
+        room_ids = {}
+        async for doc in db.collection("assignments").where("epoch", "==", epoch).stream():
+            assignment = doc.to_dict()
+            if assignment:
+                room_ids[assignment["firebase_uid"]] = assignment.get("room_id")
+        users = []
+        async for doc in db.collection("users").stream():
+            user_data = doc.to_dict()
+            if user_data:
+                firebase_uid = user_data.get("firebase_uid")
+                room_id = room_ids[firebase_uid] if firebase_uid in room_ids else _legacy_room_id(epoch, user_data)
+                users.append(_user_view(user_data, room_id))
+        return users
+
+    async def find_unassigned_users(self, limit: int) -> List[dict]:
+        epoch = await self.get_current_epoch()
+        docs = await db.collection("assignments").where("epoch", "==", epoch).where("room_id", "==", None).limit(limit).get()
+        return [_user_view(doc.to_dict(), None) for doc in docs if (doc.to_dict() or {}).get("firebase_uid")]
+
+    # ルーム
+    async def get_room(self, room_id: str) -> Optional[dict]:
+        room_doc = await db.collection("rooms").document(room_id).get()
+        if not room_doc.exists:
+            return None
+        room_data = room_doc.to_dict()
+        # 前のエポックのルームは削除されるまでの間も見せない（epochのないルームはエポック導入前のもの）
+        return room_data if room_data.get("epoch", INITIAL_EPOCH) == await self.get_current_epoch() else None
+
+    async def is_current_room(self, room_id: str) -> bool:
+        """ルームのエポックはプロセス内に覚えておき、2回目からは読まずに現在のエポックと比べる"""
+        room_epoch = self._room_epochs.get(room_id)
+        if room_epoch is None:
+            room_doc = await db.collection("rooms").document(room_id).get()
+            if not room_doc.exists:
+                return False
+            room_epoch = (room_doc.to_dict() or {}).get("epoch", INITIAL_EPOCH)
+            self._room_epochs.set(room_id, room_epoch)
+        return room_epoch == await self.get_current_epoch()
+
+    async def _forget_room(self, room_id: str):
+        self._room_epochs.delete(room_id)
+        await room_message_cache.invalidate(room_id)
+
+    async def list_rooms(self) -> List[dict]:
+        epoch = await self.get_current_epoch()
+        rooms = []
+        async for doc in db.collection("rooms").where("epoch", "==", epoch).stream():
+            room_data = doc.to_dict()
+            if room_data:
+                rooms.append(room_data)
+        return rooms
+
+    async def list_rooms_for_user(self, firebase_uid: str) -> List[dict]:
+        """roomsコレクションに (users, epoch) の複合インデックスが必要（firestore.indexes.json）"""
+        epoch = await self.get_current_epoch()
+        docs = await db.collection("rooms").where("users", "array_contains", _user_doc_id(firebase_uid)).where("epoch", "==", epoch).get()
+        return [doc.to_dict() for doc in docs]
+
+    async def create_room(self, room_data: dict, users: List[dict]):
+        # ルーム作成とユーザーへのルームID割り当てを1回のコミットで行う
+        epoch = await self.get_current_epoch()
+        batch = db.batch()
+        batch.set(db.collection("rooms").document(room_data["id"]), {**room_data, "epoch": epoch})
+        for user in users:
+            batch.set(_assignment_ref(epoch, user["firebase_uid"]), _assignment(epoch, user, room_data["id"]))
+        await batch.commit()
+        await user_cache.put_many([{**user, "room_id": room_data["id"]} for user in users], epoch)
+
+    async def assign_pair(self, user1_id: str, user2_id: str, room_data: dict) -> Tuple[Optional[dict], List[dict]]:
+        epoch = await self.get_current_epoch()
+        room, users = await _assign_pair_in_transaction(db.transaction(), epoch, (user1_id, user2_id), room_data)
+        if room:
+            # コミット後に両ユーザーの割り当てをキャッシュへ反映
+            await user_cache.put_many(users, epoch)
+        return room, users
+
+    async def save_turn(self, turn_data: dict, pending: bool = False):
+        turn_id = turn_data["id"]
+        # 削除対象のエポックを見分けるため、保存した時点のエポックを付けておく
+        turn_data = {**turn_data, "epoch": await self.get_current_epoch()}
+        if pending:
+            batch = db.batch()
+            batch.set(db.collection("turns").document(turn_id), turn_data)
+            batch.delete(db.collection("pending_turns").document(turn_id))
+            await batch.commit()
+        else:
+            await db.collection("turns").document(turn_id).set(turn_data)
+        # 履歴キャッシュにも反映（失敗してもキャッシュ側で無効化されるだけ）
+        await room_message_cache.append(turn_data["room_id"], serialize_turn(dict(turn_data)))
+
+    async def get_turn(self, turn_id: str) -> Optional[dict]:
+        turn_doc = await db.collection("turns").document(turn_id).get()
+        return serialize_turn(turn_doc.to_dict()) if turn_doc.exists else None
+
+    async def get_turns(self, room_id: str, since: Optional[dict] = None, before: Optional[dict] = None,
+                        limit: int = MESSAGE_PAGE_SIZE) -> List[dict]:
+        """最新・差分取得はルームの直近ターンのキャッシュから返し、なければ直近1ページを読んで載せる
+
+        turnsコレクションに (room_id, created_at, id) の複合インデックスが必要（firestore.indexes.json）
+        """
+        if not before:
+            cached = await self._get_cached_turns(room_id, since, limit)
+            if cached is None:
+                latest = await _query_turns(room_id, None, None, MESSAGE_PAGE_SIZE)
+                await room_message_cache.fill(room_id, latest, complete=len(latest) < MESSAGE_PAGE_SIZE)
+                cached = await self._get_cached_turns(room_id, since, limit)
+            if cached is not None:
+                return cached
+        return await _query_turns(room_id, since, before, limit)
+
+    async def _get_cached_turns(self, room_id: str, since: Optional[dict], limit: int):
+        if since is not None:
+            return await room_message_cache.get_since(room_id, since, limit)
+        return await room_message_cache.get_latest(room_id, limit)
+
+    async def create_pending_turn(self, pending_data: dict):
+        await db.collection("pending_turns").document(pending_data["id"]).set(pending_data)
+
+    async def get_pending_turn(self, turn_id: str) -> Optional[dict]:
+        pending_doc = await db.collection("pending_turns").document(turn_id).get()
+        return pending_doc.to_dict() if pending_doc.exists else None
+
+    async def fail_pending_turn(self, turn_id: str, error: str):
+        await db.collection("pending_turns").document(turn_id).update({"status": "failed", "error": error})
+
+    # 日次リセット
+    async def list_users_for_reset(self) -> List[dict]:
+        """firebase_uidのないユーザーは割り当ての対象にしない"""
+        users = []
+        async for docs in iter_pages(db.collection("users").select(["firebase_uid", "created_at"])):
+            for user_doc in docs:
+                user_data = user_doc.to_dict()
+                if user_data and user_data.get("firebase_uid"):
+                    users.append({"firebase_uid": user_data["firebase_uid"], "created_at": user_data.get("created_at")})
+        return users
+
+    async def write_assignments(self, epoch: str, rooms: List[dict], users: List[dict]) -> dict:
+        """ルームと2人の割り当ては同じバッチに入れ、各ユーザーへの書き込みは1回だけにする"""
+        rooms_ref = db.collection("rooms")
+        users_by_doc_id = {_user_doc_id(user["firebase_uid"]): user for user in users}
+        writer = BatchWriter(db, "assign:users")
+        for room_data in rooms:
+            await writer.write_group(
+                [("set", rooms_ref.document(room_data["id"]), {**room_data, "epoch": epoch})]
+                + [
+                    ("set", _assignment_ref(epoch, users_by_doc_id[user_doc_id]["firebase_uid"]),
+                     _assignment(epoch, users_by_doc_id[user_doc_id], room_data["id"]))
+                    for user_doc_id in room_data["users"]
+                ]
+            )
+        for user in users:
+            if user.get("room_id") is None:
+                await writer.set(_assignment_ref(epoch, user["firebase_uid"]), _assignment(epoch, user, None))
+        stats = await writer.close()
+
+        # 新しいエポックの割り当てを切り替え前にキャッシュへ載せておく（失敗したバッチがあれば載せない）
+        if not stats.get("failed_ops"):
+            await user_cache.put_many(users, epoch)
+        return stats
+
+    async def load_pair_history(self) -> Optional[bytes]:
+        """pair_history/meta のチャンク数だけ chunk_{i} を読んで連結する"""
+        history_ref = db.collection("pair_history")
+        meta_doc = await history_ref.document("meta").get()
+        meta = meta_doc.to_dict() if meta_doc.exists else None
+        if not meta:
+            return None
+        refs = [history_ref.document(f"chunk_{index}") for index in range(meta["chunks"])]
+        chunks = {}
+        async for chunk_doc in db.get_all(refs):
+            if chunk_doc.exists:
+                chunks[chunk_doc.id] = (chunk_doc.to_dict() or {}).get("data", b"")
+        data = b"".join(chunks.get(ref.id, b"") for ref in refs)
+        if len(data) != meta["size"]:
+            print(f"[Firestore] Pair history is incomplete: {len(data)} of {meta['size']} bytes")
+            return None
+        return data
+
+    async def save_pair_history(self, data: bytes):
+        """チャンクとmetaを1つのバッチで書き、読み手が新旧の混ざった索引を見ないようにする"""
+        history_ref = db.collection("pair_history")
+        meta_doc = await history_ref.document("meta").get()
+        previous_chunks = (meta_doc.to_dict() or {}).get("chunks", 0) if meta_doc.exists else 0
+        chunks = [data[offset:offset + PAIR_HISTORY_CHUNK_BYTES] for offset in range(0, len(data), PAIR_HISTORY_CHUNK_BYTES)]
+        batch = db.batch()
+        for index, chunk in enumerate(chunks):
+            batch.set(history_ref.document(f"chunk_{index}"), {"data": chunk})
+        # 前回より小さくなった場合は余ったチャンクを消す
+        for index in range(len(chunks), previous_chunks):
+            batch.delete(history_ref.document(f"chunk_{index}"))
+        batch.set(history_ref.document("meta"), {"chunks": len(chunks), "size": len(data)})
+        await batch.commit()
+
+    # エポック導入前のデータ
+    async def migrate_legacy_data(self) -> dict:
+        """エポック導入前のデータを初期エポックのものとして書き直す（済んでいれば何もしない）
+
+        現在が初期エポックなら、割り当てのないユーザーに users.room_id から割り当てを作る
+        （既にある割り当ては上書きしない）。epochのないルームとターンにはINITIAL_EPOCHを付け、
+        初期エポックの削除で消えるようにする。書き込みに失敗したバッチがあれば例外を送出し、
+        次の呼び出しで残りをやり直す。
+        """
+        if self._legacy_migrated:
+            return {}
+        migration_ref = db.collection("meta").document("migrations")
+        migration_doc = await migration_ref.get()
+        if migration_doc.exists and (migration_doc.to_dict() or {}).get("epochs"):
+            self._legacy_migrated = True
+            return {}
+        epochs = await self._load_epochs(force=True)
+        stats = {}
+        if epochs["current"] == INITIAL_EPOCH:
+            stats["assignments"] = await _backfill_initial_assignments()
+        for collection_name in ("rooms", "turns"):
+            stats[collection_name] = await _tag_legacy_documents(collection_name)
+        failed_ops = sum(collection_stats.get("failed_ops", 0) for collection_stats in stats.values())
+        if failed_ops:
+            raise RuntimeError(f"{failed_ops} writes failed while migrating pre-epoch data")
+
+        tagged = stats["rooms"].get("committed_ops", 0) + stats["turns"].get("committed_ops", 0)
+        epochs = await self._load_epochs(force=True)
+        if tagged and epochs["current"] != INITIAL_EPOCH and INITIAL_EPOCH not in epochs["retired"]:
+            # 初期エポックの削除が移行より先に終わっていた場合は、もう一度削除待ちにする
+            await self._save_epochs({**epochs, "retired": [INITIAL_EPOCH] + list(epochs["retired"])})
+        await migration_ref.set({"epochs": True})
+        self._legacy_migrated = True
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "epoch": self._epochs["current"] if self._epochs else None,
+            "message_cache": room_message_cache.stats(),
+            "user_cache": user_cache.stats(),
+        }
+
+@observe_db("rooms.query_messages")
+async def _query_turns(room_id: str, since: Optional[dict], before: Optional[dict], limit: int):
+    turns_ref = db.collection("turns")
+    query = turns_ref.where("room_id", "==", room_id)
+
+    if since:
+        # 差分取得: 最新状態のクライアントは空の結果（1読み取り）になる
+        query = query.order_by("created_at").order_by("id").start_after(since)
+        newest_first = False
+    else:
+        query = query.order_by("created_at", direction=firestore.Query.DESCENDING).order_by("id", direction=firestore.Query.DESCENDING)
+        if before:
+            query = query.start_after(before)
+        newest_first = True
+
+    messages = []
+    async for doc in query.limit(limit).stream():
+        data = doc.to_dict()
+        if data:
+            messages.append(serialize_turn(data))
+
+    if newest_first:
+        messages.reverse()
+    return messages
+
+async def _backfill_initial_assignments() -> dict:
+    """初期エポックの割り当てがないユーザーに、users.room_id をもとに割り当てを作る"""
+    assigned = set()
+    async for docs in iter_pages(db.collection("assignments").where("epoch", "==", INITIAL_EPOCH).select(["firebase_uid"])):
+        assigned.update((doc.to_dict() or {}).get("firebase_uid") for doc in docs)
+    writer = BatchWriter(db, "migrate:assignments")
+    async for docs in iter_pages(db.collection("users").select(["firebase_uid", "created_at", "room_id"])):
+        for doc in docs:
+            user_data = doc.to_dict() or {}
+            if user_data.get("firebase_uid") and user_data["firebase_uid"] not in assigned:
+                # 読んだ後にマッチングで割り当てが作られていても上書きしない
+                await writer.create(_assignment_ref(INITIAL_EPOCH, user_data["firebase_uid"]),
+                                    _assignment(INITIAL_EPOCH, user_data, user_data.get("room_id")))
+    return await writer.close()
+
+async def _tag_legacy_documents(collection_name: str) -> dict:
+    """epochのないドキュメントにINITIAL_EPOCHを付ける（フィールドがないことでは検索できないので全件見る）"""
+    writer = BatchWriter(db, f"migrate:{collection_name}")
+    async for docs in iter_pages(db.collection(collection_name).select(["epoch"])):
+        for doc in docs:
+            if not (doc.to_dict() or {}).get("epoch"):
+                await writer.update(doc.reference, {"epoch": INITIAL_EPOCH})
+    return await writer.close()
+
+async def _delete_epoch_documents(collection_name: str, epoch: str, pause_seconds: float, on_delete=None) -> dict:
+    """エポックのドキュメントをページごとにバッチ削除する（ページごとにpause_seconds待つ）
+
+    on_deleteを渡すと、削除する各ドキュメントのIDで呼び出す。
+    """
+    writer = BatchWriter(db, f"collect:{collection_name}")
+    # IDだけ取得すれば削除できるので本文は読まない
+    query = db.collection(collection_name).where("epoch", "==", epoch).select(["epoch"])
+    async for docs in iter_pages(query):
+        for doc in docs:
+            await writer.delete(doc.reference)
+            if on_delete is not None:
+                await on_delete(doc.id)
+        if pause_seconds > 0:
+            await asyncio.sleep(pause_seconds)
+    return await writer.close()
@@ -0,0 +1,338 @@
+import bisect
+import itertools
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from db.storage import Storage, serialize_turn, MESSAGE_PAGE_SIZE, INITIAL_EPOCH
+
+USER_DOC_PREFIX = "user_"
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+class UserRecord:
+    __slots__ = ("firebase_uid", "created_at")
+
+    def __init__(self, firebase_uid: str, created_at=None):
+        self.firebase_uid = firebase_uid
+        self.created_at = created_at
+
+    def to_dict(self, room_id: Optional[str]) -> dict:
+        return {"firebase_uid": self.firebase_uid, "created_at": self.created_at, "room_id": room_id}
+
+class RoomRecord:
+    __slots__ = ("id", "created_at", "users", "epoch")
+
+    def __init__(self, room_id: str, created_at, users: Tuple[str, ...], epoch: str):
+        self.id = room_id
+        self.created_at = created_at
+        self.users = users
+        self.epoch = epoch
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "created_at": self.created_at, "users": list(self.users), "epoch": self.epoch}
+
+class TurnRecord:
+    __slots__ = ("id", "room_id", "original_sender_id", "original_text", "processed_text", "created_at", "processed_at", "epoch")
+
+    def __init__(self, data: dict, epoch: str):
+        self.epoch = epoch
+        self.id = data["id"]
+        self.room_id = data["room_id"]
+        self.original_sender_id = data.get("original_sender_id", "")
+        self.original_text = data.get("original_text", "")
+        self.processed_text = data.get("processed_text", "")
+        # 並び順の比較が文字列で済むよう、保存時にISO形式へそろえる
+        self.created_at = _iso(data.get("created_at", ""))
+        self.processed_at = _iso(data.get("processed_at", ""))
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.created_at, self.id)
+
+    def to_dict(self) -> dict:
+        return serialize_turn({slot: getattr(self, slot) for slot in self.__slots__})
+
+class PendingTurnRecord:
+    __slots__ = ("id", "room_id", "original_sender_id", "original_text", "status", "requested_at", "error")
+
+    def __init__(self, data: dict):
+        self.id = data["id"]
+        self.room_id = data["room_id"]
+        self.original_sender_id = data.get("original_sender_id", "")
+        self.original_text = data.get("original_text", "")
+        self.status = data.get("status", "pending")
+        self.requested_at = data.get("requested_at")
+        self.error = data.get("error")
+
+    def to_dict(self) -> dict:
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        if data["error"] is None:
+            del data["error"]
+        return data
+
+class RoomTurns:
+    """1ルームのターンを(created_at, id)順に並べた索引（キーとレコードを同じ順で持つ）"""
+    __slots__ = ("keys", "turns")
+
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []
+        self.turns: List[TurnRecord] = []
+
+    def insert(self, turn: TurnRecord):
+        index = bisect.bisect_right(self.keys, turn.key)
+        self.keys.insert(index, turn.key)
+        self.turns.insert(index, turn)
+
+    def remove(self, turn: TurnRecord):
+        index = bisect.bisect_left(self.keys, turn.key)
+        if index < len(self.turns) and self.turns[index] is turn:
+            del self.keys[index]
+            del self.turns[index]
+
+class EpochData:
+    """1エポック分のルーム・割り当て・ターンの索引（エポックの削除はこれを捨てるだけ）"""
+    __slots__ = ("rooms", "rooms_by_user", "assignments", "unassigned", "turns_by_room", "turn_ids")
+
+    def __init__(self):
+        self.rooms: Dict[str, RoomRecord] = {}
+        self.rooms_by_user: Dict[str, Set[str]] = {}
+        # firebase_uid → room_id（Noneなら未割り当て）
+        self.assignments: Dict[str, Optional[str]] = {}
+        # 未割り当てユーザー（挿入順を保つdictを集合として使う）
+        self.unassigned: Dict[str, None] = {}
+        self.turns_by_room: Dict[str, RoomTurns] = {}
+        self.turn_ids: Set[str] = set()
+
+    def set_room_id(self, firebase_uid: str, room_id: Optional[str]):
+        self.assignments[firebase_uid] = room_id
+        if room_id:
+            self.unassigned.pop(firebase_uid, None)
+        else:
+            self.unassigned[firebase_uid] = None
+
+    def add_room(self, room_data: dict, epoch: str) -> RoomRecord:
+        room = RoomRecord(room_data["id"], room_data.get("created_at"), tuple(room_data.get("users", ())), epoch)
+        self.rooms[room.id] = room
+        for user_doc_id in room.users:
+            self.rooms_by_user.setdefault(user_doc_id[len(USER_DOC_PREFIX):], set()).add(room.id)
+        return room
+
+class MemoryStorage(Storage):
+    """プロセス内のインデックス付きストア
+
+    エポックごとに未割り当てユーザー・ユーザーごとのルーム・ルームごとの時刻順ターンを
+    索引として持ち、どの操作もコレクション全体を走査しない。メソッド内でawaitしないので
+    各操作はイベントループ上でアトミックに実行される。複数Podでは共有されないため
+    ローカル開発・負荷試験用。
+    """
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[str, UserRecord] = {}
+        self._turns: Dict[str, TurnRecord] = {}
+        self._pending: Dict[str, PendingTurnRecord] = {}
+        self._epochs: Dict[str, EpochData] = {INITIAL_EPOCH: EpochData()}
+        self._current = INITIAL_EPOCH
+        self._next: Optional[str] = None
+        self._retired: List[str] = []
+        self._pair_history: Optional[bytes] = None
+
+    def _epoch(self, epoch: str) -> EpochData:
+        data = self._epochs.get(epoch)
+        if data is None:
+            data = self._epochs[epoch] = EpochData()
+        return data
+
+    @property
+    def _active(self) -> EpochData:
+        return self._epochs[self._current]
+
+    # ユーザー
+    async def get_user(self, firebase_uid: str) -> Optional[dict]:
+        user = self._users.get(firebase_uid)
+        return user.to_dict(self._active.assignments.get(firebase_uid)) if user is not None else None
+
+    async def get_cached_user(self, firebase_uid: str) -> Optional[dict]:
+        # 全てプロセス内にあるので読んでも往復は発生しない
+        return await self.get_user(firebase_uid)
+
+    async def create_user(self, user_data: dict) -> bool:
+        firebase_uid = user_data["firebase_uid"]
+        if firebase_uid in self._users:
+            return False
+        self._users[firebase_uid] = UserRecord(firebase_uid, user_data.get("created_at"))
+        self._active.set_room_id(firebase_uid, user_data.get("room_id"))
+        if self._next is not None:
+            self._epoch(self._next).set_room_id(firebase_uid, None)
+        return True
+
+    async def list_users(self) -> List[dict]:
+        assignments = self._active.assignments
+        return [user.to_dict(assignments.get(uid)) for uid, user in self._users.items()]
+
+    async def find_unassigned_users(self, limit: int) -> List[dict]:
+        return [self._users[uid].to_dict(None) for uid in itertools.islice(self._active.unassigned, limit)]
+
+    # ルーム
+    async def get_room(self, room_id: str) -> Optional[dict]:
+        room = self._active.rooms.get(room_id)
+        return room.to_dict() if room is not None else None
+
+    async def is_current_room(self, room_id: str) -> bool:
+        return room_id in self._active.rooms
+
+    async def list_rooms(self) -> List[dict]:
+        return [room.to_dict() for room in self._active.rooms.values()]
+
+    async def list_rooms_for_user(self, firebase_uid: str) -> List[dict]:
+        active = self._active
+        return [active.rooms[room_id].to_dict() for room_id in active.rooms_by_user.get(firebase_uid, ())]
+
+    async def create_room(self, room_data: dict, users: List[dict]):
+        # Firestoreのバッチと同じく、存在しないユーザーがいれば何も書かない
+        if any(user["firebase_uid"] not in self._users for user in users):
+            raise KeyError("Cannot assign a room to a missing user")
+        active = self._active
+        active.add_room(room_data, self._current)
+        for user in users:
+            active.set_room_id(user["firebase_uid"], room_data["id"])
+
+    async def assign_pair(self, user1_id: str, user2_id: str, room_data: dict) -> Tuple[Optional[dict], List[dict]]:
+        active = self._active
+        available = [
+            self._users[uid] for uid in (user1_id, user2_id)
+            if uid in self._users and not active.assignments.get(uid)
+        ]
+        if len(available) < 2 or user1_id == user2_id:
+            return None, [user.to_dict(None) for user in available]
+        active.add_room(room_data, self._current)
+        for user in available:
+            active.set_room_id(user.firebase_uid, room_data["id"])
+        return room_data, [user.to_dict(room_data["id"]) for user in available]
+
+    # ターン
+    async def save_turn(self, turn_data: dict, pending: bool = False):
+        turn = TurnRecord(turn_data, self._current)
+        # 同じturn_idの再実行は上書き
+        previous = self._turns.pop(turn.id, None)
+        if previous is not None and previous.epoch in self._epochs:
+            previous_epoch = self._epochs[previous.epoch]
+            previous_epoch.turns_by_room[previous.room_id].remove(previous)
+            previous_epoch.turn_ids.discard(previous.id)
+        self._turns[turn.id] = turn
+        active = self._active
+        active.turns_by_room.setdefault(turn.room_id, RoomTurns()).insert(turn)
+        active.turn_ids.add(turn.id)
+        if pending:
+            self._pending.pop(turn.id, None)
+
+    async def get_turn(self, turn_id: str) -> Optional[dict]:
+        turn = self._turns.get(turn_id)
+        return turn.to_dict() if turn is not None else None
+
+    async def get_turns(self, room_id: str, since: Optional[dict] = None, before: Optional[dict] = None,
+                        limit: int = MESSAGE_PAGE_SIZE) -> List[dict]:
+        room = self._active.turns_by_room.get(room_id)
+        if room is None:
+            return []
+        if since:
+            start = bisect.bisect_right(room.keys, (since["created_at"], since["id"]))
+            selected = room.turns[start:start + limit]
+        elif before:
+            end = bisect.bisect_left(room.keys, (before["created_at"], before["id"]))
+            selected = room.turns[max(0, end - limit):end]
+        else:
+            selected = room.turns[-limit:]
+        return [turn.to_dict() for turn in selected]
+
+    async def create_pending_turn(self, pending_data: dict):
+        self._pending[pending_data["id"]] = PendingTurnRecord(pending_data)
+
+    async def get_pending_turn(self, turn_id: str) -> Optional[dict]:
+        pending = self._pending.get(turn_id)
+        return pending.to_dict() if pending is not None else None
+
+    async def fail_pending_turn(self, turn_id: str, error: str):
+        pending = self._pending.get(turn_id)
+        if pending is None:
+            raise KeyError(f"No pending turn to update: {turn_id}")
+        pending.status = "failed"
+        pending.error = error
+
+    # エポック
+    async def get_current_epoch(self) -> str:
+        return self._current
+
+    async def get_epochs(self) -> dict:
+        return {"current": self._current, "next": self._next, "retired": list(self._retired)}
+
+    async def prepare_epoch(self, epoch: str):
+        self._next = epoch
+        self._epoch(epoch)
+
+    async def activate_epoch(self, epoch: str) -> dict:
+        previous = self._current
+        self._epoch(epoch)
+        self._current = epoch
+        if self._next == epoch:
+            self._next = None
+        if previous != epoch and previous not in self._retired:
+            self._retired.append(previous)
+        return await self.get_epochs()
+
+    async def collect_epoch(self, epoch: str, pause_seconds: float = 0.0) -> dict:
+        if epoch == self._current:
+            raise ValueError(f"Cannot collect the current epoch: {epoch}")
+        data = self._epochs.pop(epoch, None) or EpochData()
+        deleted_turns = 0
+        for turn_id in data.turn_ids:
+            turn = self._turns.get(turn_id)
+            if turn is not None and turn.epoch == epoch:
+                del self._turns[turn_id]
+                deleted_turns += 1
+        if epoch in self._retired:
+            self._retired.remove(epoch)
+        return {
+            "rooms": {"deleted": len(data.rooms)},
+            "turns": {"deleted": deleted_turns},
+            "assignments": {"deleted": len(data.assignments)},
+        }
+
+    # 日次リセット
+    async def list_users_for_reset(self) -> List[dict]:
+        return [{"firebase_uid": user.firebase_uid, "created_at": user.created_at} for user in self._users.values()]
+
+    async def write_assignments(self, epoch: str, rooms: List[dict], users: List[dict]) -> dict:
+        started_at = time.monotonic()
+        data = self._epoch(epoch)
+        for room_data in rooms:
+            data.add_room(room_data, epoch)
+        updated = 0
+        for user_data in users:
+            if user_data["firebase_uid"] in self._users:
+                data.set_room_id(user_data["firebase_uid"], user_data.get("room_id"))
+                updated += 1
+        return {
+            "committed_ops": len(rooms) + updated,
+            "failed_ops": 0,
+            "elapsed_seconds": round(time.monotonic() - started_at, 3),
+        }
+
+    async def load_pair_history(self) -> Optional[bytes]:
+        return self._pair_history
+
+    async def save_pair_history(self, data: bytes):
+        self._pair_history = bytes(data)
+
+    def stats(self) -> dict:
+        active = self._active
+        return {
+            "backend": self.name,
+            "epoch": self._current,
+            "epochs": len(self._epochs),
+            "users": len(self._users),
+            "unassigned_users": len(active.unassigned),
+            "rooms": len(active.rooms),
+            "turns": len(self._turns),
+            "pending_turns": len(self._pending),
+        }
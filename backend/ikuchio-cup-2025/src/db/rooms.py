@@ -1,31 +1,33 @@
-import gcp.firestore
+import asyncio
+import os
 import uuid
 import datetime
 import random
-from gcp.gemini import generate
+import time
+from gcp.gemini import generate, generate_stream
+from moderation.prefilter import prefilter_pipeline
 import json
+from db.storage import storage, MESSAGE_PAGE_SIZE, encode_message_cursor, decode_message_cursor
+from matchmaking.pairing import PairHistory, match_users
+from metrics import observe_db
+from tracing import start_span
 
-def get_db():
-    return gcp.firestore.get_firestore_client()
+# 日次リセットで1回に書き込むルーム数（この単位で進捗をチェックポイントに記録する）
+RESET_CHUNK_ROOMS = int(os.environ.get('RESET_CHUNK_ROOMS', '500'))
+# 古いエポックを削除する時のページごとの待ち時間（本番の読み書きを圧迫しないよう間引く）
+EPOCH_GC_PAUSE_SECONDS = float(os.environ.get('EPOCH_GC_PAUSE_SECONDS', '0.5'))
 
-db = get_db()
-
-def create_room_with_random_users():
+@observe_db("rooms.create_room_with_random_users")
+async def create_room_with_random_users():
     # ルーム未割り当てのユーザーのみ取得
-    users_ref = db.collection("users")
-    query = users_ref.where("room_id", "==", None).limit(10)
-    users_docs = query.get()
+    users = await storage.find_unassigned_users(10)
     
-    if len(users_docs) < 2:
-        print(f"[Room Debug] Not enough unassigned users: {len(users_docs)}")
+    if len(users) < 2:
+        print(f"[Room Debug] Not enough unassigned users: {len(users)}")
         return None
     
     # ランダムに2名選択
-    selected_users = random.sample(users_docs, 2)
-    user1_dict = selected_users[0].to_dict()
-    user2_dict = selected_users[1].to_dict()
-    if user1_dict is None or user2_dict is None or "firebase_uid" not in user1_dict or "firebase_uid" not in user2_dict:
-        return None
+    user1_dict, user2_dict = random.sample(users, 2)
     user1_id = user1_dict["firebase_uid"]
     user2_id = user2_dict["firebase_uid"]
     
@@ -38,12 +40,8 @@ def create_room_with_random_users():
     }
     
     try:
-        # ルーム作成
-        db.collection("rooms").document(room_id).set(room_data)
-        
-        # ユーザーにルームIDを割り当て
-        selected_users[0].reference.update({"room_id": room_id})
-        selected_users[1].reference.update({"room_id": room_id})
+        # ルーム作成とユーザーへのルームID割り当てを1回の書き込みで行う
+        await storage.create_room(room_data, [user1_dict, user2_dict])
         
         print(f"[Room Debug] Created room {room_id} for users {user1_id} and {user2_id}")
         return room_data
@@ -51,38 +49,77 @@ def create_room_with_random_users():
         print(f"Error creating room: {e}")
         return None
 
-def firestore_get_room(room_id: str):
-    room_doc = db.collection("rooms").document(room_id).get()
-    
-    if room_doc.exists:
-        return room_doc.to_dict()
-    else:
-        return None
+@observe_db("rooms.create_room_for_pair")
+async def firestore_create_room_for_pair(user1_id: str, user2_id: str):
+    """2人が未割り当てであることを確認してルーム作成と割り当てをアトミックに行う
 
-def firestore_get_all_rooms():
-    rooms_ref = db.collection("rooms")
-    docs = rooms_ref.get()
-    
-    return [doc.to_dict() for doc in docs if doc.to_dict()]
+    戻り値は (作成したルーム or None, まだ未割り当てのユーザーのfirebase_uidリスト)
+    """
+    room_id = f"room_{uuid.uuid4()}"
+    room_data = {
+        "id": room_id,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        "users": [f"user_{user1_id}", f"user_{user2_id}"]
+    }
+    room, users = await storage.assign_pair(user1_id, user2_id, room_data)
+    if room:
+        print(f"[Room Debug] Created room {room_id} for users {user1_id} and {user2_id}")
+        return room, []
+    return None, [user["firebase_uid"] for user in users]
 
-async def firestore_send_message(room_id: str, sender_id: str, original_text: str):
+@observe_db("rooms.get_room")
+async def firestore_get_room(room_id: str):
+    return await storage.get_room(room_id)
+
+@observe_db("rooms.get_all_rooms")
+async def firestore_get_all_rooms():
+    return await storage.list_rooms()
+
+async def _generate_streaming(turn_id: str, input_text: str, on_partial):
+    """ストリーミング生成し、途中経過をon_partialに渡して最終テキストを返す"""
+    processed_text = input_text
+    async for partial_text in generate_stream(input_text):
+        processed_text = partial_text
+        try:
+            await on_partial(turn_id, partial_text)
+        except Exception as e:
+            print(f"[Message Debug] Failed to deliver partial text: {e}")
+    return processed_text
+
+@observe_db("rooms.process_message")
+async def firestore_process_message(turn_id: str, room_id: str, sender_id: str, original_text: str,
+                                    on_partial=None, pending: bool = False):
+    """メッセージを処理してターンを保存する（保存失敗時は例外を送出）
+
+    on_partialを渡すとGeminiの生成途中のテキストを on_partial(turn_id, text) で逐次通知し、
+    生成完了後にターンを1回だけ保存する。pendingがTrueなら保留中ターンの削除も同時に行う。
+    同じturn_idで再実行しても同じドキュメントを上書きするだけなので、リトライしても重複しない。
+    """
     print(f"[Message Debug] Starting message processing for room {room_id}")
     print(f"[Message Debug] Original text: {original_text}")
     
-    turn_id = f"turn_{uuid.uuid4()}"
+    # ローカル前処理（相槌の素通し・個人情報の伏せ字化）
+    prefiltered = prefilter_pipeline.run(original_text)
     
     # AIによるテキスト処理
-    try:
-        print(f"[Message Debug] Calling Gemini AI for processing...")
-        processed_text = await generate(original_text)
-        print(f"[Message Debug] Gemini processing completed")
-        print(f"[Message Debug] Processed text: {processed_text}")
-    except Exception as e:
-        print(f"[Message Debug] AI processing failed: {e}")
-        import traceback
-        print(f"[Message Debug] Full traceback: {traceback.format_exc()}")
-        processed_text = original_text  # フォールバック
-        print(f"[Message Debug] Using fallback (original text)")
+    if not prefiltered.needs_llm:
+        processed_text = prefiltered.text
+        print(f"[Message Debug] Prefilter stage '{prefiltered.stage}' completed processing, skipping Gemini")
+    else:
+        try:
+            print(f"[Message Debug] Calling Gemini AI for processing...")
+            if on_partial is not None:
+                processed_text = await _generate_streaming(turn_id, prefiltered.text, on_partial)
+            else:
+                processed_text = await generate(prefiltered.text)
+            print(f"[Message Debug] Gemini processing completed")
+            print(f"[Message Debug] Processed text: {processed_text}")
+        except Exception as e:
+            print(f"[Message Debug] AI processing failed: {e}")
+            import traceback
+            print(f"[Message Debug] Full traceback: {traceback.format_exc()}")
+            processed_text = prefiltered.text  # フォールバック（伏せ字化済みの原文）
+            print(f"[Message Debug] Using fallback (prefiltered original text)")
     
     now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
     
@@ -96,135 +133,291 @@ async def firestore_send_message(room_id: str, sender_id: str, original_text: st
         "processed_at": now.isoformat()
     }
     
+    with start_span("firestore.write_turn", new_trace=False, pending=pending, backend=storage.name):
+        await storage.save_turn(turn_data, pending)
+    return {**turn_data, "cursor": encode_message_cursor(turn_data)}
+
+async def firestore_send_message(room_id: str, sender_id: str, original_text: str, on_partial=None):
+    """メッセージを同期的に処理して保存する（保存に失敗した場合はNone）"""
+    turn_id = f"turn_{uuid.uuid4()}"
     try:
-        db.collection("turns").document(turn_id).set(turn_data)
-        return turn_data
+        return await firestore_process_message(turn_id, room_id, sender_id, original_text, on_partial=on_partial)
     except Exception as e:
         print(f"Error sending message: {e}")
         return None
 
-def firestore_get_messages(room_id: str):
-    turns_ref = db.collection("turns")
-    query = turns_ref.where("room_id", "==", room_id).limit(100)
-    docs = query.get()
-    
-    messages = []
-    for doc in docs:
-        data = doc.to_dict()
-        if data:
-            # created_atを文字列に変換
-            if 'created_at' in data and hasattr(data['created_at'], 'isoformat'):
-                data['created_at'] = data['created_at'].isoformat()
-            if 'processed_at' in data and hasattr(data['processed_at'], 'isoformat'):
-                data['processed_at'] = data['processed_at'].isoformat()
-            messages.append(data)
-    
-    # ソート処理
-    try:
-        messages.sort(key=lambda x: x.get('created_at', ''))
-    except (TypeError, ValueError, KeyError) as e:
-        print(f"Warning: Failed to sort messages: {e}")
-        # ソートに失敗した場合はそのまま返す
-    
-    return messages
+@observe_db("rooms.create_pending_turn")
+async def firestore_create_pending_turn(room_id: str, sender_id: str, original_text: str):
+    """Gemini処理前のターンを保留中として保存する（処理完了でturnsに移る）"""
+    turn_id = f"turn_{uuid.uuid4()}"
+    pending_data = {
+        "id": turn_id,
+        "room_id": room_id,
+        "original_sender_id": sender_id,
+        "original_text": original_text,
+        "status": "pending",
+        "requested_at": datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).isoformat()
+    }
+    await storage.create_pending_turn(pending_data)
+    return pending_data
+
+@observe_db("rooms.fail_pending_turn")
+async def firestore_fail_pending_turn(turn_id: str, error: str):
+    """リトライを使い切ったターンを失敗として記録する"""
+    await storage.fail_pending_turn(turn_id, error)
+
+@observe_db("rooms.get_turn_status")
+async def firestore_get_turn_status(room_id: str, turn_id: str):
+    """ターンの処理状況を返す（処理済みならターン本体、保留中・失敗なら保留レコード）
+
+    room_idのターンでない場合と、現在のエポックのルームでない場合（前のエポックの
+    ルームが削除されるまでの間も）はNoneを返す。
+    """
+    if not await storage.is_current_room(room_id):
+        return None
+    turn = await storage.get_turn(turn_id)
+    result = {**turn, "status": "done"} if turn is not None else await storage.get_pending_turn(turn_id)
+    if result is None or result.get("room_id") != room_id:
+        return None
+    return result
+
+@observe_db("rooms.get_messages")
+async def firestore_get_messages(room_id: str, since: str = None, before: str = None, limit: int = MESSAGE_PAGE_SIZE):
+    """ルームのメッセージをcreated_at順で取得する
+
+    - 引数なし: 最新のlimit件
+    - since: そのカーソルより後のターンのみ（差分取得）
+    - before: そのカーソルより前のlimit件（過去ログのページング）
+
+    不正なカーソルはValueError。現在のエポックのルームでなければ（前のエポックのルームが
+    削除されるまでの間も）Noneを返す。
+    """
+    limit = max(1, min(int(limit), MESSAGE_PAGE_SIZE))
+    since_fields = decode_message_cursor(since) if since else None
+    before_fields = decode_message_cursor(before) if before else None
+    if not await storage.is_current_room(room_id):
+        return None
+    return await storage.get_turns(room_id, since=since_fields, before=before_fields, limit=limit)
 
-def get_room_processed_texts_json(room_id: str):
-    messages = firestore_get_messages(room_id)
+async def get_room_processed_texts_json(room_id: str):
+    messages = await firestore_get_messages(room_id)
     texts = []
-    for msg in messages:
+    for msg in messages or []:
         processed = msg.get("processed_text")
         if processed:
             texts.append({"text": processed})
     return json.dumps(texts, ensure_ascii=False)
 
-def _clear_all_data():
-    """Delete all rooms and messages from database"""
-    # 全ルーム削除
-    rooms_ref = db.collection("rooms")
-    docs = rooms_ref.get()
-    for doc in docs:
-        doc.reference.delete()
-    
-    # 全メッセージ削除
-    turns_ref = db.collection("turns")
-    turn_docs = turns_ref.get()
-    for doc in turn_docs:
-        doc.reference.delete()
-
-def _clear_user_room_assignments():
-    """Clear room_id from all users and return user documents"""
-    users_ref = db.collection("users")
-    user_docs = users_ref.get()
-    for user_doc in user_docs:
-        try:
-            user_doc.reference.update({"room_id": None})
-            user_data = user_doc.to_dict()
-            firebase_uid = user_data.get('firebase_uid', 'unknown') if user_data else 'unknown'
-            print(f"Debug: Cleared room_id for user user_{firebase_uid}")
-        except Exception as e:
-            print(f"Debug: Failed to clear room_id: {e}")
-    return user_docs
-
-def _create_pair_rooms(users_list):
-    """Create rooms for user pairs"""
-    created_rooms = []
-    i = 0
-    while i < len(users_list) - 1:
-        user1_dict = users_list[i].to_dict()
-        user2_dict = users_list[i + 1].to_dict()
-        
-        if user1_dict and user2_dict and "firebase_uid" in user1_dict and "firebase_uid" in user2_dict:
-            user1_id = user1_dict["firebase_uid"]
-            user2_id = user2_dict["firebase_uid"]
-            
-            room_id = f"room_{uuid.uuid4()}"
-            room_data = {
-                "id": room_id,
-                "created_at": datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))),
-                "users": [f"user_{user1_id}", f"user_{user2_id}"]
-            }
-            
-            try:
-                db.collection("rooms").document(room_id).set(room_data)
-            except Exception as e:
-                print(f"Error creating pair room: {e}")
-                continue
-            
-            try:
-                users_list[i].reference.update({"room_id": room_id})
-                users_list[i + 1].reference.update({"room_id": room_id})
-                print(f"Debug: Assigned room {room_id} to users user_{user1_id} and user_{user2_id}")
-            except Exception as e:
-                print(f"Debug: Failed to assign room_id: {e}")
-            
-            created_rooms.append(room_data)
+def _reset_room_id(reset_id: str, index: int) -> str:
+    """同じリセットの同じペアには常に同じルームIDを振る（再開時の書き直しが上書きになる）"""
+    return f"room_{uuid.uuid5(uuid.NAMESPACE_URL, f'reset:{reset_id}:{index}')}"
+
+def _create_pair_rooms(users_list, reset_id: str, created_at, start: int = 0, end: int = None):
+    """Create rooms for user pairs [start, end); returns the rooms and the users with their new room_id
+
+    users_listはシャッフル済みの {"firebase_uid", "created_at"} のリスト。
+    """
+    pair_count = len(users_list) // 2
+    end = pair_count if end is None else min(end, pair_count)
+    rooms = []
+    assigned_users = []
+    for index in range(start, end):
+        user1 = users_list[index * 2]
+        user2 = users_list[index * 2 + 1]
         
-        i += 2
-    return created_rooms
+        room_id = _reset_room_id(reset_id, index)
+        rooms.append({
+            "id": room_id,
+            "created_at": created_at,
+            "users": [f"user_{user1['firebase_uid']}", f"user_{user2['firebase_uid']}"]
+        })
+        assigned_users.append({**user1, "room_id": room_id})
+        assigned_users.append({**user2, "room_id": room_id})
+    return rooms, assigned_users
 
 def _handle_odd_user(users_list):
     """Handle the last user if odd number of users - leave without room"""
     if len(users_list) % 2 == 1:
-        last_user_dict = users_list[-1].to_dict()
-        if last_user_dict and "firebase_uid" in last_user_dict:
-            user_id = last_user_dict["firebase_uid"]
-            print(f"Debug: User user_{user_id} left without room assignment (odd number)")
-    return None
+        user = users_list[-1]
+        print(f"Debug: User user_{user['firebase_uid']} left without room assignment (odd number)")
+        return [{**user, "room_id": None}]
+    return []
+
+async def _plan_pairs(users_list, epoch: str):
+    """シャッフル済みのusers_listを、過去に組んだことのない2人が隣り合う順に並べ替える
+
+    前回余ったユーザーを優先して組ませ、今回余った1人を末尾に置く（_handle_odd_user の対象）。
+    索引はここでは保存しない（切り替え前に失敗して組み直すと、使われなかったペアが
+    残るため）。切り替えた後に _save_pair_history で記録する。戻り値は (並べ替えたリスト, 統計)。
+    """
+    history = PairHistory.from_bytes(await storage.load_pair_history())
+    users_by_uid = {user["firebase_uid"]: user for user in users_list}
+    pairs, odd, stats = match_users([user["firebase_uid"] for user in users_list], history, epoch)
+    ordered = [users_by_uid[uid] for pair in pairs for uid in pair]
+    if odd is not None:
+        ordered.append(users_by_uid[odd])
+    print(f"[Reset] Planned {stats['pairs']} pairs in {stats['elapsed_seconds']}s "
+          f"(repaired {stats['repaired']}, repeats {stats['repeats']})")
+    return ordered, stats
+
+async def _save_pair_history(users_list, epoch: str) -> dict:
+    """有効になったepochの組み合わせ（users_listの隣り合う2人）を過去の組み合わせの索引に保存する"""
+    history = PairHistory.from_bytes(await storage.load_pair_history())
+    pair_count = len(users_list) // 2
+    pairs = [(users_list[2 * i]["firebase_uid"], users_list[2 * i + 1]["firebase_uid"]) for i in range(pair_count)]
+    odd = users_list[-1]["firebase_uid"] if len(users_list) % 2 == 1 else None
+    if history.record_epoch(epoch, pairs, odd):
+        await storage.save_pair_history(history.to_bytes())
+    return history.stats()
 
-def firestore_reset_all_rooms():
-    """Reset all rooms and create new room assignments"""
-    _clear_all_data()
-    user_docs = _clear_user_room_assignments()
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+class ResetWriteError(Exception):
+    """リセットの割り当ての書き込みに失敗したバッチがあった（チェックポイントを進めずにやり直す）"""
+
+async def _write_reset_assignments(state: dict, epoch: str, rooms, users):
+    """割り当てを書き込み、失敗したバッチがあれば例外を送出する
+
+    BatchWriterは失敗したバッチをfailed_opsに数えるだけなので、ここで止めないと
+    チェックポイントが失敗したチャンクの先に進み、割り当ての欠けたエポックが有効になる。
+    """
+    stats = await storage.write_assignments(epoch, rooms, users)
+    if stats.get("failed_ops"):
+        raise ResetWriteError(f"{stats['failed_ops']} assignment writes failed for epoch {epoch}")
+    _add_write_stats(state["assigned"], stats)
+
+def _add_write_stats(total: dict, stats: dict):
+    for key in ("committed_ops", "failed_ops", "elapsed_seconds"):
+        total[key] = round(total.get(key, 0) + stats.get(key, 0), 3)
+
+@observe_db("rooms.reset_all_rooms")
+async def firestore_reset_all_rooms(reset_id: str = None, checkpoint=None, activate_at: datetime.datetime = None):
+    """Reset all rooms by preparing a new epoch and switching to it
+
+    reset_idをエポックとして全員の新しい組み合わせを書き込み、最後に現在のエポックを
+    1回の書き込みで切り替える。切り替えまでは前のエポックのルームがそのまま使われ、
+    前のエポックのデータは firestore_collect_old_epochs が後から削除する。
+    activate_atを渡すと、準備が終わってもその時刻まで切り替えを待つ。
+
+    checkpointを渡すと、組み合わせの決定・RESET_CHUNK_ROOMSごとの書き込み・切り替えが
+    終わるたびに checkpoint.save(state) で進捗を記録し、開始時に checkpoint.load() の
+    状態から再開する。組み合わせ順に並べたユーザー一覧は大きいので save_plan/load_plan で
+    1回だけ別に保存する。組み合わせは _plan_pairs で過去に組んだ相手を避けて決め、
+    切り替えが済んでから過去の組み合わせの索引に記録する。
+    ルームIDはreset_idとペア番号から決まるので、途中まで書いたチャンクをやり直しても
+    同じドキュメントを上書きするだけになる。
+    """
+    started_at = time.monotonic()
+    reset_id = reset_id or uuid.uuid4().hex
+    epoch = reset_id
+    state = await checkpoint.load() if checkpoint is not None else None
+    users_list = None
+    if state is not None and state["planned"]:
+        users_list = await checkpoint.load_plan()
+        if users_list is None:
+            # 組み合わせが失われた場合は途中の割り当てと混ざらないよう最初からやり直す
+            print(f"[Reset] Plan for reset {reset_id} is missing, restarting from the beginning")
+            state = None
+    resumed = state is not None
+    if state is None:
+        state = {"reset_id": reset_id, "planned": False, "assigned_rooms": 0, "assigned": {}, "activated": False, "done": False}
+    else:
+        print(f"[Reset] Resuming reset {reset_id}: assigned_rooms={state['assigned_rooms']}, activated={state['activated']}")
+    
+    async def save():
+        if checkpoint is not None:
+            await checkpoint.save(state)
     
-    print(f"Debug: Found {len(user_docs)} users for room creation")
+    if users_list is None:
+        # 準備中として記録してから一覧を取るので、この後に登録したユーザーも新しいエポックで未割り当てになる
+        await storage.prepare_epoch(epoch)
+        # 各ユーザーへの書き込みは新しいエポックの割り当て1回だけ
+        users_list = [
+            {"firebase_uid": user["firebase_uid"], "created_at": _iso(user.get("created_at"))}
+            for user in await storage.list_users_for_reset()
+        ]
+        random.shuffle(users_list)
+        users_list, state["pairing"] = await _plan_pairs(users_list, epoch)
+        if checkpoint is not None:
+            await checkpoint.save_plan(users_list)
+        state["planned"] = True
+        state["created_at"] = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).isoformat()
+        state["total_rooms"] = len(users_list) // 2
+        await save()
+    created_at = datetime.datetime.fromisoformat(state["created_at"])
+    pair_count = len(users_list) // 2
     
-    if len(user_docs) < 2:
-        return {"message": "Not enough users to create rooms", "created_rooms": 0}
+    print(f"Debug: Found {len(users_list)} users for room creation")
     
-    users_list = [doc for doc in user_docs]
-    random.shuffle(users_list)
+    while state["assigned_rooms"] < pair_count:
+        start = state["assigned_rooms"]
+        end = min(pair_count, start + RESET_CHUNK_ROOMS)
+        rooms, assigned_users = _create_pair_rooms(users_list, reset_id, created_at, start, end)
+        await _write_reset_assignments(state, epoch, rooms, assigned_users)
+        state["assigned_rooms"] = end
+        await save()
     
-    created_rooms = _create_pair_rooms(users_list)
-    _handle_odd_user(users_list)
+    if not state["activated"]:
+        odd_users = _handle_odd_user(users_list)
+        if odd_users:
+            await _write_reset_assignments(state, epoch, [], odd_users)
+        if activate_at is not None:
+            wait_seconds = (activate_at - datetime.datetime.now(activate_at.tzinfo)).total_seconds()
+            if wait_seconds > 0:
+                print(f"[Reset] Epoch {epoch} prepared, switching at {activate_at.isoformat()}")
+                await asyncio.sleep(wait_seconds)
+        cutover_started_at = time.monotonic()
+        epochs = await storage.activate_epoch(epoch)
+        state["cutover_seconds"] = round(time.monotonic() - cutover_started_at, 6)
+        state["retired_epochs"] = epochs["retired"]
+        state["activated"] = True
+        await save()
     
-    return {"message": "All rooms have been reset and new rooms created", "created_rooms": len(created_rooms)}
+    if not state.get("history_saved"):
+        # 使われた組み合わせだけを記録する（記録済みのエポックなら何もしない）
+        state.setdefault("pairing", {})["history"] = await _save_pair_history(users_list, epoch)
+        state["history_saved"] = True
+        await save()
+    
+    state["done"] = True
+    await save()
+    
+    stats = {
+        "users": len(users_list),
+        "epoch": epoch,
+        "assigned": state["assigned"],
+        "pairing": state.get("pairing"),
+        "cutover_seconds": state["cutover_seconds"],
+        "retired_epochs": state["retired_epochs"],
+        "elapsed_seconds": round(time.monotonic() - started_at, 3),
+        "resumed": resumed,
+    }
+    print(f"[Reset] Completed in {stats['elapsed_seconds']}s (cutover {stats['cutover_seconds']}s): {pair_count} rooms for {len(users_list)} users")
+    
+    if len(users_list) < 2:
+        return {"message": "Not enough users to create rooms", "created_rooms": 0, "stats": stats}
+    
+    return {"message": "All rooms have been reset and new rooms created", "created_rooms": pair_count, "stats": stats}
+
+@observe_db("rooms.collect_old_epochs")
+async def firestore_collect_old_epochs(pause_seconds: float = EPOCH_GC_PAUSE_SECONDS) -> dict:
+    """削除待ちのエポックのルーム・ターン・割り当てを古い順に削除する
+
+    削除は冪等なので、途中で止まっても次の呼び出しで残りから続けられる。
+    最初にエポック導入前のデータを初期エポックへ移行する（済んでいれば何もしない）。
+    """
+    migrated = await storage.migrate_legacy_data()
+    if migrated:
+        print(f"[Reset] Migrated pre-epoch data: {migrated}")
+    collected = {}
+    for epoch in (await storage.get_epochs())["retired"]:
+        started_at = time.monotonic()
+        stats = await storage.collect_epoch(epoch, pause_seconds)
+        print(f"[Reset] Collected epoch {epoch} in {time.monotonic() - started_at:.1f}s: {stats}")
+        collected[epoch] = stats
+    return collected
+
+@observe_db("rooms.get_epochs")
+async def firestore_get_epochs():
+    return await storage.get_epochs()
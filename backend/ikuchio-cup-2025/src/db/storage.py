@@ -0,0 +1,205 @@
+import base64
+import json
+import os
+from typing import List, Optional, Tuple
+
+# firestore: Firestore（本番） / memory: プロセス内のインデックス付きストア（ローカル開発・負荷試験用）
+# 未設定なら DISABLE_FIRESTORE=true の時だけ memory を使う
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND')
+
+# 1回のメッセージ取得で返す最大ターン数
+MESSAGE_PAGE_SIZE = 100
+
+# エポックの切り替え前から存在するデータのエポック
+INITIAL_EPOCH = "initial"
+
+def encode_message_cursor(turn: dict) -> str:
+    """ターンの(created_at, id)を不透明なカーソル文字列に変換"""
+    raw = json.dumps([turn.get("created_at", ""), turn.get("id", "")], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_message_cursor(cursor: str) -> dict:
+    """カーソル文字列をstart_after用のフィールド値に戻す（不正な場合はValueError）"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, turn_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid message cursor: {cursor}") from e
+    if not isinstance(created_at, str) or not isinstance(turn_id, str):
+        raise ValueError(f"Invalid message cursor: {cursor}")
+    return {"created_at": created_at, "id": turn_id}
+
+def serialize_turn(data: dict) -> dict:
+    """日時を文字列にしてカーソルを付ける（APIで返す形）"""
+    if 'created_at' in data and hasattr(data['created_at'], 'isoformat'):
+        data['created_at'] = data['created_at'].isoformat()
+    if 'processed_at' in data and hasattr(data['processed_at'], 'isoformat'):
+        data['processed_at'] = data['processed_at'].isoformat()
+    data['cursor'] = encode_message_cursor(data)
+    return data
+
+class Storage:
+    """ユーザー・ルーム・ターンの永続化（db/rooms.py・db/users.py から使う）
+
+    ユーザーはfirebase_uid、ルームとターンはidで識別する。返すのはAPIでそのまま
+    返せる辞書で、ターンは serialize_turn 済み（created_at順・カーソル付き）。
+
+    ルーム・ターン・ユーザーのルーム割り当てはエポック（日次リセットごとの世代）に
+    属し、読み取りは現在のエポックだけを見る。日次リセットは次のエポックに割り当てを
+    書き込んでから activate_epoch で現在のエポックを切り替え、古いエポックのデータは
+    collect_epoch で後から削除する。ユーザーの辞書のroom_idは現在のエポックでの割り当て。
+    """
+    name = "base"
+
+    # ユーザー
+    async def get_user(self, firebase_uid: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_cached_user(self, firebase_uid: str) -> Optional[dict]:
+        """キャッシュにあるユーザーだけを返す（データベースは読まない。なければNone）"""
+        return None
+
+    async def create_user(self, user_data: dict) -> bool:
+        """存在しない場合だけ作成する（既に存在すればFalse）"""
+        raise NotImplementedError
+
+    async def list_users(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def find_unassigned_users(self, limit: int) -> List[dict]:
+        """現在のエポックでルーム未割り当てのユーザーを最大limit人"""
+        raise NotImplementedError
+
+    # ルーム
+    async def get_room(self, room_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def is_current_room(self, room_id: str) -> bool:
+        """現在のエポックのルームか（前のエポックのルームの履歴を削除前に見せないために使う）"""
+        return await self.get_room(room_id) is not None
+
+    async def list_rooms(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def list_rooms_for_user(self, firebase_uid: str) -> List[dict]:
+        raise NotImplementedError
+
+    async def create_room(self, room_data: dict, users: List[dict]):
+        """現在のエポックにルームを作成し、usersにそのルームを割り当てる（確認なしで1回の書き込み）"""
+        raise NotImplementedError
+
+    async def assign_pair(self, user1_id: str, user2_id: str, room_data: dict) -> Tuple[Optional[dict], List[dict]]:
+        """2人が未割り当てであることを確認してルーム作成と割り当てをアトミックに行う
+
+        成立すれば (room_data, 割り当て後の2人)、しなければ (None, まだ未割り当てのユーザー) を返す。
+        """
+        raise NotImplementedError
+
+    # ターン
+    async def save_turn(self, turn_data: dict, pending: bool = False):
+        """処理済みターンを保存する（pendingなら保留中ターンの削除も同時に行う）"""
+        raise NotImplementedError
+
+    async def get_turn(self, turn_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_turns(self, room_id: str, since: Optional[dict] = None, before: Optional[dict] = None,
+                        limit: int = MESSAGE_PAGE_SIZE) -> List[dict]:
+        """ルームのターンを古い順で返す（since/beforeはdecode_message_cursorの値）
+
+        sinceならそれより後の先頭limit件、beforeならそれより前の末尾limit件、
+        どちらもなければ最新limit件。
+        """
+        raise NotImplementedError
+
+    async def create_pending_turn(self, pending_data: dict):
+        raise NotImplementedError
+
+    async def get_pending_turn(self, turn_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def fail_pending_turn(self, turn_id: str, error: str):
+        raise NotImplementedError
+
+    # エポック
+    async def get_current_epoch(self) -> str:
+        raise NotImplementedError
+
+    async def get_epochs(self) -> dict:
+        """{"current": 現在, "next": 準備中（なければNone）, "retired": 削除待ちのリスト}"""
+        raise NotImplementedError
+
+    async def prepare_epoch(self, epoch: str):
+        """準備中のエポックとして記録する（以後に作成したユーザーはそのエポックでも未割り当てになる）"""
+        raise NotImplementedError
+
+    async def activate_epoch(self, epoch: str) -> dict:
+        """現在のエポックを1回の書き込みで切り替え、前のエポックを削除待ちにする"""
+        raise NotImplementedError
+
+    async def collect_epoch(self, epoch: str, pause_seconds: float = 0.0) -> dict:
+        """削除待ちのエポックのルーム・ターン・割り当てを削除し、削除待ちから外す
+
+        pause_secondsはページごとの待ち時間（本番の読み書きを圧迫しないよう間引く）。
+        """
+        raise NotImplementedError
+
+    async def migrate_legacy_data(self) -> dict:
+        """エポック導入前のデータを初期エポックのものとして書き直す（1回だけ。統計を返す）
+
+        導入前のデータを持たないストレージでは何もしない。
+        """
+        return {}
+
+    # 日次リセット
+    async def list_users_for_reset(self) -> List[dict]:
+        """リセット対象のユーザー（firebase_uidとcreated_atだけ）"""
+        raise NotImplementedError
+
+    async def write_assignments(self, epoch: str, rooms: List[dict], users: List[dict]) -> dict:
+        """エポックに新しいルームを作成し、各ユーザーのroom_id（Noneなら未割り当て）を書き込む
+
+        usersは list_users_for_reset の各要素にroom_idを加えたもの。統計を返す。
+        """
+        raise NotImplementedError
+
+    async def load_pair_history(self) -> Optional[bytes]:
+        """過去の組み合わせの索引（matchmaking.pairing.PairHistory.to_bytes の値、なければNone）"""
+        raise NotImplementedError
+
+    async def save_pair_history(self, data: bytes):
+        """過去の組み合わせの索引をまとめて置き換える"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+def create_storage() -> Storage:
+    """STORAGE_BACKEND（firestore/memory）に応じてストレージを生成"""
+    backend = STORAGE_BACKEND
+    if backend is None:
+        backend = 'memory' if os.environ.get('DISABLE_FIRESTORE') == 'true' else 'firestore'
+    if backend == 'memory':
+        from db.memory_storage import MemoryStorage
+        print("[Storage] Using in-memory storage (data is lost when the process exits)")
+        return MemoryStorage()
+    from db.firestore_storage import FirestoreStorage
+    print("[Storage] Using Firestore storage")
+    return FirestoreStorage()
+
+class LazyStorage:
+    """最初の属性アクセス時に create_storage() でエンジンを生成して委譲する
+
+    エンジンのモジュールはこのモジュールのStorageを継承するため、import時には生成しない。
+    """
+
+    def __init__(self):
+        self._storage = None
+
+    def __getattr__(self, name):
+        if self._storage is None:
+            self._storage = create_storage()
+        return getattr(self._storage, name)
+
+# グローバルインスタンス
+storage = LazyStorage()
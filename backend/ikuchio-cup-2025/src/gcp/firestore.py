@@ -26,4 +26,26 @@ def get_firestore_client():
         print(f"[Firestore] Traceback: {traceback.format_exc()}")
         raise e
 
-db = get_firestore_client()
\ No newline at end of file
+def get_async_firestore_client():
+    """イベントループをブロックしないAsyncClientを生成"""
+    try:
+        project_id = os.environ.get('GOOGLE_CLOUD_PROJECT', 'ikuchio-cup-2025')
+        database_id = 'ikuchio-cup-2025-dev'
+        print(f"[Firestore] Initializing async client for project: {project_id}, database: {database_id}")
+        
+        # gRPCチャネルは最初のリクエスト時に確立される
+        client = firestore.AsyncClient(project=project_id, database=database_id)
+        print(f"[Firestore] Async client initialized successfully")
+        return client
+    except Exception as e:
+        print(f"[Firestore] Error initializing async client: {e}")
+        import traceback
+        print(f"[Firestore] Traceback: {traceback.format_exc()}")
+        raise e
+
+def __getattr__(name):
+    # 同期クライアントは `from gcp.firestore import db` された時に初めて生成する
+    if name == "db":
+        from clients import clients
+        return clients.sync_firestore()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
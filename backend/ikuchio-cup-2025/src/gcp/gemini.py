@@ -3,8 +3,17 @@ from google.genai import types
 from google.genai.types import HarmCategory, HarmBlockThreshold
 from gcp.secret_manager import SecretManagerUtil
 import base64
+import json
 import os
 import datetime
+import asyncio
+from contextlib import asynccontextmanager
+import hashlib
+import time
+import unicodedata
+from cache.tiered_cache import TieredCache
+from metrics import registry
+from tracing import new_span, start_span
 
 # API_KEYを遅延読み込みに変更
 API_KEY = None
@@ -34,18 +43,8 @@ def get_api_key():
         print("[Gemini Debug] API key is in fallback state, not retrying")
     return API_KEY
 
-async def generate(input_text):
-  api_key = get_api_key()
-  if api_key == "fallback":
-    print("[Gemini Debug] Using fallback - returning original text")
-    return input_text
-    
-  client = genai.Client(
-      vertexai=True,
-      api_key=api_key
-  )
-
-  si_text1 = """役割
+# システムプロンプトとモデル設定は起動時に1度だけ構築する
+SYSTEM_INSTRUCTION = """役割
 あなたは、入力された文章を書き手本人（一人称視点）として書き直し、個人情報や固有名詞、そして特定のトピックを検閲・フィルタリングするAIです。あなたとの会話は行いません。指示に従って処理した文章のみをレスポンスしてください。
 
 全体的な指示
@@ -84,8 +83,108 @@ async def generate(input_text):
 処理: 上記の検閲対象に該当する情報を、例外なくすべて ▢▢ という記号で伏せ字にしてください。
 """
 
-  model = "gemini-2.5-flash"
-  contents = [
+MODEL = "gemini-2.5-flash"
+
+# 同時に投げるGemini呼び出し数の上限（超えた分は待機キューに並ぶ）
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '32'))
+GEMINI_TIMEOUT_SECONDS = float(os.environ.get('GEMINI_TIMEOUT_SECONDS', '30'))
+
+GENERATE_CONTENT_CONFIG = types.GenerateContentConfig(
+  temperature = 1,
+  top_p = 1,
+  seed = 0,
+  max_output_tokens = 65535,
+  safety_settings = [types.SafetySetting(
+    category="HARM_CATEGORY_HATE_SPEECH",
+    threshold="OFF"
+  ),types.SafetySetting(
+    category="HARM_CATEGORY_DANGEROUS_CONTENT",
+    threshold="OFF"
+  ),types.SafetySetting(
+    category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
+    threshold="OFF"
+  ),types.SafetySetting(
+    category="HARM_CATEGORY_HARASSMENT",
+    threshold="OFF"
+  )],
+  system_instruction=[types.Part.from_text(text=SYSTEM_INSTRUCTION)]
+)
+
+# マイクロバッチ（複数の入力を1リクエストにまとめる）用の追加指示と設定
+BATCH_INSTRUCTION = """バッチ処理
+入力は文章のJSON配列です。配列の各要素を独立した文章として扱い、それぞれに上記のすべての指示とルールを適用してください。
+レスポンスは入力と同じ順序・同じ要素数の、処理後の文章（文字列）のJSON配列のみとしてください。
+"""
+
+BATCH_GENERATE_CONTENT_CONFIG = GENERATE_CONTENT_CONFIG.model_copy(update={
+  "response_mime_type": "application/json",
+  "response_schema": types.Schema(type="ARRAY", items=types.Schema(type="STRING")),
+  "system_instruction": [types.Part.from_text(text=SYSTEM_INSTRUCTION), types.Part.from_text(text=BATCH_INSTRUCTION)],
+})
+
+# GEMINI_BATCHING=trueで有効。ウィンドウ内に集まった入力をまとめて送る
+GEMINI_BATCHING = os.environ.get('GEMINI_BATCHING', 'false') == 'true'
+GEMINI_BATCH_MAX_SIZE = int(os.environ.get('GEMINI_BATCH_MAX_SIZE', '8'))
+GEMINI_BATCH_WINDOW_MS = float(os.environ.get('GEMINI_BATCH_WINDOW_MS', '50'))
+
+# プロンプト・モデル・設定が変わるとキャッシュのネームスペースも変わり、古い結果は参照されなくなる
+PROMPT_VERSION = hashlib.sha256(
+  f"{MODEL}\n{GENERATE_CONTENT_CONFIG.model_dump_json()}".encode("utf-8")
+).hexdigest()[:16]
+
+# 処理結果キャッシュ（同一の相槌などはGeminiを呼ばずに返す）
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get('GEMINI_CACHE_MAX_ENTRIES', '10000'))
+GEMINI_CACHE_TTL_SECONDS = float(os.environ.get('GEMINI_CACHE_TTL_SECONDS', '86400'))
+GEMINI_CACHE_MAX_INPUT_CHARS = int(os.environ.get('GEMINI_CACHE_MAX_INPUT_CHARS', '200'))
+generation_cache = TieredCache(
+  f"gemini:{PROMPT_VERSION}",
+  max_entries=GEMINI_CACHE_MAX_ENTRIES,
+  ttl_seconds=GEMINI_CACHE_TTL_SECONDS,
+)
+
+_client = None
+_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_in_flight = 0
+_waiting = 0
+
+# result: cache（キャッシュから返した）/ ok（Geminiで処理）/ fallback（原文を返した）
+gemini_generate_seconds = registry.histogram(
+  "gemini_generate_seconds", "Duration of generate() and generate_stream() calls", ("mode", "result"))
+gemini_first_chunk_seconds = registry.histogram(
+  "gemini_first_chunk_seconds", "Time until the first streamed chunk arrives")
+registry.gauge("gemini_in_flight", "Gemini requests currently running", collect=lambda: _in_flight)
+registry.gauge("gemini_waiting", "Gemini requests waiting for a concurrency slot", collect=lambda: _waiting)
+
+def get_client():
+  """プロセス全体で共有するGeminiクライアント（接続はクライアント内でプールされる）"""
+  global _client
+  if _client is None:
+    api_key = get_api_key()
+    if api_key == "fallback":
+      return None
+    _client = genai.Client(
+        vertexai=True,
+        api_key=api_key
+    )
+    print("[Gemini Debug] Shared client initialized")
+  return _client
+
+def warmup():
+  """起動時にAPIキーとクライアントを準備しておく"""
+  return get_client() is not None
+
+def get_gemini_stats():
+  """同時実行数と待機キューの深さ"""
+  return {
+    "in_flight": _in_flight,
+    "waiting": _waiting,
+    "max_concurrency": GEMINI_MAX_CONCURRENCY,
+    "cache": generation_cache.stats(),
+    "batching": micro_batcher.stats() if micro_batcher is not None else None,
+  }
+
+def _build_contents(input_text):
+  return [
     types.Content(
       role="user",
       parts=[
@@ -94,46 +193,266 @@ async def generate(input_text):
     )
   ]
 
-  generate_content_config = types.GenerateContentConfig(
-    temperature = 1,
-    top_p = 1,
-    seed = 0,
-    max_output_tokens = 65535,
-    safety_settings = [types.SafetySetting(
-      category="HARM_CATEGORY_HATE_SPEECH",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_DANGEROUS_CONTENT",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-      threshold="OFF"
-    ),types.SafetySetting(
-      category="HARM_CATEGORY_HARASSMENT",
-      threshold="OFF"
-    )],
-    system_instruction=[types.Part.from_text(text=si_text1)]
-  )
+@asynccontextmanager
+async def _concurrency_slot():
+  """同時実行数の枠を確保する（確保待ちの間は待機キューに数える）"""
+  global _in_flight, _waiting
+  _waiting += 1
+  try:
+    await _semaphore.acquire()
+  finally:
+    _waiting -= 1
+  _in_flight += 1
+  try:
+    yield
+  finally:
+    _in_flight -= 1
+    _semaphore.release()
+
+async def _call_gemini(input_text):
+  """Geminiで1件処理する。失敗・タイムアウト時はNoneを返す"""
+  client = get_client()
+  if client is None:
+    print("[Gemini Debug] Using fallback - returning original text")
+    return None
+
+  async with _concurrency_slot():
+    try:
+      # タイムアウトを設定
+      response = await asyncio.wait_for(
+        client.aio.models.generate_content(
+          model=MODEL,
+          contents=_build_contents(input_text),
+          config=GENERATE_CONTENT_CONFIG
+        ),
+        timeout=GEMINI_TIMEOUT_SECONDS
+      )
+      
+      response_text = response.text if response.text else ""
+      print(f"[Gemini Debug] Generated response: {response_text[:100]}...")
+      return response_text if response_text.strip() else None
+    except asyncio.TimeoutError:
+      print(f"[Gemini Debug] Generation timed out after {GEMINI_TIMEOUT_SECONDS:.0f} seconds")
+      return None
+    except Exception as e:
+      print(f"[Gemini Debug] Generation failed: {str(e)}")
+      return None
+
+async def _call_gemini_batch(input_texts):
+  """複数の入力を1リクエストで処理する。要素ごとに失敗した場合はNoneを返す"""
+  failed = [None] * len(input_texts)
+  client = get_client()
+  if client is None:
+    return failed
+
+  async with _concurrency_slot():
+    try:
+      response = await asyncio.wait_for(
+        client.aio.models.generate_content(
+          model=MODEL,
+          contents=_build_contents(json.dumps(input_texts, ensure_ascii=False)),
+          config=BATCH_GENERATE_CONTENT_CONFIG
+        ),
+        timeout=GEMINI_TIMEOUT_SECONDS
+      )
+      outputs = json.loads(response.text or "")
+    except asyncio.TimeoutError:
+      print(f"[Gemini Debug] Batch generation timed out after {GEMINI_TIMEOUT_SECONDS:.0f} seconds")
+      return failed
+    except Exception as e:
+      print(f"[Gemini Debug] Batch generation failed: {str(e)}")
+      return failed
+
+  if not isinstance(outputs, list) or len(outputs) != len(input_texts):
+    print(f"[Gemini Debug] Batch response shape mismatch: expected {len(input_texts)} items")
+    return failed
+  return [output if isinstance(output, str) and output.strip() else None for output in outputs]
 
+class GeminiMicroBatcher:
+  """短い時間窓に集まった入力を1回のGemini呼び出しにまとめる"""
+
+  def __init__(self, max_size: int = GEMINI_BATCH_MAX_SIZE, window_ms: float = GEMINI_BATCH_WINDOW_MS):
+    self.max_size = max(1, max_size)
+    self.window_seconds = window_ms / 1000
+    self._pending = []
+    self._timer = None
+    self._tasks = set()
+    self.batches = 0
+    self.items = 0
+
+  async def submit(self, input_text):
+    """入力を次のバッチに追加し、その入力の処理結果（失敗時はNone）を待つ"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append((input_text, future))
+    if len(self._pending) >= self.max_size:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.window_seconds, self._flush)
+    return await future
+
+  def _flush(self):
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    batch, self._pending = self._pending, []
+    if not batch:
+      return
+    task = asyncio.create_task(self._run(batch))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, batch):
+    texts = [text for text, _ in batch]
+    self.batches += 1
+    self.items += len(texts)
+    try:
+      if len(texts) == 1:
+        results = [await _call_gemini(texts[0])]
+      else:
+        results = await _call_gemini_batch(texts)
+    except Exception as e:
+      print(f"[Gemini Debug] Micro-batch failed: {e}")
+      results = [None] * len(texts)
+    for (_, future), result in zip(batch, results):
+      if not future.done():
+        future.set_result(result)
+
+  def stats(self):
+    return {
+      "batches": self.batches,
+      "items": self.items,
+      "average_batch_size": self.items / self.batches if self.batches else 0.0,
+      "pending": len(self._pending),
+    }
+
+micro_batcher = GeminiMicroBatcher() if GEMINI_BATCHING else None
+
+def _cache_key(input_text):
+  """正規化した入力文のハッシュ（プロンプトのバージョンはネームスペース側に含む）"""
+  normalized = " ".join(unicodedata.normalize("NFKC", input_text).split())
+  return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+async def generate(input_text):
+  with start_span("gemini.generate", new_trace=False, input_chars=len(input_text)) as span:
+    result = await _generate(input_text)
+    span.set_attribute("result", result[1])
+    return result[0]
+
+async def _generate(input_text):
+  """(処理済みテキスト, 結果の種類) を返す"""
+  started_at = time.perf_counter()
+  result = "fallback"
   try:
-    import asyncio
-    # 30秒のタイムアウトを設定
-    response = await asyncio.wait_for(
-      asyncio.to_thread(
-        client.models.generate_content,
-        model=model,
-        contents=contents,
-        config=generate_content_config
-      ),
-      timeout=30.0
-    )
-    
-    response_text = response.text if response.text else ""
-    print(f"[Gemini Debug] Generated response: {response_text[:100]}...")
-    return response_text if response_text.strip() else input_text
-  except asyncio.TimeoutError:
-    print(f"[Gemini Debug] Generation timed out after 30 seconds")
-    return input_text
-  except Exception as e:
-    print(f"[Gemini Debug] Generation failed: {str(e)}")
-    return input_text
\ No newline at end of file
+    cacheable = len(input_text) <= GEMINI_CACHE_MAX_INPUT_CHARS
+    if cacheable:
+      key = _cache_key(input_text)
+      cached = await generation_cache.get(key)
+      if cached is not None:
+        print(f"[Gemini Debug] Cache hit for input: {input_text[:20]}...")
+        result = "cache"
+        return cached, result
+
+    if micro_batcher is not None:
+      processed_text = await micro_batcher.submit(input_text)
+    else:
+      processed_text = await _call_gemini(input_text)
+    if processed_text is None:
+      # 失敗時の原文フォールバックはキャッシュしない
+      return input_text, result
+
+    if cacheable:
+      await generation_cache.set(key, processed_text)
+    result = "ok"
+    return processed_text, result
+  finally:
+    gemini_generate_seconds.observe(time.perf_counter() - started_at, mode="unary", result=result)
+
+async def invalidate_generation_cache():
+  """現在のプロンプトバージョンのキャッシュを明示的に破棄する"""
+  deleted = await generation_cache.clear()
+  print(f"[Gemini Debug] Generation cache cleared ({deleted} shared entries)")
+  return deleted
+
+async def generate_stream(input_text):
+  """処理済みテキストを生成途中から順に返す非同期ジェネレーター
+
+  各要素はそれまでの累積テキストで、最後の要素が最終結果になる。
+  失敗・タイムアウト時は最後に原文を返す。
+  """
+  # yieldをまたいで現在のスパンを切り替えないよう、スパンは手動で終了する
+  span = new_span("gemini.generate_stream", new_trace=False, input_chars=len(input_text))
+  try:
+    async for text in _generate_stream(input_text):
+      yield text
+  finally:
+    span.end()
+
+async def _generate_stream(input_text):
+  # マイクロバッチ有効時はまとめて処理した最終結果だけを返す
+  if micro_batcher is not None:
+    yield await generate(input_text)
+    return
+
+  started_at = time.perf_counter()
+  cacheable = len(input_text) <= GEMINI_CACHE_MAX_INPUT_CHARS
+  if cacheable:
+    key = _cache_key(input_text)
+    cached = await generation_cache.get(key)
+    if cached is not None:
+      print(f"[Gemini Debug] Cache hit for input: {input_text[:20]}...")
+      gemini_generate_seconds.observe(time.perf_counter() - started_at, mode="stream", result="cache")
+      yield cached
+      return
+
+  client = get_client()
+  if client is None:
+    print("[Gemini Debug] Using fallback - returning original text")
+    gemini_generate_seconds.observe(time.perf_counter() - started_at, mode="stream", result="fallback")
+    yield input_text
+    return
+
+  accumulated = ""
+  completed = False
+  async with _concurrency_slot():
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GEMINI_TIMEOUT_SECONDS
+    try:
+      stream = await asyncio.wait_for(
+        client.aio.models.generate_content_stream(
+          model=MODEL,
+          contents=_build_contents(input_text),
+          config=GENERATE_CONTENT_CONFIG
+        ),
+        timeout=GEMINI_TIMEOUT_SECONDS
+      )
+      chunks = stream.__aiter__()
+      while True:
+        # ストリーム全体で元の30秒の制限を守る
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+          raise asyncio.TimeoutError()
+        try:
+          chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+        except StopAsyncIteration:
+          break
+        if chunk.text:
+          if not accumulated:
+            gemini_first_chunk_seconds.observe(time.perf_counter() - started_at)
+          accumulated += chunk.text
+          yield accumulated
+      completed = True
+    except asyncio.TimeoutError:
+      print(f"[Gemini Debug] Streaming generation timed out after {GEMINI_TIMEOUT_SECONDS:.0f} seconds")
+    except Exception as e:
+      print(f"[Gemini Debug] Streaming generation failed: {str(e)}")
+
+  if not completed or not accumulated.strip():
+    gemini_generate_seconds.observe(time.perf_counter() - started_at, mode="stream", result="fallback")
+    yield input_text
+    return
+
+  gemini_generate_seconds.observe(time.perf_counter() - started_at, mode="stream", result="ok")
+  print(f"[Gemini Debug] Streamed response: {accumulated[:100]}...")
+  if cacheable:
+    await generation_cache.set(key, accumulated)
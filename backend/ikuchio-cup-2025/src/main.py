@@ -1,4 +1,6 @@
+from clients import clients
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import JSONResponse
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from routers import users, rooms
@@ -6,24 +8,50 @@ import json
 import os
 import asyncio
 from contextlib import asynccontextmanager
+from typing import Optional
 from starlette.websockets import WebSocketState
-# from websocket_manager import websocket_manager
+from websocket_manager import websocket_manager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("[Startup] Application starting up...")
     
+    # 共有クライアントの準備はバックグラウンドで行い、完了するまで/readyは503を返す
+    warmup_task = asyncio.create_task(clients.warmup())
+    
     # ルームスケジューラーを開始
     from scheduler.room_scheduler import room_scheduler
     asyncio.create_task(room_scheduler.start())
     
+    # マッチングループを開始
+    from matchmaking.matchmaker import matchmaker
+    asyncio.create_task(matchmaker.start())
+    
+    # メッセージ処理ワーカーを開始
+    from messaging.worker import message_worker_pool
+    await message_worker_pool.start()
+    
     # Redis Pub/Sub購読を開始
-    # await websocket_manager.start_subscriber()
+    await websocket_manager.start_subscriber()
+    
+    # Firebaseの署名用証明書の定期取得を開始
+    from auth.firebase_auth import certificate_refresher
+    certificate_refresher.start()
+    
+    # イベントループのブロック時間の計測を開始
+    from metrics import monitor_event_loop_lag
+    loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
     
     yield
     
-    # ルームスケジューラーを停止
+    # スケジューラー・マッチャー・ワーカー・購読を停止
     room_scheduler.stop()
+    matchmaker.stop()
+    await message_worker_pool.stop()
+    await websocket_manager.stop_subscriber()
+    certificate_refresher.stop()
+    loop_lag_task.cancel()
+    warmup_task.cancel()
     print("[Shutdown] Application shutting down...")
 
 # 本番環境では/docsを無効化
@@ -55,6 +83,12 @@ def health_check():
         print(f"[Health] Traceback: {traceback.format_exc()}")
         return {"message": f"Health check failed: {str(e)}", "status": "error"}
 
+@app.get("/ready")
+def readiness_check():
+    """共有クライアントのウォームアップが終わるまで503（readinessProbe用）"""
+    status = clients.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/api/status")
 def api_status():
     """APIの状態を詳細に返すエンドポイント"""
@@ -85,27 +119,32 @@ def api_status():
 def api_health_check():
     return {"message": "API is working!", "status": "ok"}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus形式のメトリクス（HPAのカスタム指標にも使う）"""
+    from fastapi.responses import PlainTextResponse
+    from metrics import registry
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/debug")
-def debug_database():
+async def debug_database():
     import os
     from gcp.gemini import get_api_key
+    from db.storage import storage
+    from db.users import firestore_get_all_users
+    from db.rooms import firestore_get_all_rooms
     
-    # Firestoreアクセスをテスト
+    # ストレージへのアクセスをテスト
     firestore_status = "unknown"
     users = []
     rooms = []
     
-    if os.environ.get('DISABLE_FIRESTORE') == 'true':
-        firestore_status = "disabled"
-    else:
-        try:
-            from db.users import firestore_get_all_users
-            from db.rooms import firestore_get_all_rooms
-            users = firestore_get_all_users()
-            rooms = firestore_get_all_rooms()
-            firestore_status = "success"
-        except Exception as e:
-            firestore_status = f"error: {str(e)}"
+    try:
+        users = await firestore_get_all_users()
+        rooms = await firestore_get_all_rooms()
+        firestore_status = "success" if storage.name == "firestore" else f"disabled ({storage.name} storage)"
+    except Exception as e:
+        firestore_status = f"error: {str(e)}"
     
     # API KEYのテスト
     api_key_status = "unknown"
@@ -127,10 +166,29 @@ def debug_database():
             "GOOGLE_CLOUD_PROJECT": os.environ.get("GOOGLE_CLOUD_PROJECT", "Not set"),
             "GCLOUD_PROJECT": os.environ.get("GCLOUD_PROJECT", "Not set")
         },
+        "storage": storage.stats(),
         "users": users[:5] if users else [],  # 最初の5件のみ
         "rooms": rooms[:5] if rooms else []   # 最初の5件のみ
     }
 
+# 全Pod共有のキャッシュを消せるので、/docsと同じく本番環境では登録しない
+if not is_production:
+    @app.post("/api/debug/gemini-cache/clear")
+    async def clear_gemini_cache():
+        """Gemini処理結果キャッシュ（現在のプロンプトバージョン）を破棄する
+
+        プロンプトやモデルを変えた場合はPROMPT_VERSIONが変わるので不要。同じプロンプトのまま
+        誤った結果がキャッシュされた場合などに使う。消えるのはRedisとこのPodのプロセス内の
+        エントリで、他のPodのプロセス内のエントリは期限切れか再起動まで残る。
+        本番環境（ENVIRONMENT=production）では登録しない。
+        """
+        from gcp.gemini import invalidate_generation_cache, PROMPT_VERSION
+        try:
+            deleted = await invalidate_generation_cache()
+            return {"status": "cleared", "prompt_version": PROMPT_VERSION, "deleted_shared_entries": deleted}
+        except Exception as e:
+            return {"error": f"Failed to clear Gemini cache: {str(e)}"}
+
 @app.get("/api/test-secret")
 def test_secret_manager():
     """Secret Manager接続テスト用エンドポイント"""
@@ -161,50 +219,49 @@ def test_secret_manager():
         return error_info
 
 
-# WebSocket接続管理
-active_connections = {}
+async def _replay_room_events(websocket: WebSocket, room_id: str, last_seq: Optional[int]):
+    """last_seqより後のイベントを再送し、最後に現在の連番を伝える"""
+    from messaging.room_events import room_event_log
+    try:
+        if last_seq is not None:
+            events = await room_event_log.read_after(room_id, last_seq)
+            if events is None:
+                # イベントログから消えた範囲がある場合はHTTPで取り直してもらう
+                websocket_manager.send_to_connection(websocket, room_id, {"type": "resync", "room_id": room_id})
+            else:
+                for event in events:
+                    websocket_manager.send_to_connection(websocket, room_id, event)
+                print(f"[WebSocket] Replayed {len(events)} events to room {room_id} after seq {last_seq}")
+        seq = await room_event_log.current_seq(room_id)
+        websocket_manager.send_to_connection(websocket, room_id, {"type": "sync", "room_id": room_id, "seq": seq})
+    except Exception as e:
+        print(f"[WebSocket] Failed to replay events for room {room_id}: {e}")
+        websocket_manager.send_to_connection(websocket, room_id, {"type": "resync", "room_id": room_id})
 
 @app.websocket("/ws/{room_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str):
-    await websocket.accept()
-    
-    if room_id not in active_connections:
-        active_connections[room_id] = []
-    active_connections[room_id].append(websocket)
+async def websocket_endpoint(websocket: WebSocket, room_id: str, last_seq: Optional[int] = None):
+    # 先に購読を始めてから再送するので、その間のイベントも取りこぼさない（重複はseqで除外される）
+    await websocket_manager.connect(websocket, room_id)
+    await _replay_room_events(websocket, room_id, last_seq)
     
     try:
         while True:
             data = await websocket.receive_text()
             print(f"[WebSocket] Received message in room {room_id}: {data}")
             
-            # 同じルームの他の接続にメッセージを送信
-            for connection in active_connections[room_id]:
-                if connection != websocket:
-                    try:
-                        await connection.send_text(data)
-                    except:
-                        pass
+            # 同じルームの他の接続（他Podを含む）にメッセージを送信
+            await websocket_manager.publish_message(room_id, data, exclude=websocket)
                 
     except (WebSocketDisconnect, Exception) as e:
         print(f"[WebSocket] Client disconnected from room {room_id}: {e}")
     finally:
-        try:
-            active_connections[room_id].remove(websocket)
-            if not active_connections[room_id]:
-                del active_connections[room_id]
-        except (ValueError, KeyError):
-            pass
+        await websocket_manager.disconnect(websocket, room_id)
 
 try:
-    import os
-    if os.environ.get('DISABLE_FIRESTORE') == 'true':
-        from routers import users_simple
-        app.include_router(users_simple.users_router)
-        print("[Startup] Simple routers loaded (Firestore disabled)")
-    else:
-        app.include_router(users.users_router)
-        app.include_router(rooms.rooms_router)
-        print("[Startup] Full routers loaded successfully")
+    # DISABLE_FIRESTORE=true（またはSTORAGE_BACKEND=memory）ならインメモリストレージで同じAPIを提供する
+    app.include_router(users.users_router)
+    app.include_router(rooms.rooms_router)
+    print("[Startup] Full routers loaded successfully")
 except Exception as e:
     print(f"[Startup] Error loading routers: {str(e)}")
     import traceback
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from matchmaking.queue import create_match_queue
+from db.rooms import firestore_create_room_for_pair
+from metrics import registry
+
+# 他Podでのenqueueに気付くまでの最大待ち時間
+MATCH_POLL_INTERVAL = float(os.environ.get('MATCHMAKING_POLL_INTERVAL', '1.0'))
+
+class Matchmaker:
+    """待機キューから2人ずつ取り出してルームを作成する
+
+    pop_pairはキュー側でアトミックなので、複数Podでマッチャーが動いても同じユーザーが
+    二重に取り出されることはない。ルーム作成はFirestoreトランザクションで行い、
+    既に割り当て済みのユーザーは捨て、未割り当ての相手は元の到着時刻のスコアでキューに
+    戻す（後から来たユーザーに順番を抜かされない）。
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue
+        self.running = False
+        self._wakeup = asyncio.Event()
+        self.matched_pairs = 0
+
+    def _get_queue(self):
+        if self.queue is None:
+            self.queue = create_match_queue()
+        return self.queue
+
+    async def enqueue(self, firebase_uid: str) -> bool:
+        """ユーザーを待機キューに追加（待機中なら何もしない）"""
+        added = await self._get_queue().enqueue(firebase_uid)
+        if added:
+            print(f"[Matchmaking] User user_{firebase_uid} joined the waiting queue")
+            self._wakeup.set()
+        return added
+
+    async def match_available(self) -> int:
+        """キューに2人以上いる限りマッチングを続け、作成したルーム数を返す"""
+        queue = self._get_queue()
+        created = 0
+        while True:
+            popped = await queue.pop_pair_with_scores()
+            if not popped:
+                return created
+            scores = dict(popped)
+            pair = [firebase_uid for firebase_uid, _ in popped]
+            try:
+                room_data, unmatched = await firestore_create_room_for_pair(pair[0], pair[1])
+            except Exception as e:
+                # Firestore障害時はキューに戻して次のループまで待つ
+                print(f"[Matchmaking] Failed to create room for {pair}: {e}")
+                for firebase_uid in pair:
+                    await queue.enqueue(firebase_uid, scores[firebase_uid])
+                return created
+            if room_data:
+                created += 1
+                self.matched_pairs += 1
+            for firebase_uid in unmatched:
+                await queue.enqueue(firebase_uid, scores.get(firebase_uid))
+
+    async def start(self):
+        """マッチングループを開始"""
+        if self.running:
+            return
+
+        self.running = True
+        print("[Matchmaking] Matchmaker started")
+
+        while self.running:
+            try:
+                await self.match_available()
+            except Exception as e:
+                print(f"[Matchmaking] Error in matchmaker loop: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=MATCH_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stop(self):
+        """マッチングループを停止"""
+        self.running = False
+        self._wakeup.set()
+        print("[Matchmaking] Matchmaker stopped")
+
+# グローバルインスタンス
+matchmaker = Matchmaker()
+
+async def _collect_waiting_users():
+    return await matchmaker._get_queue().size()
+
+registry.gauge("matchmaking_waiting_users", "Users waiting in the matchmaking queue", collect=_collect_waiting_users)
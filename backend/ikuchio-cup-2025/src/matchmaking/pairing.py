@@ -0,0 +1,299 @@
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# 1世代のBloomフィルタに記録するリセット回数（2世代持つので、この1〜2倍の回数は同じ相手と組まない）
+PAIR_HISTORY_GENERATION_EPOCHS = int(os.environ.get('PAIR_HISTORY_GENERATION_EPOCHS', '14'))
+# Bloomフィルタの偽陽性率（偽陽性は「組んだことがある」と誤判定して別の相手を探すだけ）
+PAIR_HISTORY_ERROR_RATE = float(os.environ.get('PAIR_HISTORY_ERROR_RATE', '0.01'))
+# 相手が見つからない時に遡って試す待機中ユーザー数
+PAIRING_LOOKAHEAD = int(os.environ.get('PAIRING_LOOKAHEAD', '16'))
+# 最後に残ったユーザーを既存のペアと組み替えて解消する試行回数
+PAIRING_REPAIR_ATTEMPTS = int(os.environ.get('PAIRING_REPAIR_ATTEMPTS', '256'))
+
+_MASK32 = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MAGIC = b"PH1"
+
+def user_hash(firebase_uid: str) -> int:
+    """プロセスによらず同じ値になる64bitのユーザーハッシュ"""
+    return int.from_bytes(hashlib.blake2b(firebase_uid.encode("utf-8"), digest_size=8).digest(), "little")
+
+def pair_key(hash1: int, hash2: int) -> int:
+    """2人のユーザーハッシュから、順序によらない64bitのペアキーを作る"""
+    if hash1 > hash2:
+        hash1, hash2 = hash2, hash1
+    return ((hash1 * _GOLDEN) ^ hash2) & _MASK64
+
+class BloomFilter:
+    """ペアキーのBloomフィルタ（ダブルハッシュでhashes個のビットを立てる）"""
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, size: int, hashes: int, bits: Optional[bytearray] = None, count: int = 0):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+        self.count = count
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        capacity = max(1, capacity)
+        size = max(64, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hashes)
+
+    def add(self, key: int):
+        h1 = key & _MASK32
+        h2 = (key >> 32) | 1
+        size = self.size
+        bits = self.bits
+        for i in range(self.hashes):
+            index = (h1 + i * h2) % size
+            bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def add_many(self, keys):
+        size = self.size
+        bits = self.bits
+        probes = range(self.hashes)
+        count = 0
+        for key in keys:
+            h1 = key & _MASK32
+            h2 = (key >> 32) | 1
+            for i in probes:
+                index = (h1 + i * h2) % size
+                bits[index >> 3] |= 1 << (index & 7)
+            count += 1
+        self.count += count
+
+    def __contains__(self, key: int) -> bool:
+        h1 = key & _MASK32
+        h2 = (key >> 32) | 1
+        size = self.size
+        bits = self.bits
+        for i in range(self.hashes):
+            index = (h1 + i * h2) % size
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def estimated_error_rate(self, extra: int = 0) -> float:
+        """あとextra件追加した時の偽陽性率の見積もり"""
+        return (1 - math.exp(-self.hashes * (self.count + extra) / self.size)) ** self.hashes
+
+class PairHistory:
+    """過去のリセットで組んだペアの索引と、前回余って次回に回すユーザー
+
+    ペアは64bitのキーにしてBloomフィルタに記録する（ユーザー数×日数に比例しない固定サイズ）。
+    フィルタは PAIR_HISTORY_GENERATION_EPOCHS 回ごとに新しい世代に切り替え、直近2世代だけ残す。
+    """
+
+    def __init__(self, generations: Optional[List[BloomFilter]] = None, last_epoch: Optional[str] = None,
+                 generation_epochs: int = 0, carry: Optional[List[str]] = None):
+        self.generations = generations or []
+        self.last_epoch = last_epoch
+        # 最新の世代に記録したリセット回数
+        self.generation_epochs = generation_epochs
+        self.carry = carry or []
+
+    def start_epoch(self, epoch: str, expected_pairs: int):
+        """epochのペアの記録を始める（同じepochのやり直しなら世代を進めない）"""
+        if epoch == self.last_epoch:
+            return
+        current = self.generations[-1] if self.generations else None
+        if (current is None or self.generation_epochs >= PAIR_HISTORY_GENERATION_EPOCHS
+                # ユーザーが増えて想定より埋まった場合も早めに切り替える
+                or current.estimated_error_rate(expected_pairs) > PAIR_HISTORY_ERROR_RATE * 2):
+            capacity = int(max(1, expected_pairs) * PAIR_HISTORY_GENERATION_EPOCHS * 1.2)
+            self.generations = self.generations[-1:] + [BloomFilter.for_capacity(capacity, PAIR_HISTORY_ERROR_RATE)]
+            self.generation_epochs = 0
+        self.generation_epochs += 1
+        self.last_epoch = epoch
+
+    def seen(self, key: int) -> bool:
+        for generation in self.generations:
+            if key in generation:
+                return True
+        return False
+
+    def checker(self):
+        """seen と同じ判定を、属性参照を省いてまとめて呼べる関数にする（組み合わせのループ用）"""
+        filters = [(g.size, range(g.hashes), g.bits) for g in self.generations]
+
+        def seen(key: int) -> bool:
+            h1 = key & _MASK32
+            h2 = (key >> 32) | 1
+            for size, probes, bits in filters:
+                for i in probes:
+                    index = (h1 + i * h2) % size
+                    if not bits[index >> 3] & (1 << (index & 7)):
+                        break
+                else:
+                    return True
+            return False
+        return seen
+
+    def record(self, key: int):
+        self.generations[-1].add(key)
+
+    def record_many(self, keys):
+        self.generations[-1].add_many(keys)
+
+    def record_epoch(self, epoch: str, pairs: Sequence[Tuple[str, str]], odd: Optional[str]) -> bool:
+        """有効になったepochの組み合わせを記録し、余った1人を次回に回す
+
+        match_users は計画用の索引に記録するだけなので、保存する索引にはエポックを
+        切り替えた後でこれを使って記録する。記録済みのepochなら何もせずFalseを返す。
+        """
+        if epoch == self.last_epoch:
+            return False
+        self.start_epoch(epoch, len(pairs))
+        self.record_many(pair_key(user_hash(first), user_hash(second)) for first, second in pairs)
+        self.carry = [odd] if odd is not None else []
+        return True
+
+    def to_bytes(self) -> bytes:
+        meta = {
+            "last_epoch": self.last_epoch,
+            "generation_epochs": self.generation_epochs,
+            "carry": self.carry,
+            "generations": [{"size": g.size, "hashes": g.hashes, "count": g.count} for g in self.generations],
+        }
+        header = json.dumps(meta).encode("utf-8")
+        return b"".join([_MAGIC, struct.pack("<I", len(header)), header] + [bytes(g.bits) for g in self.generations])
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "PairHistory":
+        """保存した索引を読み込む（ない・壊れている場合は空の索引）"""
+        if not data or not data.startswith(_MAGIC):
+            return cls()
+        try:
+            (header_length,) = struct.unpack_from("<I", data, len(_MAGIC))
+            offset = len(_MAGIC) + 4
+            meta = json.loads(data[offset:offset + header_length])
+            offset += header_length
+            generations = []
+            for generation in meta["generations"]:
+                length = (generation["size"] + 7) // 8
+                bits = bytearray(data[offset:offset + length])
+                if len(bits) != length:
+                    raise ValueError("Truncated pair history")
+                generations.append(BloomFilter(generation["size"], generation["hashes"], bits, generation["count"]))
+                offset += length
+        except (ValueError, KeyError, struct.error) as e:
+            print(f"[Pairing] Ignoring unreadable pair history: {e}")
+            return cls()
+        return cls(generations, meta["last_epoch"], meta["generation_epochs"], meta["carry"])
+
+    def stats(self) -> dict:
+        return {
+            "generations": len(self.generations),
+            "generation_epochs": self.generation_epochs,
+            "pairs": sum(g.count for g in self.generations),
+            "bytes": sum(len(g.bits) for g in self.generations),
+            "estimated_error_rate": round(self.generations[-1].estimated_error_rate(), 6) if self.generations else 0.0,
+        }
+
+def match_users(user_ids: Sequence[str], history: PairHistory, epoch: str,
+                lookahead: int = PAIRING_LOOKAHEAD, repair_attempts: int = PAIRING_REPAIR_ATTEMPTS,
+                rng: Optional[random.Random] = None) -> Tuple[List[Tuple[str, str]], Optional[str], dict]:
+    """user_ids（シャッフル済み）を、historyで組んだことのない2人ずつに分ける
+
+    前回余ったユーザー（history.carry）を先頭に回して優先的に組ませ、今回余った1人は
+    history.carry に入れて次回に回す。各ユーザーは直前に待っている最大lookahead人から
+    組める相手を探し、最後に残った人は既存のペアと組み替えて解消する。それでも組めない
+    場合だけ過去と同じペアを許す。組んだペアはhistoryに記録する。
+
+    戻り値は (ペアのリスト, 余ったユーザー or None, 統計)。
+    """
+    started_at = time.perf_counter()
+    rng = rng or random
+    carry = []
+    order = list(user_ids)
+    if history.carry:
+        present = set(user_ids)
+        carry = [uid for uid in dict.fromkeys(history.carry) if uid in present]
+        carried = set(carry)
+        order = carry + [uid for uid in user_ids if uid not in carried]
+    blake2b = hashlib.blake2b
+    from_bytes = int.from_bytes
+    hashes = [from_bytes(blake2b(uid.encode("utf-8"), digest_size=8).digest(), "little") for uid in order]
+    history.start_epoch(epoch, len(order) // 2)
+    seen = history.checker()
+
+    pairs: List[Tuple[int, int]] = []
+    waiting: List[int] = []
+    checks = 0
+    for index, user in enumerate(hashes):
+        if waiting:
+            # ほとんどの場合は直前に待っている人と組める
+            other = waiting[-1]
+            other_hash = hashes[other]
+            checks += 1
+            if not seen(((min(user, other_hash) * _GOLDEN) ^ max(user, other_hash)) & _MASK64):
+                waiting.pop()
+                pairs.append((other, index))
+                continue
+            stop = max(-1, len(waiting) - 1 - lookahead)
+            for position in range(len(waiting) - 2, stop, -1):
+                checks += 1
+                other = waiting[position]
+                if not seen(pair_key(hashes[other], user)):
+                    waiting[position] = waiting[-1]
+                    waiting.pop()
+                    pairs.append((other, index))
+                    break
+            else:
+                waiting.append(index)
+        else:
+            waiting.append(index)
+
+    # 残ったユーザー同士、または既存のペア (c, d) を (a, c)・(b, d) に組み替えて解消する
+    repeats = 0
+    repaired = 0
+    while len(waiting) >= 2:
+        a = waiting.pop()
+        partner = next((position for position, b in enumerate(waiting) if not seen(pair_key(hashes[a], hashes[b]))), None)
+        if partner is not None:
+            pairs.append((waiting.pop(partner), a))
+            continue
+        swapped = False
+        for _ in range(repair_attempts if pairs else 0):
+            pair_index = rng.randrange(len(pairs))
+            c, d = pairs[pair_index]
+            if seen(pair_key(hashes[a], hashes[c])):
+                c, d = d, c
+                if seen(pair_key(hashes[a], hashes[c])):
+                    continue
+            position = next((position for position, b in enumerate(waiting) if not seen(pair_key(hashes[b], hashes[d]))), None)
+            if position is not None:
+                pairs[pair_index] = (a, c)
+                pairs.append((waiting.pop(position), d))
+                repaired += 1
+                swapped = True
+                break
+        if not swapped:
+            # 全員と組んだことがある（ユーザーが少ない）場合は過去と同じペアを許す
+            pairs.append((waiting.pop(), a))
+            repeats += 1
+
+    history.record_many(pair_key(hashes[first], hashes[second]) for first, second in pairs)
+    odd = order[waiting[0]] if waiting else None
+    history.carry = [odd] if odd is not None else []
+
+    stats = {
+        "users": len(order),
+        "pairs": len(pairs),
+        "carried": len(carry),
+        "checks": checks,
+        "repaired": repaired,
+        "repeats": repeats,
+        "elapsed_seconds": round(time.perf_counter() - started_at, 4),
+    }
+    return [(order[first], order[second]) for first, second in pairs], odd, stats
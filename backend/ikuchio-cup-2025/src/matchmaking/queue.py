@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+from typing import List, Optional, Tuple
+
+class MatchQueue:
+    """マッチング待ちユーザーのキュー（到着順）
+
+    enqueueは冪等で、pop_pairは2人揃っている場合のみ2人をアトミックに取り出す。
+    """
+
+    async def enqueue(self, firebase_uid: str, score: Optional[float] = None) -> bool:
+        """キューに追加する。既に待機中なら何もせずFalseを返す"""
+        raise NotImplementedError
+
+    async def pop_pair(self) -> Optional[List[str]]:
+        """先頭の2人を取り出す。2人未満ならNone"""
+        pair = await self.pop_pair_with_scores()
+        return [firebase_uid for firebase_uid, _ in pair] if pair else None
+
+    async def pop_pair_with_scores(self) -> Optional[List[Tuple[str, float]]]:
+        """先頭の2人を (firebase_uid, 到着時刻のスコア) で取り出す（戻す時に元の順番を保つため）"""
+        raise NotImplementedError
+
+    async def remove(self, firebase_uid: str):
+        raise NotImplementedError
+
+    async def contains(self, firebase_uid: str) -> bool:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        raise NotImplementedError
+
+class InMemoryMatchQueue(MatchQueue):
+    """単一Pod・ローカル開発用のキュー"""
+
+    def __init__(self):
+        # dictは挿入順を保持するのでFIFOとして使える
+        self._waiting = {}
+        self._lock = asyncio.Lock()
+
+    async def enqueue(self, firebase_uid: str, score: Optional[float] = None) -> bool:
+        async with self._lock:
+            if firebase_uid in self._waiting:
+                return False
+            self._waiting[firebase_uid] = score if score is not None else time.time()
+            if score is not None:
+                # 再投入されたユーザーは元の順番に戻す
+                self._waiting = dict(sorted(self._waiting.items(), key=lambda item: item[1]))
+            return True
+
+    async def pop_pair_with_scores(self) -> Optional[List[Tuple[str, float]]]:
+        async with self._lock:
+            if len(self._waiting) < 2:
+                return None
+            pair = []
+            for _ in range(2):
+                uid = next(iter(self._waiting))
+                pair.append((uid, self._waiting.pop(uid)))
+            return pair
+
+    async def remove(self, firebase_uid: str):
+        async with self._lock:
+            self._waiting.pop(firebase_uid, None)
+
+    async def contains(self, firebase_uid: str) -> bool:
+        return firebase_uid in self._waiting
+
+    async def size(self) -> int:
+        return len(self._waiting)
+
+# 2人以上待機している場合のみ先頭2人をスコアごとまとめて取り出す（member, score, member, score）
+_POP_PAIR_SCRIPT = """
+if redis.call('ZCARD', KEYS[1]) < 2 then
+  return {}
+end
+return redis.call('ZPOPMIN', KEYS[1], 2)
+"""
+
+class RedisMatchQueue(MatchQueue):
+    """全Podで共有するキュー（到着時刻をスコアにしたソート済みセット）"""
+
+    def __init__(self, redis_url: str, key: str = "matchmaking:waiting"):
+        from clients import clients
+        self.redis = clients.redis(redis_url)
+        self.key = key
+        self._pop_pair = self.redis.register_script(_POP_PAIR_SCRIPT)
+
+    async def enqueue(self, firebase_uid: str, score: Optional[float] = None) -> bool:
+        added = await self.redis.zadd(self.key, {firebase_uid: score if score is not None else time.time()}, nx=True)
+        return bool(added)
+
+    async def pop_pair_with_scores(self) -> Optional[List[Tuple[str, float]]]:
+        popped = await self._pop_pair(keys=[self.key])
+        if not popped:
+            return None
+        return [(popped[0], float(popped[1])), (popped[2], float(popped[3]))]
+
+    async def remove(self, firebase_uid: str):
+        await self.redis.zrem(self.key, firebase_uid)
+
+    async def contains(self, firebase_uid: str) -> bool:
+        return await self.redis.zscore(self.key, firebase_uid) is not None
+
+    async def size(self) -> int:
+        return await self.redis.zcard(self.key)
+
+def create_match_queue() -> MatchQueue:
+    """MATCHMAKING_BACKEND（redis/memory）に応じてキューを生成"""
+    backend = os.environ.get('MATCHMAKING_BACKEND')
+    redis_url = os.environ.get('REDIS_URL')
+    if backend is None:
+        backend = 'redis' if redis_url else 'memory'
+    if backend == 'redis':
+        print("[Matchmaking] Using Redis match queue")
+        return RedisMatchQueue(redis_url or 'redis://localhost:6379')
+    print("[Matchmaking] Using in-memory match queue")
+    return InMemoryMatchQueue()
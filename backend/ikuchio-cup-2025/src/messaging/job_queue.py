@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import time
+from typing import List, Optional
+
+class Job:
+    """キューに積むメッセージ処理ジョブ"""
+    __slots__ = ("id", "payload", "attempts", "raw")
+
+    def __init__(self, id: str, payload: dict, attempts: int = 0, raw: Optional[str] = None):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+        self.raw = raw
+
+    def dumps(self) -> str:
+        return json.dumps({"id": self.id, "payload": self.payload, "attempts": self.attempts}, ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, raw: str) -> "Job":
+        data = json.loads(raw)
+        return cls(data["id"], data["payload"], data.get("attempts", 0), raw=raw)
+
+class JobQueue:
+    """少なくとも1回配送（at-least-once）のジョブキュー
+
+    dequeueしたジョブはackするまで処理中として保持され、retryで再投入、
+    dead_letterで処理を諦めたジョブの置き場に移す。
+    """
+
+    async def enqueue(self, job: Job):
+        raise NotImplementedError
+
+    async def dequeue(self, timeout: float) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def ack(self, job: Job):
+        raise NotImplementedError
+
+    async def retry(self, job: Job):
+        raise NotImplementedError
+
+    async def dead_letter(self, job: Job, error: str):
+        raise NotImplementedError
+
+    async def recover_expired(self) -> int:
+        """処理中のままリースが切れた（ワーカーが落ちた）ジョブを再投入し、件数を返す"""
+        return 0
+
+    async def depth(self) -> dict:
+        raise NotImplementedError
+
+class InMemoryJobQueue(JobQueue):
+    """単一Pod・ローカル開発用のキュー（プロセス終了で消える）"""
+
+    def __init__(self):
+        self._pending = asyncio.Queue()
+        self._processing = {}
+        self.dead: List[dict] = []
+
+    async def enqueue(self, job: Job):
+        await self._pending.put(job)
+
+    async def dequeue(self, timeout: float) -> Optional[Job]:
+        try:
+            job = await asyncio.wait_for(self._pending.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._processing[job.id] = job
+        return job
+
+    async def ack(self, job: Job):
+        self._processing.pop(job.id, None)
+
+    async def retry(self, job: Job):
+        self._processing.pop(job.id, None)
+        job.attempts += 1
+        await self._pending.put(job)
+
+    async def dead_letter(self, job: Job, error: str):
+        self._processing.pop(job.id, None)
+        self.dead.append({"id": job.id, "payload": job.payload, "attempts": job.attempts, "error": error})
+
+    async def depth(self) -> dict:
+        return {"pending": self._pending.qsize(), "processing": len(self._processing), "dead": len(self.dead)}
+
+class RedisJobQueue(JobQueue):
+    """Redisのリストを使った永続キュー（BLMOVEで処理中リストへ移してからリースを記録）"""
+
+    def __init__(self, redis_url: str, name: str = "message_jobs", lease_seconds: float = 120):
+        from clients import clients
+        self.redis = clients.redis(redis_url)
+        self.pending_key = f"{name}:pending"
+        self.processing_key = f"{name}:processing"
+        self.leases_key = f"{name}:leases"
+        self.dead_key = f"{name}:dead"
+        self.lease_seconds = lease_seconds
+
+    async def enqueue(self, job: Job):
+        await self.redis.lpush(self.pending_key, job.dumps())
+
+    async def dequeue(self, timeout: float) -> Optional[Job]:
+        raw = await self.redis.blmove(self.pending_key, self.processing_key, timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        job = Job.loads(raw)
+        await self.redis.hset(self.leases_key, job.id, time.time() + self.lease_seconds)
+        return job
+
+    async def ack(self, job: Job):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, job.raw)
+            pipe.hdel(self.leases_key, job.id)
+            await pipe.execute()
+
+    async def retry(self, job: Job):
+        job.attempts += 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, job.raw)
+            pipe.hdel(self.leases_key, job.id)
+            pipe.lpush(self.pending_key, job.dumps())
+            await pipe.execute()
+
+    async def dead_letter(self, job: Job, error: str):
+        entry = json.dumps({"id": job.id, "payload": job.payload, "attempts": job.attempts, "error": error}, ensure_ascii=False)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrem(self.processing_key, 1, job.raw)
+            pipe.hdel(self.leases_key, job.id)
+            pipe.lpush(self.dead_key, entry)
+            await pipe.execute()
+
+    async def recover_expired(self) -> int:
+        now = time.time()
+        recovered = 0
+        for raw in await self.redis.lrange(self.processing_key, 0, -1):
+            job = Job.loads(raw)
+            expires_at = await self.redis.hget(self.leases_key, job.id)
+            if expires_at is None:
+                # BLMOVE直後でまだリースが書かれていない可能性があるので猶予を与える
+                await self.redis.hsetnx(self.leases_key, job.id, now + self.lease_seconds)
+                continue
+            if float(expires_at) > now:
+                continue
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(self.processing_key, 1, raw)
+                pipe.hdel(self.leases_key, job.id)
+                pipe.rpush(self.pending_key, raw)
+                results = await pipe.execute()
+            if results[0]:
+                recovered += 1
+        return recovered
+
+    async def depth(self) -> dict:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(self.pending_key)
+            pipe.llen(self.processing_key)
+            pipe.llen(self.dead_key)
+            pending, processing, dead = await pipe.execute()
+        return {"pending": pending, "processing": processing, "dead": dead}
+
+def create_job_queue() -> JobQueue:
+    """MESSAGE_QUEUE_BACKEND（redis/memory）に応じてキューを生成"""
+    backend = os.environ.get('MESSAGE_QUEUE_BACKEND')
+    redis_url = os.environ.get('REDIS_URL')
+    if backend is None:
+        backend = 'redis' if redis_url else 'memory'
+    if backend == 'redis':
+        print("[MessageQueue] Using Redis job queue")
+        return RedisJobQueue(redis_url or 'redis://localhost:6379')
+    print("[MessageQueue] Using in-memory job queue")
+    return InMemoryJobQueue()
@@ -0,0 +1,42 @@
+import os
+from messaging.room_events import room_event_log
+
+# Geminiの生成途中のテキストをWebSocketに逐次配信する
+MESSAGE_STREAMING = os.environ.get('MESSAGE_STREAMING', 'true') == 'true'
+
+async def publish_new_message(room_id: str, turn: dict, sender_id: str):
+    """処理済みターンの保存完了を全Podに通知
+
+    通知にはルーム内の連番(seq)とターン本体を含め、イベントログにも残す。
+    再接続したクライアントはlast_seq以降をイベントログから再送してもらう。
+    """
+    from websocket_manager import websocket_manager
+    notification = {
+        "type": "new_message",
+        "room_id": room_id,
+        "message_id": turn.get("id", ""),
+        "sender_id": sender_id,
+        "turn": turn
+    }
+    try:
+        notification["seq"] = await room_event_log.append(room_id, notification)
+    except Exception as e:
+        # 連番なしでも通知自体は届ける（クライアントはHTTPで取得する）
+        print(f"[RoomEvents] Failed to append event for room {room_id}: {e}")
+    await websocket_manager.publish_message(room_id, notification)
+
+def partial_publisher(room_id: str, sender_id: str):
+    """生成途中のテキストをルームのWebSocket購読者に配信するコールバックを作る"""
+    if not MESSAGE_STREAMING:
+        return None
+    from websocket_manager import websocket_manager
+    
+    async def publish_partial(turn_id: str, processed_text: str):
+        await websocket_manager.publish_message(room_id, {
+            "type": "partial_message",
+            "room_id": room_id,
+            "message_id": turn_id,
+            "sender_id": sender_id,
+            "processed_text": processed_text
+        })
+    return publish_partial
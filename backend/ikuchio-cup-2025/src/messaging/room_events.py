@@ -0,0 +1,114 @@
+import json
+import os
+from collections import deque
+from typing import List, Optional
+
+# ルームごとに保持する直近イベント数と保持期間（ルームは日替わりなので2日で十分）
+ROOM_EVENTS_MAX_LEN = int(os.environ.get('ROOM_EVENTS_MAX_LEN', '500'))
+ROOM_EVENTS_TTL_SECONDS = int(os.environ.get('ROOM_EVENTS_TTL_SECONDS', str(2 * 24 * 3600)))
+
+class RoomEventLog:
+    """ルームごとの連番付きイベントログ（再接続時の取りこぼし再送用）
+
+    appendはルーム内で単調増加する連番(seq)を割り当てて返す。read_afterは
+    last_seqより後のイベントを返し、既にログから消えた範囲が含まれる場合はNoneを返す
+    （クライアントはHTTPで差分取得し直す）。
+    """
+
+    async def append(self, room_id: str, event: dict) -> int:
+        raise NotImplementedError
+
+    async def read_after(self, room_id: str, last_seq: int) -> Optional[List[dict]]:
+        raise NotImplementedError
+
+    async def current_seq(self, room_id: str) -> int:
+        raise NotImplementedError
+
+class InMemoryRoomEventLog(RoomEventLog):
+    """単一Pod・ローカル開発用のリングバッファ"""
+
+    def __init__(self, max_len: int = ROOM_EVENTS_MAX_LEN):
+        self.max_len = max_len
+        self._events = {}
+        self._seqs = {}
+
+    async def append(self, room_id: str, event: dict) -> int:
+        seq = self._seqs.get(room_id, 0) + 1
+        self._seqs[room_id] = seq
+        self._events.setdefault(room_id, deque(maxlen=self.max_len)).append({**event, "seq": seq})
+        return seq
+
+    async def read_after(self, room_id: str, last_seq: int) -> Optional[List[dict]]:
+        events = self._events.get(room_id)
+        current = self._seqs.get(room_id, 0)
+        if last_seq >= current:
+            return []
+        if not events or events[0]["seq"] > last_seq + 1:
+            return None
+        return [event for event in events if event["seq"] > last_seq]
+
+    async def current_seq(self, room_id: str) -> int:
+        return self._seqs.get(room_id, 0)
+
+# 連番の採番とストリームへの追加をアトミックに行う（ストリームIDを "{seq}-0" にする）
+_APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[2])
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], seq .. '-0', 'event', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+class RedisRoomEventLog(RoomEventLog):
+    """Redis Streamを使った全Pod共有のイベントログ"""
+
+    def __init__(self, redis_url: str, max_len: int = ROOM_EVENTS_MAX_LEN, ttl_seconds: int = ROOM_EVENTS_TTL_SECONDS):
+        from clients import clients
+        self.redis = clients.redis(redis_url)
+        self.max_len = max_len
+        self.ttl_seconds = ttl_seconds
+        self._append = self.redis.register_script(_APPEND_SCRIPT)
+
+    def _keys(self, room_id: str):
+        return [f"room_events:{room_id}", f"room_seq:{room_id}"]
+
+    async def append(self, room_id: str, event: dict) -> int:
+        seq = await self._append(
+            keys=self._keys(room_id),
+            args=[json.dumps(event, ensure_ascii=False), self.max_len, self.ttl_seconds],
+        )
+        return int(seq)
+
+    async def read_after(self, room_id: str, last_seq: int) -> Optional[List[dict]]:
+        stream_key, seq_key = self._keys(room_id)
+        current = int(await self.redis.get(seq_key) or 0)
+        if last_seq >= current:
+            return []
+        entries = await self.redis.xrange(stream_key, min=f"{last_seq + 1}-0", max="+")
+        events = []
+        for entry_id, fields in entries:
+            event = json.loads(fields["event"])
+            event["seq"] = int(entry_id.split("-", 1)[0])
+            events.append(event)
+        # MAXLENで切り詰められて先頭が欠けている場合は再送できない
+        if not events or events[0]["seq"] != last_seq + 1:
+            return None
+        return events
+
+    async def current_seq(self, room_id: str) -> int:
+        return int(await self.redis.get(self._keys(room_id)[1]) or 0)
+
+def create_room_event_log() -> RoomEventLog:
+    """ROOM_EVENTS_BACKEND（redis/memory）に応じてイベントログを生成"""
+    backend = os.environ.get('ROOM_EVENTS_BACKEND')
+    redis_url = os.environ.get('REDIS_URL')
+    if backend is None:
+        backend = 'redis' if redis_url else 'memory'
+    if backend == 'redis':
+        print("[RoomEvents] Using Redis Stream event log")
+        return RedisRoomEventLog(redis_url or 'redis://localhost:6379')
+    print("[RoomEvents] Using in-memory event log")
+    return InMemoryRoomEventLog()
+
+# グローバルインスタンス
+room_event_log = create_room_event_log()
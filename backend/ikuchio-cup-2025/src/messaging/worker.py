@@ -0,0 +1,144 @@
+import asyncio
+import os
+from messaging.job_queue import Job, create_job_queue
+from messaging.notifications import publish_new_message, partial_publisher
+from db.rooms import firestore_process_message, firestore_fail_pending_turn
+from metrics import registry
+from tracing import current_traceparent, start_span
+
+MESSAGE_WORKERS = int(os.environ.get('MESSAGE_WORKERS', '8'))
+MESSAGE_JOB_MAX_ATTEMPTS = int(os.environ.get('MESSAGE_JOB_MAX_ATTEMPTS', '3'))
+# リトライ間隔（秒）。試行回数に応じて倍にする
+MESSAGE_JOB_RETRY_BACKOFF = float(os.environ.get('MESSAGE_JOB_RETRY_BACKOFF', '1.0'))
+# 落ちたワーカーのジョブを回収する間隔（秒）
+MESSAGE_JOB_RECOVERY_INTERVAL = float(os.environ.get('MESSAGE_JOB_RECOVERY_INTERVAL', '30'))
+
+class MessageWorkerPool:
+    """保留中ターンのGemini処理・保存・通知を行う非同期ワーカー群"""
+
+    def __init__(self, queue=None, workers: int = MESSAGE_WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self.running = False
+        self._tasks = []
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    def _get_queue(self):
+        if self.queue is None:
+            self.queue = create_job_queue()
+        return self.queue
+
+    async def submit(self, pending_turn: dict):
+        """保留中ターンを処理キューに積む"""
+        job = Job(pending_turn["id"], {
+            "room_id": pending_turn["room_id"],
+            "sender_id": pending_turn["original_sender_id"],
+            "original_text": pending_turn["original_text"],
+            # 受付時のトレースをワーカー側で引き継ぐ
+            "traceparent": current_traceparent(),
+        })
+        await self._get_queue().enqueue(job)
+
+    async def _process(self, job: Job):
+        payload = job.payload
+        room_id = payload["room_id"]
+        sender_id = payload["sender_id"]
+        with start_span("message_worker.process", parent=payload.get("traceparent"), new_trace=False,
+                        turn_id=job.id, attempt=job.attempts):
+            result = await firestore_process_message(
+                job.id, room_id, sender_id, payload["original_text"],
+                on_partial=partial_publisher(room_id, sender_id),
+                pending=True,
+            )
+            await publish_new_message(room_id, result, sender_id)
+
+    async def _handle_failure(self, job: Job, error: Exception):
+        queue = self._get_queue()
+        if job.attempts + 1 >= MESSAGE_JOB_MAX_ATTEMPTS:
+            print(f"[MessageWorker] Job {job.id} failed {job.attempts + 1} times, moving to dead letter: {error}")
+            await queue.dead_letter(job, str(error))
+            self.dead_lettered += 1
+            try:
+                await firestore_fail_pending_turn(job.id, str(error))
+            except Exception as e:
+                print(f"[MessageWorker] Failed to mark turn {job.id} as failed: {e}")
+            return
+        delay = MESSAGE_JOB_RETRY_BACKOFF * (2 ** job.attempts)
+        print(f"[MessageWorker] Job {job.id} failed (attempt {job.attempts + 1}), retrying in {delay:.1f}s: {error}")
+        await asyncio.sleep(delay)
+        await queue.retry(job)
+        self.retried += 1
+
+    async def _worker(self, index: int):
+        queue = self._get_queue()
+        while self.running:
+            try:
+                job = await queue.dequeue(timeout=1.0)
+            except Exception as e:
+                print(f"[MessageWorker] Worker {index} failed to dequeue: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if job is None:
+                continue
+            try:
+                await self._process(job)
+                await queue.ack(job)
+                self.processed += 1
+            except Exception as e:
+                try:
+                    await self._handle_failure(job, e)
+                except Exception as handle_error:
+                    # キュー操作も失敗した場合はリース切れで回収される
+                    print(f"[MessageWorker] Failed to handle failure of job {job.id}: {handle_error}")
+
+    async def _recovery_loop(self):
+        queue = self._get_queue()
+        while self.running:
+            await asyncio.sleep(MESSAGE_JOB_RECOVERY_INTERVAL)
+            try:
+                recovered = await queue.recover_expired()
+                if recovered:
+                    print(f"[MessageWorker] Recovered {recovered} expired jobs")
+            except Exception as e:
+                print(f"[MessageWorker] Recovery failed: {e}")
+
+    async def start(self):
+        """ワーカーを開始"""
+        if self.running:
+            return
+        self.running = True
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recovery_loop()))
+        print(f"[MessageWorker] Started {self.workers} workers")
+
+    async def stop(self):
+        """ワーカーを停止（処理中のジョブはリース切れ後に他のPodが回収する）"""
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        print("[MessageWorker] Workers stopped")
+
+    async def queue_depth(self) -> dict:
+        """キューのジョブ数を状態ごとに返す（受付時の過負荷判定とメトリクスで使う）"""
+        return await self._get_queue().depth()
+
+    async def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "queue": await self.queue_depth(),
+        }
+
+# グローバルインスタンス
+message_worker_pool = MessageWorkerPool()
+
+async def _collect_queue_depth():
+    return await message_worker_pool.queue_depth()
+
+registry.gauge("message_queue_depth", "Message processing jobs by state", ("state",), collect=_collect_queue_depth)
@@ -0,0 +1,209 @@
+import asyncio
+import bisect
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from tracing import start_span
+
+# 秒単位のレイテンシ用バケット（Gemini呼び出しの数十秒まで）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(label_names, label_values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+class Metric:
+    """ラベル付きメトリクスの共通部分"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in self._values.items()]
+
+class Gauge(Metric):
+    """値を直接設定するか、collectで値を返す関数（同期・非同期どちらでも可）を登録する"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 collect: Optional[Callable] = None):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    async def refresh(self):
+        """collect関数の戻り値（数値、またはラベル値タプル→数値のdict）で値を更新"""
+        if self._collect is None:
+            return
+        result = self._collect()
+        if asyncio.iscoroutine(result):
+            result = await result
+        if isinstance(result, dict):
+            self._values = {tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))): value for key, value in result.items()}
+        elif result is not None:
+            self._values = {(): result}
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in self._values.items()]
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各バケットの件数..., 合計値, 件数]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """withブロックの所要時間を記録する"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """プロセス内のメトリクス一覧。renderでPrometheusのテキスト形式を返す"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = (), collect: Optional[Callable] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names, collect))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    async def render(self) -> str:
+        for metric in self._metrics.values():
+            if isinstance(metric, Gauge):
+                try:
+                    await metric.refresh()
+                except Exception as e:
+                    print(f"[Metrics] Failed to collect {metric.name}: {e}")
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# グローバルインスタンス
+registry = MetricsRegistry()
+
+def _collect_startup_seconds():
+    from clients import clients
+    return clients.startup_seconds
+
+registry.gauge("startup_seconds", "Seconds from process start until all clients were warmed up", collect=_collect_startup_seconds)
+
+# Firestore操作（db/rooms.py・db/users.py）の所要時間と回数
+firestore_operation_seconds = registry.histogram(
+    "firestore_operation_seconds", "Duration of Firestore-backed db operations", ("operation", "outcome"))
+
+def observe_db(operation: str):
+    """db層の非同期関数の所要時間を operation ラベル付きで記録するデコレーター
+
+    呼び出し元がトレース中なら db.{operation} のスパンも記録する。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            outcome = "ok"
+            try:
+                with start_span(f"db.{operation}", new_trace=False):
+                    return await func(*args, **kwargs)
+            except BaseException:
+                outcome = "error"
+                raise
+            finally:
+                firestore_operation_seconds.observe(time.perf_counter() - started_at, operation=operation, outcome=outcome)
+        return wrapper
+    return decorator
+
+# イベントループが他の処理でブロックされて予定より遅れて起きた時間
+event_loop_lag_seconds = registry.histogram("event_loop_lag_seconds", "Delay of a periodic event loop wakeup")
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL_SECONDS', '0.5'))
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS):
+    """一定間隔でsleepし、予定からの遅れをイベントループのブロック時間として記録する"""
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, time.perf_counter() - expected))
@@ -0,0 +1,181 @@
+import os
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+# 伏せ字（gcp/gemini.pyのシステムプロンプトと同じ記号）
+MASK = "▢▢"
+
+class PrefilterResult:
+    """前処理の結果。needs_llmがFalseならGeminiを呼ばずにtextをそのまま使う"""
+    __slots__ = ("text", "needs_llm", "stage")
+
+    def __init__(self, text: str, needs_llm: bool, stage: Optional[str] = None):
+        self.text = text
+        self.needs_llm = needs_llm
+        self.stage = stage
+
+class PrefilterStage:
+    """前処理ステージ。(処理後のテキスト, ここで処理を完了するか) を返す"""
+    name = "stage"
+
+    def process(self, text: str) -> Tuple[str, bool]:
+        raise NotImplementedError
+
+class ShortReactionStage(PrefilterStage):
+    """相槌や短い感想はそのまま通す（システムプロンプトのルール1）"""
+    name = "reaction"
+
+    REACTIONS = {
+        "いいね", "いいねそれ", "それいいね", "すごい", "すごいね", "すごいな", "すごっ", "すご",
+        "美味しそう", "おいしそう", "うまそう", "がち", "ガチ", "まじ", "マジ", "まじで", "マジで",
+        "ほんと", "ほんとに", "本当", "本当に", "なるほど", "たしかに", "確かに", "わかる", "わかるー",
+        "それな", "草", "笑", "w", "ww", "www", "えー", "へー", "へぇ", "ふーん", "おー", "おお",
+        "やばい", "やば", "やばっ", "えらい", "えらすぎ", "かわいい", "かっこいい", "おもしろい", "面白い",
+        "うける", "ウケる", "ありがとう", "ありがと", "おつかれ", "お疲れ様", "おつかれさま", "おはよう",
+        "こんにちは", "こんばんは", "おやすみ", "よろしく", "了解", "りょうかい", "おけ", "ok", "うん",
+        "はい", "いいえ", "そうなんだ", "そうなの", "そっか", "楽しそう", "いいな", "いいなあ", "羨ましい",
+        "うらやましい", "最高", "さいこう", "えぐい", "つよい", "強い", "すてき", "素敵",
+    }
+    # 末尾の記号・伸ばし棒・笑いは比較時に無視する
+    _TRAILING = re.compile(r"[!?！？。、.,…〜~ーｰっッ♪☆★\s]+$")
+    MAX_LENGTH = 15
+
+    def process(self, text: str) -> Tuple[str, bool]:
+        stripped = text.strip()
+        if not stripped or len(stripped) > self.MAX_LENGTH:
+            return text, False
+        core = unicodedata.normalize("NFKC", stripped).lower()
+        core = self._TRAILING.sub("", core)
+        # 「草www」「wwww」のような笑いの繰り返しもまとめて判定する
+        if core in self.REACTIONS or (core.rstrip("w") or "w") in self.REACTIONS:
+            return stripped, True
+        return text, False
+
+class PIIMaskStage(PrefilterStage):
+    """構造化された個人情報（メール・電話番号・郵便番号・番地・URL）を伏せ字にする
+
+    照合は全角数字・記号も拾えるようNFKCで正規化した写しで行い、伏せ字は元のテキストの
+    対応する範囲にだけ入れる（半角カナや記号など、それ以外の部分は書き換えない）。
+    """
+    name = "pii"
+
+    PATTERNS = [
+        re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}"),
+        re.compile(r"https?://[^\s]+"),
+        # 電話番号（+81、携帯、固定、フリーダイヤル）
+        re.compile(r"(?<!\d)(?:\+81[-\s]?|0)\d{1,4}[-\s(（]?\d{1,4}[-\s)）]?\d{3,4}(?!\d)"),
+        # 郵便番号
+        re.compile(r"(?:〒\s?)?(?<![\d-])\d{3}-\d{4}(?![\d-])"),
+        # 番地（1丁目2番3号）
+        re.compile(r"\d+丁目(?:\d+番地?)?(?:\d+号)?"),
+        # 番地（1-2-3）。スコアや範囲（3-2、10-20歳）と区別するため、地名（〜都道府県市区町村・丁目）の
+        # 直後か、番地・号が続く場合だけ伏せる。伏せるのは数字の部分（addressグループ）だけ
+        re.compile(r"(?:[都道府県市区町村]|丁目)[^\s\d、。,!?]{0,6}?(?P<address>(?<![\d-])\d{1,4}-\d{1,4}(?:-\d{1,4})?(?![\d-]))"),
+        re.compile(r"(?P<address>(?<![\d-])\d{1,4}-\d{1,4}(?:-\d{1,4})?)\s?(?:番地|号)"),
+    ]
+
+    @staticmethod
+    def _normalize(text: str) -> Tuple[str, List[int]]:
+        """1文字ずつNFKCで正規化した写しと、写しの各文字が元のテキストの何文字目かの対応"""
+        normalized = []
+        positions = []
+        for index, char in enumerate(text):
+            for normalized_char in unicodedata.normalize("NFKC", char):
+                normalized.append(normalized_char)
+                positions.append(index)
+        return "".join(normalized), positions
+
+    def process(self, text: str) -> Tuple[str, bool]:
+        normalized, positions = self._normalize(text)
+        spans = []
+        for pattern in self.PATTERNS:
+            for match in pattern.finditer(normalized):
+                group = "address" if "address" in pattern.groupindex else 0
+                start, end = match.span(group)
+                if start < end:
+                    spans.append((positions[start], positions[end - 1] + 1))
+        if not spans:
+            return text, False
+        # 重なった範囲はまとめて1つの伏せ字にする
+        spans.sort()
+        merged = [list(spans[0])]
+        for start, end in spans[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        pieces = []
+        cursor = 0
+        for start, end in merged:
+            pieces.append(text[cursor:start])
+            pieces.append(MASK)
+            cursor = end
+        pieces.append(text[cursor:])
+        return "".join(pieces), False
+
+class TrivialTextStage(PrefilterStage):
+    """書き直す内容が残っていない（記号・絵文字・伏せ字のみ）メッセージはそのまま通す"""
+    name = "trivial"
+
+    def process(self, text: str) -> Tuple[str, bool]:
+        remaining = text.replace(MASK, "")
+        for char in remaining:
+            if unicodedata.category(char)[0] in ("L", "N"):
+                return text, False
+        return text, True
+
+STAGE_REGISTRY = {
+    ShortReactionStage.name: ShortReactionStage,
+    PIIMaskStage.name: PIIMaskStage,
+    TrivialTextStage.name: TrivialTextStage,
+}
+
+class PrefilterPipeline:
+    """ステージを順に適用し、どこかで完了すればGeminiを呼ばない"""
+
+    def __init__(self, stages: List[PrefilterStage]):
+        self.stages = stages
+        self.total = 0
+        self.skipped_llm = 0
+        self.completed_by_stage = {stage.name: 0 for stage in stages}
+        self.masked = 0
+
+    def run(self, text: str) -> PrefilterResult:
+        self.total += 1
+        current = text
+        for stage in self.stages:
+            processed, done = stage.process(current)
+            if stage.name == PIIMaskStage.name and processed != current:
+                self.masked += 1
+            current = processed
+            if done:
+                self.skipped_llm += 1
+                self.completed_by_stage[stage.name] += 1
+                return PrefilterResult(current, needs_llm=False, stage=stage.name)
+        return PrefilterResult(current, needs_llm=True)
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "skipped_llm": self.skipped_llm,
+            "skip_ratio": self.skipped_llm / self.total if self.total else 0.0,
+            "masked": self.masked,
+            "completed_by_stage": dict(self.completed_by_stage),
+        }
+
+def create_prefilter_pipeline(stage_names: Optional[str] = None) -> PrefilterPipeline:
+    """PREFILTER_STAGES（カンマ区切り、空文字で無効）からパイプラインを構築"""
+    if stage_names is None:
+        stage_names = os.environ.get('PREFILTER_STAGES', 'reaction,pii,trivial')
+    stages = []
+    for name in (n.strip() for n in stage_names.split(",")):
+        if not name:
+            continue
+        if name not in STAGE_REGISTRY:
+            raise ValueError(f"Unknown prefilter stage: {name}")
+        stages.append(STAGE_REGISTRY[name]())
+    return PrefilterPipeline(stages)
+
+# グローバルインスタンス
+prefilter_pipeline = create_prefilter_pipeline()
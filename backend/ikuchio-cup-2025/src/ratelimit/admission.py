@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from metrics import registry
+from ratelimit.token_bucket import Bucket, create_rate_limiter
+
+# 1ユーザー（検証済みのFirebase UID、なければ接続元IP）あたりの送信の上限（0で無効）
+MESSAGE_RATE_PER_USER_PER_MINUTE = float(os.environ.get('MESSAGE_RATE_PER_USER_PER_MINUTE', '30'))
+MESSAGE_BURST_PER_USER = float(os.environ.get('MESSAGE_BURST_PER_USER', '10'))
+# 1ルームあたりの送信の上限（2人の合計。0で無効）
+MESSAGE_RATE_PER_ROOM_PER_MINUTE = float(os.environ.get('MESSAGE_RATE_PER_ROOM_PER_MINUTE', '60'))
+MESSAGE_BURST_PER_ROOM = float(os.environ.get('MESSAGE_BURST_PER_ROOM', '20'))
+# このPodでGeminiの空きを待っているリクエスト数がこれ以上なら新しい送信を断る（0で無効）
+LOAD_SHED_GEMINI_WAITING = int(os.environ.get('LOAD_SHED_GEMINI_WAITING', '64'))
+# メッセージ処理キューの未処理ジョブ数がこれ以上なら新しい送信を断る（0で無効）
+LOAD_SHED_QUEUE_DEPTH = int(os.environ.get('LOAD_SHED_QUEUE_DEPTH', '500'))
+# キューの長さを読み直す間隔（秒）。送信ごとにRedisへ問い合わせないよう直前の値を使う
+LOAD_SHED_QUEUE_CHECK_SECONDS = float(os.environ.get('LOAD_SHED_QUEUE_CHECK_SECONDS', '1'))
+# 過負荷で断った時に返すRetry-After（秒）
+LOAD_SHED_RETRY_AFTER_SECONDS = float(os.environ.get('LOAD_SHED_RETRY_AFTER_SECONDS', '5'))
+
+message_admission_total = registry.counter(
+    "message_admission_total", "Message send admission decisions", ("result", "reason"))
+message_admission_seconds = registry.histogram(
+    "message_admission_seconds", "Time spent deciding whether to accept a message send")
+
+class AdmissionRejected(Exception):
+    """送信を受け付けない（status_codeは429か503、retry_afterは再送までの秒数）"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(f"Message rejected ({reason}), retry after {retry_after:.1f}s")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+def _gemini_waiting() -> int:
+    from gcp.gemini import get_gemini_stats
+    return get_gemini_stats()["waiting"]
+
+async def _queue_pending() -> int:
+    from messaging.worker import message_worker_pool
+    return (await message_worker_pool.queue_depth())["pending"]
+
+class MessageAdmission:
+    """メッセージ送信の受付判定（Geminiを呼ぶ前・保存する前に行う）
+
+    1. 全体の負荷: Geminiの待ち行列かメッセージ処理キューが閾値を超えていれば503
+    2. ユーザーとルームのトークンバケット: どちらかが空なら429（両方から同時に1つ取る）
+
+    どちらもRetry-Afterに使う秒数を AdmissionRejected で返す。レートリミッターに
+    つながらない場合は送信を止めないよう受け付ける。
+    """
+
+    def __init__(self, limiter=None, gemini_waiting: Callable[[], int] = _gemini_waiting,
+                 queue_pending: Callable[[], Awaitable[int]] = _queue_pending):
+        self.limiter = limiter
+        self._gemini_waiting = gemini_waiting
+        self._queue_pending = queue_pending
+        self._queue_depth = 0
+        self._queue_checked_at = 0.0
+        self._queue_refresh: Optional[asyncio.Task] = None
+
+    def _get_limiter(self):
+        if self.limiter is None:
+            self.limiter = create_rate_limiter()
+        return self.limiter
+
+    async def _refresh_queue_depth(self):
+        try:
+            self._queue_depth = await self._queue_pending()
+        except Exception as e:
+            print(f"[Admission] Failed to read queue depth: {e}")
+        finally:
+            self._queue_checked_at = time.monotonic()
+
+    def _check_queue_depth(self) -> int:
+        """直前に読んだキューの長さを返し、古ければバックグラウンドで読み直す（送信は待たせない）"""
+        stale = time.monotonic() - self._queue_checked_at >= LOAD_SHED_QUEUE_CHECK_SECONDS
+        if stale and (self._queue_refresh is None or self._queue_refresh.done()):
+            self._queue_refresh = asyncio.create_task(self._refresh_queue_depth())
+        return self._queue_depth
+
+    def _shed_reason(self) -> Optional[str]:
+        if LOAD_SHED_GEMINI_WAITING > 0 and self._gemini_waiting() >= LOAD_SHED_GEMINI_WAITING:
+            return "gemini"
+        if LOAD_SHED_QUEUE_DEPTH > 0 and self._check_queue_depth() >= LOAD_SHED_QUEUE_DEPTH:
+            return "queue"
+        return None
+
+    def _buckets(self, room_id: str, sender_key: str):
+        buckets = []
+        if MESSAGE_RATE_PER_USER_PER_MINUTE > 0:
+            buckets.append(Bucket(f"user:{sender_key}", MESSAGE_RATE_PER_USER_PER_MINUTE / 60, MESSAGE_BURST_PER_USER))
+        if MESSAGE_RATE_PER_ROOM_PER_MINUTE > 0:
+            buckets.append(Bucket(f"room:{room_id}", MESSAGE_RATE_PER_ROOM_PER_MINUTE / 60, MESSAGE_BURST_PER_ROOM))
+        return buckets
+
+    async def admit(self, room_id: str, sender_key: str):
+        """受け付けられない場合は AdmissionRejected を送出する"""
+        started_at = time.perf_counter()
+        try:
+            # 過負荷の判定はプロセス内の値だけで済むので、Redisに問い合わせる前に行う
+            reason = self._shed_reason()
+            if reason is not None:
+                message_admission_total.inc(result="shed", reason=reason)
+                raise AdmissionRejected(503, reason, LOAD_SHED_RETRY_AFTER_SECONDS)
+
+            buckets = self._buckets(room_id, sender_key)
+            if buckets:
+                try:
+                    result = await self._get_limiter().acquire(buckets)
+                except Exception as e:
+                    print(f"[Admission] Rate limiter unavailable, accepting message: {e}")
+                    message_admission_total.inc(result="accepted", reason="limiter_error")
+                    return
+                if not result.allowed:
+                    reason = result.bucket.key.split(":", 1)[0]
+                    message_admission_total.inc(result="rate_limited", reason=reason)
+                    raise AdmissionRejected(429, reason, result.retry_after)
+            message_admission_total.inc(result="accepted", reason="")
+        finally:
+            message_admission_seconds.observe(time.perf_counter() - started_at)
+
+# グローバルインスタンス
+message_admission = MessageAdmission()
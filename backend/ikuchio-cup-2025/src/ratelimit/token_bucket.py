@@ -0,0 +1,126 @@
+import math
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+class Bucket:
+    """トークンバケット1つ分の設定（rate: 1秒あたりの補充数、burst: 最大トークン数）"""
+    __slots__ = ("key", "rate", "burst")
+
+    def __init__(self, key: str, rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+class RateLimitResult:
+    """acquireの結果。拒否された場合は最初に足りなかったバケットと、補充までの秒数を持つ"""
+    __slots__ = ("allowed", "retry_after", "bucket")
+
+    def __init__(self, allowed: bool, retry_after: float = 0.0, bucket: Optional[Bucket] = None):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.bucket = bucket
+
+class RateLimiter:
+    """複数のトークンバケットからまとめて1トークンずつ取る
+
+    全部のバケットにトークンがある場合だけ取り、1つでも足りなければどれからも取らない
+    （部屋の上限で拒否された送信がユーザーの分を減らさないようにする）。
+    """
+
+    async def acquire(self, buckets: Sequence[Bucket]) -> RateLimitResult:
+        raise NotImplementedError
+
+class InMemoryRateLimiter(RateLimiter):
+    """単一Pod・ローカル開発用（プロセス内でだけ数える）"""
+
+    # この件数を超えたら満タンまで戻ったバケットを捨てる
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def _level(self, bucket: Bucket, now: float) -> float:
+        state = self._buckets.get(bucket.key)
+        if state is None:
+            return bucket.burst
+        tokens, updated_at = state
+        return min(bucket.burst, tokens + (now - updated_at) * bucket.rate)
+
+    def _prune(self, now: float):
+        # 設定はキーごとに持たないので、最後の更新から十分時間が経ったものを満タンとみなす
+        self._buckets = {key: state for key, state in self._buckets.items() if now - state[1] < 3600}
+
+    async def acquire(self, buckets: Sequence[Bucket]) -> RateLimitResult:
+        now = time.monotonic()
+        levels = [self._level(bucket, now) for bucket in buckets]
+        for bucket, level in zip(buckets, levels):
+            if level < 1:
+                return RateLimitResult(False, (1 - level) / bucket.rate, bucket)
+        for bucket, level in zip(buckets, levels):
+            self._buckets[bucket.key] = (level - 1, now)
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._prune(now)
+        return RateLimitResult(True)
+
+# 全バケットを補充してから判定し、全部に1トークン以上ある場合だけ減らす
+# （時刻はPod間でずれないようRedisのTIMEを使う。小数はLuaから返すと切り捨てられるので文字列で返す）
+_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+for i = 1, #KEYS do
+  local rate = tonumber(ARGV[i * 2 - 1])
+  local burst = tonumber(ARGV[i * 2])
+  local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local level = tonumber(state[1]) or burst
+  local updated_at = tonumber(state[2]) or now
+  level = math.min(burst, level + math.max(0, now - updated_at) * rate)
+  if level < 1 then
+    return {i, tostring((1 - level) / rate)}
+  end
+  levels[i] = level
+end
+for i = 1, #KEYS do
+  local rate = tonumber(ARGV[i * 2 - 1])
+  local burst = tonumber(ARGV[i * 2])
+  redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000) + 1000)
+end
+return {0, '0'}
+"""
+
+class RedisRateLimiter(RateLimiter):
+    """全Podで共有するトークンバケット（ハッシュ1つにtokensと最終更新時刻を持つ）"""
+
+    def __init__(self, redis_url: str, prefix: str = "ratelimit"):
+        from clients import clients
+        self.redis = clients.redis(redis_url)
+        self.prefix = prefix
+        self._acquire = self.redis.register_script(_ACQUIRE_SCRIPT)
+
+    async def acquire(self, buckets: Sequence[Bucket]) -> RateLimitResult:
+        args: List[float] = []
+        for bucket in buckets:
+            args.extend((bucket.rate, bucket.burst))
+        limited, retry_after = await self._acquire(keys=[f"{self.prefix}:{bucket.key}" for bucket in buckets], args=args)
+        limited = int(limited)
+        if limited == 0:
+            return RateLimitResult(True)
+        return RateLimitResult(False, float(retry_after), buckets[limited - 1])
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-Afterヘッダーの値（整数秒。0秒にはしない）"""
+    return str(max(1, math.ceil(seconds)))
+
+def create_rate_limiter() -> RateLimiter:
+    """RATE_LIMIT_BACKEND（redis/memory）に応じてレートリミッターを生成"""
+    backend = os.environ.get('RATE_LIMIT_BACKEND')
+    redis_url = os.environ.get('REDIS_URL')
+    if backend is None:
+        backend = 'redis' if redis_url else 'memory'
+    if backend == 'redis':
+        print("[RateLimit] Using Redis rate limiter")
+        return RedisRateLimiter(redis_url or 'redis://localhost:6379')
+    print("[RateLimit] Using in-memory rate limiter")
+    return InMemoryRateLimiter()
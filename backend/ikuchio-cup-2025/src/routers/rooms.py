@@ -1,9 +1,19 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import JSONResponse
+from typing import Optional
 import uvicorn
 import asyncio
+import os
 
-from db.rooms import firestore_get_room, firestore_get_all_rooms, firestore_reset_all_rooms, create_room_with_random_users, firestore_send_message, firestore_get_messages
+from db.rooms import firestore_get_room, firestore_get_all_rooms, create_room_with_random_users, firestore_send_message, firestore_get_messages, MESSAGE_PAGE_SIZE, firestore_create_pending_turn, firestore_get_turn_status
+from messaging.notifications import publish_new_message, partial_publisher
+from messaging.worker import message_worker_pool
+from scheduler.room_scheduler import room_scheduler
+from ratelimit.admission import message_admission, AdmissionRejected
+from ratelimit.token_bucket import retry_after_header
+from auth.firebase_auth import verify_firebase_token
 from pydantic import BaseModel
+from tracing import start_span
 
 class MessageCreate(BaseModel):
     original_text: str
@@ -11,89 +21,139 @@ class MessageCreate(BaseModel):
 
 rooms_router = APIRouter()
 
+# async: 保留中ターンを保存して202を返し、Gemini処理はワーカーが行う / sync: 処理完了まで待つ
+MESSAGE_PIPELINE = os.environ.get('MESSAGE_PIPELINE', 'async')
+
 @rooms_router.post("/api/rooms")
 async def create_room():
     try:
-        result = create_room_with_random_users()
+        result = await create_room_with_random_users()
         if result is None:
             return {"error": "Not enough users to create room"}
         return result
     except:
         return {"error": "Failed to create room"}
     
+# /api/rooms/{room_id} より先に登録する
+@rooms_router.get("/api/rooms/reset-status")
+async def get_reset_status():
+    """最新の日次・手動リセットの状態（実行中のリーダー・進捗・所要時間）"""
+    try:
+        return await room_scheduler.get_status()
+    except Exception as e:
+        return {"error": f"Failed to get reset status: {str(e)}"}
+
 @rooms_router.get("/api/rooms/{room_id}")
 async def get_room(room_id: str):
     try:
-        return(firestore_get_room(room_id))
+        return(await firestore_get_room(room_id))
     except:
         return("Error!")
 
 @rooms_router.get("/api/rooms")
 async def get_all_rooms():
     try:
-        return firestore_get_all_rooms()
+        return await firestore_get_all_rooms()
     except:
         return {"error": "Failed to get rooms"}
 
 @rooms_router.post("/api/rooms/refresh")
 async def refresh_rooms():
     try:
-        return firestore_reset_all_rooms()
+        # 他のPodの日次リセットと同時に走らないよう、スケジューラーのリースを取って実行する
+        return await room_scheduler.reset_all_rooms()
     except:
         return {"error": "Failed to reset rooms"}
 
 # Singular endpoints for frontend compatibility
 @rooms_router.get("/api/room/{room_id}")
-async def get_room_messages(room_id: str):
+async def get_room_messages(room_id: str, since: Optional[str] = None, before: Optional[str] = None, limit: int = MESSAGE_PAGE_SIZE):
+    """メッセージ履歴を古い順で返す。sinceを指定すると新着ターンのみ返す"""
     try:
-        return firestore_get_messages(room_id)
+        messages = await firestore_get_messages(room_id, since=since, before=before, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         return {"error": f"Failed to get messages: {str(e)}"}
+    if messages is None:
+        # 前のエポックのルーム（リセットで入れ替わったもの）や存在しないルーム
+        raise HTTPException(status_code=404, detail="Room not found")
+    return messages
+
+
+
+async def _rate_limit_key(request: Request) -> str:
+    """ユーザーごとの送信上限のキー（検証できたFirebase UID、なければ接続元IP）
+
+    sender_idはクライアントが自由に変えられるので、上限を逃れたり他人の枠を使い切ったり
+    できないようキーには使わない。
+    """
+    if request.headers.get('Authorization'):
+        try:
+            return f"uid:{(await verify_firebase_token(request))['firebase_uid']}"
+        except HTTPException:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def _admit_message(room_id: str, message_data: MessageCreate, request: Request):
+    """送信を受け付けない場合は保存やGemini処理の前に429/503（Retry-After付き）を返す"""
+    sender_key = await _rate_limit_key(request)
+    try:
+        await message_admission.admit(room_id, sender_key)
+    except AdmissionRejected as e:
+        print(f"[Router Debug] Rejected message for room {room_id}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=f"Message rejected: {e.reason}",
+                            headers={"Retry-After": retry_after_header(e.retry_after)})
 
+async def _send_message(room_id: str, message_data: MessageCreate, traceparent: Optional[str] = None):
+    # クライアントがtraceparentを送ってきた場合はそのトレースの続きとして記録する
+    with start_span("send_message", parent=traceparent, room_id=room_id, pipeline=MESSAGE_PIPELINE):
+        return await _process_send_message(room_id, message_data)
 
+async def _process_send_message(room_id: str, message_data: MessageCreate):
+    if MESSAGE_PIPELINE == 'async':
+        # 保留中ターンを保存してキューに積み、Gemini処理を待たずに202を返す
+        pending_turn = await firestore_create_pending_turn(room_id, message_data.sender_id, message_data.original_text)
+        await message_worker_pool.submit(pending_turn)
+        print(f"[Router Debug] Message {pending_turn['id']} accepted for background processing")
+        return JSONResponse(status_code=202, content=pending_turn)
+    
+    # AI処理を含むメッセージ送信処理
+    result = await firestore_send_message(room_id, message_data.sender_id, message_data.original_text,
+                                          on_partial=partial_publisher(room_id, message_data.sender_id))
+    print(f"[Router Debug] Message and AI processing completed")
+    
+    # AI処理完了後にRedis Pub/Subで全Podに通知
+    await publish_new_message(room_id, result, message_data.sender_id)
+    print(f"[Router Debug] Notification published after AI processing")
+    return result
 
 @rooms_router.post("/api/room/{room_id}")
-async def send_message(room_id: str, message_data: MessageCreate):
+async def send_message(room_id: str, message_data: MessageCreate, request: Request, traceparent: Optional[str] = Header(None)):
     print(f"[Router Debug] Received message request for room {room_id}")
     print(f"[Router Debug] Message data: {message_data.original_text}")
+    await _admit_message(room_id, message_data, request)
     try:
-        # AI処理を含むメッセージ送信処理
-        result = await firestore_send_message(room_id, message_data.sender_id, message_data.original_text)
-        print(f"[Router Debug] Message and AI processing completed")
-        
-        # AI処理完了後にRedis Pub/Subで全Podに通知
-        from websocket_manager import websocket_manager
-        notification = {
-            "type": "new_message",
-            "room_id": room_id,
-            "message_id": result.get("id", ""),
-            "sender_id": message_data.sender_id
-        }
-        websocket_manager.publish_message(room_id, notification)
-        print(f"[Router Debug] Notification published after AI processing")
-        
-        return result
+        return await _send_message(room_id, message_data, traceparent)
     except Exception as e:
         print(f"[Router Debug] Error sending message: {str(e)}")
         return {"error": f"Failed to send message: {str(e)}"}
 
 @rooms_router.post("/api/rooms/{room_id}")
-async def send_message_plural(room_id: str, message_data: MessageCreate):
+async def send_message_plural(room_id: str, message_data: MessageCreate, request: Request, traceparent: Optional[str] = Header(None)):
+    await _admit_message(room_id, message_data, request)
     try:
-        # AI処理を含むメッセージ送信処理
-        result = await firestore_send_message(room_id, message_data.sender_id, message_data.original_text)
-        
-        # AI処理完了後にRedis Pub/Subで全Podに通知
-        from websocket_manager import websocket_manager
-        notification = {
-            "type": "new_message",
-            "room_id": room_id,
-            "message_id": result.get("id", ""),
-            "sender_id": message_data.sender_id
-        }
-        websocket_manager.publish_message(room_id, notification)
-        
-        return result
+        return await _send_message(room_id, message_data, traceparent)
     except Exception as e:
         return {"error": f"Failed to send message: {str(e)}"}
-    
+
+@rooms_router.get("/api/room/{room_id}/turns/{turn_id}")
+async def get_turn_status(room_id: str, turn_id: str):
+    """202で受け付けたターンの処理状況（pending/failed/done）を返す"""
+    try:
+        result = await firestore_get_turn_status(room_id, turn_id)
+    except Exception as e:
+        return {"error": f"Failed to get turn: {str(e)}"}
+    if result is None:
+        raise HTTPException(status_code=404, detail="Turn not found")
+    return result
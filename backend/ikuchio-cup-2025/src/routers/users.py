@@ -3,7 +3,7 @@ from pydantic import BaseModel
 import uvicorn
 
 from db.users import firestore_create_user, firestore_get_user
-from db.rooms import create_room_with_random_users
+from matchmaking.matchmaker import matchmaker
 from auth.firebase_auth import get_current_user
 
 class UserCreate(BaseModel):
@@ -18,17 +18,11 @@ async def create_user(user_data: UserCreate, current_user: dict = Depends(get_cu
         if current_user['firebase_uid'] != user_data.firebase_uid:
             raise HTTPException(status_code=403, detail="Unauthorized: UID mismatch")
         
-        result = firestore_create_user(user_data.firebase_uid)
-        if isinstance(result, str) and "already exist" in result:
-            user = firestore_get_user(user_data.firebase_uid)
-            # 既存ユーザーでルーム未参加の場合もマッチング試行
-            if user and not user.get('room_id'):
-                create_room_with_random_users()
-            return user
+        result = await firestore_create_user(user_data.firebase_uid)
         
-        # 新規ユーザーの場合、マッチング試行
+        # ルーム未参加の場合は待機キューに登録（マッチングはマッチャーが行う）
         if result and not result.get('room_id'):
-            create_room_with_random_users()
+            await matchmaker.enqueue(user_data.firebase_uid)
         
         return result
     except HTTPException:
@@ -43,15 +37,13 @@ async def get_users(firebase_uid: str, current_user: dict = Depends(get_current_
         if current_user['firebase_uid'] != firebase_uid:
             raise HTTPException(status_code=403, detail="Unauthorized: UID mismatch")
         
-        result = firestore_get_user(firebase_uid)
+        result = await firestore_get_user(firebase_uid)
         if not result:
             raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
         
-        # ルーム未参加の場合、マッチング試行
+        # ルーム未参加の場合は待機キューに登録されていることだけ保証する（登録済みなら何もしない）
         if not result.get('room_id'):
-            create_room_with_random_users()
-            # マッチング後の最新情報を取得
-            result = firestore_get_user(firebase_uid)
+            await matchmaker.enqueue(firebase_uid)
         
         return result
     except HTTPException:
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+class LeaseStore:
+    """Pod間で1つだけ保持できる期限付きリースと、リース保持者が書くJSON状態
+
+    acquireは誰も保持していない（または期限切れの）場合だけ成功する。保持者は期限が
+    切れる前にrenewし続け、renewに失敗したらリーダーではなくなったものとして処理を止める。
+    """
+
+    async def acquire(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        raise NotImplementedError
+
+    async def renew(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        """自分が保持している場合だけ期限を延ばす"""
+        raise NotImplementedError
+
+    async def release(self, name: str, owner: str) -> bool:
+        """自分が保持している場合だけ解放する"""
+        raise NotImplementedError
+
+    async def holder(self, name: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def get_state(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def set_state(self, key: str, value: dict, ttl_seconds: Optional[float] = None):
+        raise NotImplementedError
+
+class InMemoryLeaseStore(LeaseStore):
+    """単一Pod・ローカル開発用（プロセス内でだけ排他する）"""
+
+    def __init__(self):
+        self._leases: Dict[str, Tuple[str, float]] = {}
+        self._states: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _current(self, name: str) -> Optional[str]:
+        lease = self._leases.get(name)
+        if lease is None or lease[1] <= time.monotonic():
+            self._leases.pop(name, None)
+            return None
+        return lease[0]
+
+    async def acquire(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        if self._current(name) is not None:
+            return False
+        self._leases[name] = (owner, time.monotonic() + ttl_seconds)
+        return True
+
+    async def renew(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        if self._current(name) != owner:
+            return False
+        self._leases[name] = (owner, time.monotonic() + ttl_seconds)
+        return True
+
+    async def release(self, name: str, owner: str) -> bool:
+        if self._current(name) != owner:
+            return False
+        del self._leases[name]
+        return True
+
+    async def holder(self, name: str) -> Optional[str]:
+        return self._current(name)
+
+    async def get_state(self, key: str) -> Optional[dict]:
+        entry = self._states.get(key)
+        if entry is None:
+            return None
+        raw, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._states[key]
+            return None
+        # 呼び出し側が書き換えても保存内容が変わらないよう、Redis版と同じくJSONで持つ
+        return json.loads(raw)
+
+    async def set_state(self, key: str, value: dict, ttl_seconds: Optional[float] = None):
+        expires_at = time.monotonic() + ttl_seconds if ttl_seconds else None
+        self._states[key] = (json.dumps(value, ensure_ascii=False, default=str), expires_at)
+
+# 保持者が自分の場合だけ期限を延ばす／削除する
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class RedisLeaseStore(LeaseStore):
+    """全Podで共有するリース（SET NX PX）と状態（JSON文字列）"""
+
+    def __init__(self, redis_url: str, prefix: str = "lease"):
+        from clients import clients
+        self.redis = clients.redis(redis_url)
+        self.prefix = prefix
+        self._renew = self.redis.register_script(_RENEW_SCRIPT)
+        self._release = self.redis.register_script(_RELEASE_SCRIPT)
+
+    def _lease_key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def _state_key(self, key: str) -> str:
+        return f"{self.prefix}:state:{key}"
+
+    async def acquire(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        return bool(await self.redis.set(self._lease_key(name), owner, nx=True, px=int(ttl_seconds * 1000)))
+
+    async def renew(self, name: str, owner: str, ttl_seconds: float) -> bool:
+        return bool(await self._renew(keys=[self._lease_key(name)], args=[owner, int(ttl_seconds * 1000)]))
+
+    async def release(self, name: str, owner: str) -> bool:
+        return bool(await self._release(keys=[self._lease_key(name)], args=[owner]))
+
+    async def holder(self, name: str) -> Optional[str]:
+        return await self.redis.get(self._lease_key(name))
+
+    async def get_state(self, key: str) -> Optional[dict]:
+        raw = await self.redis.get(self._state_key(key))
+        return json.loads(raw) if raw else None
+
+    async def set_state(self, key: str, value: dict, ttl_seconds: Optional[float] = None):
+        raw = json.dumps(value, ensure_ascii=False, default=str)
+        await self.redis.set(self._state_key(key), raw, px=int(ttl_seconds * 1000) if ttl_seconds else None)
+
+def create_lease_store() -> LeaseStore:
+    """LEASE_BACKEND（redis/memory）に応じてリースストアを生成"""
+    backend = os.environ.get('LEASE_BACKEND')
+    redis_url = os.environ.get('REDIS_URL')
+    if backend is None:
+        backend = 'redis' if redis_url else 'memory'
+    if backend == 'redis':
+        print("[Lease] Using Redis lease store")
+        return RedisLeaseStore(redis_url or 'redis://localhost:6379')
+    print("[Lease] Using in-memory lease store")
+    return InMemoryLeaseStore()
@@ -1,57 +1,360 @@
 import asyncio
 import datetime
-from db.rooms import firestore_reset_all_rooms
+import os
+import socket
 import uuid
-import random
+from typing import Optional
+from db.rooms import firestore_reset_all_rooms, firestore_collect_old_epochs, firestore_get_epochs
+from scheduler.lease import create_lease_store
+from metrics import registry
+
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+# リーダーのリース期限（この間に更新がなければ他のPodがリセットを引き継ぐ）
+RESET_LEASE_SECONDS = float(os.environ.get('ROOM_RESET_LEASE_SECONDS', '30'))
+# リーダーでないPodがリセットの完了・リースの空きを確認しに行く間隔
+RESET_RETRY_SECONDS = float(os.environ.get('ROOM_RESET_RETRY_SECONDS', '5'))
+# 失敗したリセットを全Pod合計で何回まで試すか
+RESET_MAX_ATTEMPTS = int(os.environ.get('ROOM_RESET_MAX_ATTEMPTS', '3'))
+# 0:00の何秒前から次のエポックの組み合わせを書き込み始めるか（切り替えは0:00ちょうど）
+RESET_PREPARE_LEAD_SECONDS = float(os.environ.get('ROOM_RESET_PREPARE_LEAD_SECONDS', '600'))
+# チェックポイントと状態の保持期間
+RESET_STATE_TTL_SECONDS = float(os.environ.get('ROOM_RESET_STATE_TTL_SECONDS', str(2 * 24 * 3600)))
+
+RESET_LEASE_NAME = "room_reset"
+GC_LEASE_NAME = "room_epoch_gc"
+LATEST_RESET_KEY = "room_reset:latest"
+
+room_reset_runs_total = registry.counter(
+    "room_reset_runs_total", "Room reset runs attempted by this pod by result", ("result",))
+room_reset_duration_seconds = registry.histogram(
+    "room_reset_duration_seconds", "Wall-clock duration of completed room resets including resumes",
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0))
+room_reset_cutover_seconds = registry.histogram(
+    "room_reset_cutover_seconds", "Duration of the current-epoch pointer flip that makes new rooms visible")
+epoch_gc_runs_total = registry.counter(
+    "epoch_gc_runs_total", "Background collections of retired room epochs by result", ("result",))
+
+class LeaseLostError(Exception):
+    """リセット中にリースを失った（他のPodが引き継いでいる可能性がある）"""
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(JST)
+
+class ResetCheckpoint:
+    """firestore_reset_all_roomsの進捗をリースストアに保存する
+
+    保存のたびにリースを延長し、延長できなければ（リースが切れて他のPodが引き継いだ）
+    LeaseLostErrorで処理を止めるので、古いリーダーが新しいリーダーの進捗を上書きしない。
+    """
+
+    def __init__(self, scheduler: "RoomScheduler", reset_id: str):
+        self.scheduler = scheduler
+        self.reset_id = reset_id
+        self.store = scheduler._get_lease_store()
+
+    async def _ensure_leader(self):
+        if not await self.store.renew(RESET_LEASE_NAME, self.scheduler.owner_id, RESET_LEASE_SECONDS):
+            raise LeaseLostError(f"Lost room reset lease while running {self.reset_id}")
+
+    async def load(self) -> Optional[dict]:
+        return await self.store.get_state(f"room_reset:{self.reset_id}:checkpoint")
+
+    async def save(self, state: dict):
+        await self._ensure_leader()
+        await self.store.set_state(f"room_reset:{self.reset_id}:checkpoint", state, RESET_STATE_TTL_SECONDS)
+        await self.scheduler._update_status(
+            self.reset_id, progress={"assigned_rooms": state["assigned_rooms"], "total_rooms": state.get("total_rooms")})
+
+    async def load_plan(self) -> Optional[list]:
+        plan = await self.store.get_state(f"room_reset:{self.reset_id}:plan")
+        return plan["users"] if plan else None
+
+    async def save_plan(self, users: list):
+        await self._ensure_leader()
+        await self.store.set_state(f"room_reset:{self.reset_id}:plan", {"users": users}, RESET_STATE_TTL_SECONDS)
 
 class RoomScheduler:
-    def __init__(self):
+    """毎日0:00（JST）に全ルームをリセットする
+
+    全Podでstart()が動くが、リセットを実行するのはリースを取れた1つのPodだけ。
+    リーダーは実行中にリースを更新し続け、各段階の進捗をチェックポイントに残す。
+    リーダーが途中で落ちるとリースが切れ、待っていた他のPodがチェックポイントから再開する。
+    """
+
+    def __init__(self, lease_store=None):
         self.running = False
-    
+        self.lease_store = lease_store
+        self.owner_id = f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        # 最後に読み書きしたリセット状態
+        self.status: Optional[dict] = None
+        # 実行中に失ったリース（更新に失敗して処理を中断したもの）
+        self._lost_leases = set()
+        self._collector: Optional[asyncio.Task] = None
+
+    def _get_lease_store(self):
+        if self.lease_store is None:
+            self.lease_store = create_lease_store()
+        return self.lease_store
+
     def get_next_reset_time(self):
         """次の日本時間0:00の時刻を取得"""
-        now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
+        now = _now()
         # 翌日の0:00を取得
         next_reset = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
         return next_reset
-    
+
+    async def _load_status(self, reset_id: str) -> Optional[dict]:
+        return await self._get_lease_store().get_state(f"room_reset:{reset_id}:status")
+
+    async def _save_status(self):
+        store = self._get_lease_store()
+        self.status["updated_at"] = _now().isoformat()
+        await store.set_state(f"room_reset:{self.status['reset_id']}:status", self.status, RESET_STATE_TTL_SECONDS)
+        await store.set_state(LATEST_RESET_KEY, {"reset_id": self.status["reset_id"]}, RESET_STATE_TTL_SECONDS)
+
+    async def _update_status(self, reset_id: str, **fields):
+        if self.status is None or self.status.get("reset_id") != reset_id:
+            return
+        self.status.update(fields)
+        await self._save_status()
+
+    async def get_status(self) -> dict:
+        """最新のリセットの状態（どのPodが実行したかに関わらず共有ストアから読む）"""
+        store = self._get_lease_store()
+        latest = await store.get_state(LATEST_RESET_KEY)
+        status = await self._load_status(latest["reset_id"]) if latest else None
+        if status is not None:
+            self.status = status
+        return {
+            "reset": status,
+            "lease_holder": await store.holder(RESET_LEASE_NAME),
+            "epochs": await firestore_get_epochs(),
+            "pod": self.owner_id,
+            "next_reset_at": self.get_next_reset_time().isoformat(),
+        }
+
+    async def _keep_lease(self, name: str, job: asyncio.Task):
+        """実行中はリースを更新し続け、更新に失敗したら処理を中断する"""
+        store = self._get_lease_store()
+        while not job.done():
+            await asyncio.sleep(RESET_LEASE_SECONDS / 3)
+            try:
+                renewed = await store.renew(name, self.owner_id, RESET_LEASE_SECONDS)
+            except Exception as e:
+                print(f"[Scheduler] Failed to renew {name} lease: {e}")
+                continue
+            if not renewed:
+                print(f"[Scheduler] Lost {name} lease, stopping the job on this pod")
+                self._lost_leases.add(name)
+                job.cancel()
+                return
+
+    async def run_reset(self, reset_id: str, activate_at: Optional[datetime.datetime] = None) -> Optional[dict]:
+        """リースを取れた場合だけリセットを実行（チェックポイントがあれば続きから）
+
+        activate_atまでに次のエポックを準備し、その時刻に切り替える（Noneならすぐ切り替える）。
+        リースを取れなかった・途中で失ったときはNoneを返す。
+        """
+        store = self._get_lease_store()
+        if not await store.acquire(RESET_LEASE_NAME, self.owner_id, RESET_LEASE_SECONDS):
+            return None
+        self.is_leader = True
+        self._lost_leases.discard(RESET_LEASE_NAME)
+        keeper = None
+        try:
+            status = await self._load_status(reset_id)
+            if status is not None and status["state"] == "done":
+                room_reset_runs_total.inc(result="skipped")
+                self.status = status
+                return status["result"]
+            if status is not None and status["state"] == "failed" and status["attempts"] >= RESET_MAX_ATTEMPTS:
+                room_reset_runs_total.inc(result="skipped")
+                self.status = status
+                return {"error": f"Room reset {reset_id} gave up after {status['attempts']} attempts"}
+
+            if status is None:
+                status = {
+                    "reset_id": reset_id,
+                    "activate_at": activate_at.isoformat() if activate_at else None,
+                    "started_at": _now().isoformat(),
+                    "finished_at": None,
+                    "duration_seconds": None,
+                    "attempts": 0,
+                    "progress": None,
+                    "result": None,
+                    "error": None,
+                }
+            status.update(state="running", leader=self.owner_id, attempts=status["attempts"] + 1, error=None)
+            self.status = status
+            await self._save_status()
+            print(f"[Scheduler] Running room reset {reset_id} as leader {self.owner_id} (attempt {status['attempts']})")
+
+            activate_at = datetime.datetime.fromisoformat(status["activate_at"]) if status["activate_at"] else None
+            job = asyncio.create_task(firestore_reset_all_rooms(reset_id, ResetCheckpoint(self, reset_id), activate_at))
+            keeper = asyncio.create_task(self._keep_lease(RESET_LEASE_NAME, job))
+            try:
+                result = await job
+            except asyncio.CancelledError:
+                if RESET_LEASE_NAME not in self._lost_leases:
+                    raise
+                room_reset_runs_total.inc(result="lease_lost")
+                return None
+            except LeaseLostError as e:
+                print(f"[Scheduler] {e}")
+                room_reset_runs_total.inc(result="lease_lost")
+                return None
+            except Exception as e:
+                print(f"[Scheduler] Room reset {reset_id} failed: {e}")
+                room_reset_runs_total.inc(result="failed")
+                await self._update_status(reset_id, state="failed", error=str(e))
+                return {"error": "Failed to reset rooms"}
+
+            finished_at = _now()
+            duration = (finished_at - datetime.datetime.fromisoformat(status["started_at"])).total_seconds()
+            room_reset_duration_seconds.observe(duration)
+            room_reset_cutover_seconds.observe(result["stats"]["cutover_seconds"])
+            room_reset_runs_total.inc(result="resumed" if result["stats"]["resumed"] else "done")
+            await self._update_status(reset_id, state="done", finished_at=finished_at.isoformat(),
+                                      duration_seconds=round(duration, 3), result=result)
+            return result
+        finally:
+            if keeper is not None:
+                keeper.cancel()
+            self.is_leader = False
+            try:
+                await store.release(RESET_LEASE_NAME, self.owner_id)
+            except Exception as e:
+                print(f"[Scheduler] Failed to release room reset lease: {e}")
+
+    async def reset_until_done(self, reset_id: str, activate_at: Optional[datetime.datetime] = None) -> Optional[dict]:
+        """どこかのPodでリセットが完了する（または試行回数を使い切る）まで待つ
+
+        リースを取れたらこのPodで実行し、取れなければ他のPodの完了を待ちながら
+        リースが空くのを待つ（リーダーが落ちたらここで引き継ぐ）。
+        """
+        while self.running:
+            result = await self.run_reset(reset_id, activate_at)
+            if result is not None and "error" not in result:
+                return result
+            status = await self._load_status(reset_id)
+            if status is not None:
+                if status["state"] == "done":
+                    return status["result"]
+                if status["state"] == "failed" and status["attempts"] >= RESET_MAX_ATTEMPTS:
+                    print(f"[Scheduler] Giving up room reset {reset_id} after {status['attempts']} attempts")
+                    return None
+            await asyncio.sleep(RESET_RETRY_SECONDS)
+        return None
+
     async def reset_all_rooms(self):
+        """手動リセット（他のPodでリセット中なら実行しない）"""
+        reset_id = f"manual-{_now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
         try:
-            return firestore_reset_all_rooms()
-        except:
+            result = await self.run_reset(reset_id)
+        except Exception as e:
+            print(f"[Scheduler] Manual room reset failed: {e}")
             return {"error": "Failed to reset rooms"}
-    
+        if result is None:
+            return {"error": "Another room reset is in progress"}
+        self.start_collector()
+        return result
+
+    async def collect_old_epochs(self) -> Optional[dict]:
+        """リースを取れた場合だけ、削除待ちのエポックを少しずつ削除する（エポック導入前のデータの移行もここで行う）"""
+        store = self._get_lease_store()
+        if not await store.acquire(GC_LEASE_NAME, self.owner_id, RESET_LEASE_SECONDS):
+            return None
+        self._lost_leases.discard(GC_LEASE_NAME)
+        job = asyncio.create_task(firestore_collect_old_epochs())
+        keeper = asyncio.create_task(self._keep_lease(GC_LEASE_NAME, job))
+        try:
+            collected = await job
+            epoch_gc_runs_total.inc(result="done")
+            return collected
+        except asyncio.CancelledError:
+            if GC_LEASE_NAME not in self._lost_leases:
+                raise
+            epoch_gc_runs_total.inc(result="lease_lost")
+            return None
+        except Exception as e:
+            print(f"[Scheduler] Failed to collect old epochs: {e}")
+            epoch_gc_runs_total.inc(result="failed")
+            return None
+        finally:
+            keeper.cancel()
+            try:
+                await store.release(GC_LEASE_NAME, self.owner_id)
+            except Exception as e:
+                print(f"[Scheduler] Failed to release {GC_LEASE_NAME} lease: {e}")
+
+    def start_collector(self):
+        """古いエポックの削除をバックグラウンドで始める（実行中なら何もしない）"""
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.create_task(self.collect_old_epochs())
+
+    async def _resume_unfinished(self):
+        """起動時に、前のリーダーが終えられなかったリセットがあれば引き継ぐ"""
+        store = self._get_lease_store()
+        latest = await store.get_state(LATEST_RESET_KEY)
+        status = await self._load_status(latest["reset_id"]) if latest else None
+        if status is None or status["state"] == "done":
+            return
+        print(f"[Scheduler] Found unfinished room reset {status['reset_id']} ({status['state']}), resuming")
+        activate_at = datetime.datetime.fromisoformat(status["activate_at"]) if status.get("activate_at") else None
+        result = await self.reset_until_done(status["reset_id"], activate_at)
+        print(f"[Scheduler] Room reset {status['reset_id']} finished: {result}")
+
     async def start(self):
         """スケジューラーを開始"""
         if self.running:
             return
-        
+
         self.running = True
-        print("[Scheduler] Room scheduler started")
-        
+        print(f"[Scheduler] Room scheduler started as {self.owner_id}")
+
+        try:
+            await self._resume_unfinished()
+        except Exception as e:
+            print(f"[Scheduler] Failed to resume unfinished room reset: {e}")
+        # エポック導入前のデータの移行と、前のPodが削除し終えなかったエポックの削除を続きから行う
+        self.start_collector()
+
         while self.running:
             try:
                 next_reset = self.get_next_reset_time()
-                now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9)))
-                sleep_seconds = (next_reset - now).total_seconds()
-                
-                print(f"[Scheduler] Next reset at {next_reset.strftime('%Y-%m-%d %H:%M JST')}, sleeping for {sleep_seconds:.0f} seconds")
-                
+                # 組み合わせは0:00より前に書き込んでおき、0:00にはエポックを切り替えるだけにする
+                prepare_at = next_reset - datetime.timedelta(seconds=RESET_PREPARE_LEAD_SECONDS)
+                sleep_seconds = max(0.0, (prepare_at - _now()).total_seconds())
+
+                print(f"[Scheduler] Next reset at {next_reset.strftime('%Y-%m-%d %H:%M JST')}, preparing in {sleep_seconds:.0f} seconds")
+
                 await asyncio.sleep(sleep_seconds)
-                
+
                 if self.running:
-                    print(f"[Scheduler] Executing daily room reset at {datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9))).strftime('%Y-%m-%d %H:%M:%S JST')}")
-                    result = await self.reset_all_rooms()
+                    print(f"[Scheduler] Preparing daily room reset at {_now().strftime('%Y-%m-%d %H:%M:%S JST')}")
+                    result = await self.reset_until_done(next_reset.strftime('%Y-%m-%d'), activate_at=next_reset)
                     print(f"[Scheduler] Room reset completed: {result}")
-                    
+                    self.start_collector()
+                    # 諦めた場合なども同じ日のリセットを繰り返さないよう0:00を過ぎるまで待つ
+                    await asyncio.sleep(max(0.0, (next_reset - _now()).total_seconds()))
+
             except Exception as e:
                 print(f"[Scheduler] Error in scheduler loop: {e}")
                 await asyncio.sleep(60)  # エラー時は1分待機
-    
+
     def stop(self):
         """スケジューラーを停止"""
         self.running = False
         print("[Scheduler] Room scheduler stopped")
 
 # グローバルインスタンス
-room_scheduler = RoomScheduler()
\ No newline at end of file
+room_scheduler = RoomScheduler()
+
+registry.gauge("room_reset_leader", "1 while this pod holds the room reset lease", collect=lambda: 1 if room_scheduler.is_leader else 0)
+
+async def _collect_retired_epochs():
+    return len((await firestore_get_epochs())["retired"])
+
+registry.gauge("room_epochs_retired", "Room epochs waiting for background collection", collect=_collect_retired_epochs)
@@ -0,0 +1,137 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# 新しいトレースを記録する割合（0〜1）。親から受け取ったトレースは親の判定に従う
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+# none: 出力しない / stdout: ログに出す / file: TRACE_FILEにJSON Linesで追記
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'stdout')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """1区間の処理。trace_idが同じスパンが1つのメッセージの流れを表す"""
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "sampled", "start_time", "_started_at", "duration", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_time = time.time()
+        self._started_at = time.perf_counter()
+        self.duration = None
+        self.attributes = {}
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C Trace Context形式（Pub/Subのペイロードやジョブに載せて引き継ぐ）"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value):
+        if self.sampled:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        if self.sampled:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started_at
+        if self.sampled:
+            exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class SpanExporter:
+    """終了したスパンを書き出す（外部のコレクターなしで動くようにstdout/ファイルのみ）"""
+
+    def __init__(self, kind: str = TRACE_EXPORTER, path: str = TRACE_FILE):
+        self.kind = kind
+        self.path = path
+        self.exported = 0
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        if self.kind == 'none':
+            return
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        self.exported += 1
+        if self.kind == 'file':
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(f"[Trace] {line}")
+
+# グローバルインスタンス
+exporter = SpanExporter()
+
+def parse_traceparent(traceparent: Optional[str]):
+    """traceparentから (trace_id, 親span_id, sampled) を取り出す（不正ならNone）"""
+    if not traceparent:
+        return None
+    parts = traceparent.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == "01"
+
+def new_span(name: str, parent: Optional[str] = None, new_trace: bool = True, **attributes) -> Span:
+    """スパンを作る（現在のスパンは切り替えない。非同期ジェネレーターなど用）
+
+    parentにtraceparentを渡すとそのトレースの子になり、なければ現在のスパンの子、
+    それもなければ新しいトレースをTRACE_SAMPLE_RATEの確率で記録対象にして開始する
+    （new_trace=Falseなら記録しない）。
+    """
+    remote = parse_traceparent(parent)
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    else:
+        current = _current_span.get()
+        if current is not None:
+            trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+        else:
+            sampled = new_trace and random.random() < TRACE_SAMPLE_RATE
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+    span = Span(name, trace_id, parent_id, sampled)
+    if sampled:
+        span.attributes.update(attributes)
+    return span
+
+@contextmanager
+def start_span(name: str, parent: Optional[str] = None, new_trace: bool = True, **attributes):
+    """withブロックをスパンとして記録し、その間は現在のスパンにする"""
+    span = new_span(name, parent, new_trace, **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+def current_traceparent() -> Optional[str]:
+    """現在のスパンのtraceparent（スパン外、または記録対象外ならNone）"""
+    span = _current_span.get()
+    return span.traceparent if span is not None and span.sampled else None
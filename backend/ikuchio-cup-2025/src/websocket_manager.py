@@ -1,76 +1,320 @@
-import redis
 import json
 import asyncio
 import os
-from typing import Dict, List
+import uuid
+import time
+from typing import Dict, Optional, Union
 from fastapi import WebSocket
+from metrics import registry
+from tracing import current_traceparent, new_span, start_span
+
+# 接続ごとの送信キューの上限と、1回の送信にかけられる最大時間
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '64'))
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get('WS_SEND_TIMEOUT_SECONDS', '5'))
+# 送信キューが溢れた時の扱い（close: 接続を切る / drop: そのメッセージを捨てる）
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'close')
+
+ws_send_seconds = registry.histogram("ws_send_seconds", "Duration of a single WebSocket send")
+ws_send_lag_seconds = registry.histogram("ws_send_lag_seconds", "Time a message waited in a connection send queue")
+ws_fanout_seconds = registry.histogram("ws_fanout_seconds", "Time to enqueue a room message to every local connection")
+redis_publish_seconds = registry.histogram("redis_publish_seconds", "Duration of Redis PUBLISH for room messages")
+# 発行から他Podでの配信開始までの遅れ（Pod間の時計のずれを含む）
+redis_delivery_seconds = registry.histogram("redis_delivery_seconds", "Delay between Redis publish and subscriber delivery")
+
+class ConnectionWriter:
+    """1接続分の送信キューと送信タスク
+
+    ルームへの配信はキューに積むだけなので、遅いクライアントが他の接続への
+    配信を待たせることはない。
+    """
+    __slots__ = ("websocket", "room_id", "queue", "task", "sent", "dropped", "last_lag", "max_lag", "_on_failure")
+
+    def __init__(self, websocket: WebSocket, room_id: str, on_failure, max_queue: int = WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._on_failure = on_failure
+        self.task = asyncio.create_task(self._run())
+
+    def offer(self, message: str, traceparent: Optional[str] = None) -> bool:
+        """送信キューに積む。満杯ならFalse"""
+        try:
+            self.queue.put_nowait((time.monotonic(), message, traceparent))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def _run(self):
+        while True:
+            enqueued_at, message, traceparent = await self.queue.get()
+            send_started_at = time.monotonic()
+            span = new_span("ws.send", parent=traceparent, new_trace=False, room_id=self.room_id) if traceparent else None
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=WS_SEND_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if span is not None:
+                    span.record_error(e)
+                    span.end()
+                self._on_failure(self, f"send failed: {type(e).__name__}: {e}")
+                return
+            if span is not None:
+                span.end()
+            self.sent += 1
+            # キューに積まれてから送信完了までの遅れ
+            finished_at = time.monotonic()
+            self.last_lag = finished_at - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            ws_send_seconds.observe(finished_at - send_started_at)
+            ws_send_lag_seconds.observe(self.last_lag)
+
+    def stop(self):
+        self.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+        }
 
 class WebSocketManager:
+    """アプリ全体で唯一のWebSocket接続レジストリ
+
+    ルームへの通知はRedis Pub/Subの room:{room_id} チャンネルに流し、各Podは
+    ローカルに接続があるルームのチャンネルだけを購読して自Podの接続に配信する。
+    REDIS_URLが未設定の場合は自Pod内だけに配信する。
+    """
+
     def __init__(self):
-        redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
-        self.redis_client = redis.from_url(redis_url, decode_responses=True)
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        
+        self.redis_url = os.environ.get('REDIS_URL')
+        self.redis_client = None
+        self.active_connections: Dict[str, Dict[WebSocket, ConnectionWriter]] = {}
+        self.evicted = 0
+        self.pod_id = uuid.uuid4().hex[:12]
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._has_subscriptions = asyncio.Event()
+
+    def _get_redis(self):
+        if self.redis_client is None and self.redis_url:
+            from clients import clients
+            self.redis_client = clients.redis(self.redis_url)
+        return self.redis_client
+
+    def _connection_token(self, websocket: WebSocket) -> str:
+        return f"{self.pod_id}:{id(websocket)}"
+
     async def connect(self, websocket: WebSocket, room_id: str):
         await websocket.accept()
         if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
+            self.active_connections[room_id] = {}
+        self.active_connections[room_id][websocket] = ConnectionWriter(websocket, room_id, self._on_send_failure)
         print(f"[WebSocket] Client connected to room {room_id}")
-        
-    def disconnect(self, websocket: WebSocket, room_id: str):
-        if room_id in self.active_connections:
-            try:
-                self.active_connections[room_id].remove(websocket)
-                if not self.active_connections[room_id]:
-                    del self.active_connections[room_id]
-                print(f"[WebSocket] Client disconnected from room {room_id}")
-            except ValueError:
-                pass
-                
-    async def send_to_room(self, room_id: str, message: dict):
-        """同じPod内のWebSocket接続にメッセージを送信"""
+        # このPodで最初の接続ならルームのチャンネルを購読
+        if len(self.active_connections[room_id]) == 1:
+            await self._subscribe(room_id)
+
+    async def disconnect(self, websocket: WebSocket, room_id: str):
         if room_id in self.active_connections:
-            message_str = json.dumps(message)
-            disconnected = []
-            
-            for connection in self.active_connections[room_id]:
-                try:
-                    await connection.send_text(message_str)
-                except:
-                    disconnected.append(connection)
-            
-            # 切断された接続を削除
-            for conn in disconnected:
-                self.disconnect(conn, room_id)
-                
-    def publish_message(self, room_id: str, message: dict):
-        """Redis Pub/Subでメッセージを全Podに配信"""
+            writer = self.active_connections[room_id].pop(websocket, None)
+            if writer is None:
+                return
+            writer.stop()
+            print(f"[WebSocket] Client disconnected from room {room_id}")
+            if not self.active_connections[room_id]:
+                del self.active_connections[room_id]
+                await self._unsubscribe(room_id)
+
+    async def send_to_room(self, room_id: str, message: Union[str, dict], exclude_token: Optional[str] = None):
+        """同じPod内のWebSocket接続にメッセージを送信（各接続の送信キューに積むだけで待たない）"""
+        if room_id not in self.active_connections:
+            return
+        message_str = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+
+        # 記録対象のトレース中なら各接続の送信もそのトレースに含める
+        traceparent = current_traceparent()
+        with ws_fanout_seconds.time():
+            for connection, writer in list(self.active_connections.get(room_id, {}).items()):
+                if exclude_token is not None and self._connection_token(connection) == exclude_token:
+                    continue
+                if not writer.offer(message_str, traceparent) and WS_SLOW_CONSUMER_POLICY == 'close':
+                    self._evict(writer, "send queue overflow")
+
+    def send_to_connection(self, websocket: WebSocket, room_id: str, message: Union[str, dict]):
+        """特定の接続だけにメッセージを送信（再接続時の再送など）"""
+        writer = self.active_connections.get(room_id, {}).get(websocket)
+        if writer is None:
+            return
+        message_str = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+        if not writer.offer(message_str) and WS_SLOW_CONSUMER_POLICY == 'close':
+            self._evict(writer, "send queue overflow")
+
+    def _on_send_failure(self, writer: ConnectionWriter, reason: str):
+        self._evict(writer, reason)
+
+    def _evict(self, writer: ConnectionWriter, reason: str):
+        """遅い・壊れた接続を切断する（送信タスク自身から呼ばれるので別タスクで実行）"""
+        connections = self.active_connections.get(writer.room_id)
+        if not connections or connections.get(writer.websocket) is not writer:
+            return
+        print(f"[WebSocket] Evicting client from room {writer.room_id}: {reason}")
+        self.evicted += 1
+        asyncio.create_task(self._close_evicted(writer))
+
+    async def _close_evicted(self, writer: ConnectionWriter):
+        await self.disconnect(writer.websocket, writer.room_id)
+        try:
+            # 1013: Try Again Later（クライアントは再接続して差分を取り直す）
+            await asyncio.wait_for(writer.websocket.close(code=1013), timeout=WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    async def publish_message(self, room_id: str, message: Union[str, dict], exclude: Optional[WebSocket] = None):
+        """Redis Pub/Subでメッセージを全Podに配信（excludeの接続には送らない）"""
+        data = message if isinstance(message, str) else json.dumps(message, ensure_ascii=False)
+        exclude_token = self._connection_token(exclude) if exclude is not None else None
+        redis_client = self._get_redis()
+        if redis_client is None:
+            await self.send_to_room(room_id, data, exclude_token)
+            return
         try:
-            self.redis_client.publish(f"room:{room_id}", json.dumps(message))
+            with start_span("redis.publish", new_trace=False, room_id=room_id):
+                # 受信側Podの配信スパンをこのトレースの子にするためtraceparentを載せる
+                envelope = json.dumps({"data": data, "exclude": exclude_token, "published_at": time.time(),
+                                       "traceparent": current_traceparent()}, ensure_ascii=False)
+                with redis_publish_seconds.time():
+                    await redis_client.publish(f"room:{room_id}", envelope)
             print(f"[Redis] Published message to room {room_id}")
         except Exception as e:
+            # Redisが使えない場合も自Podの接続には届ける
             print(f"[Redis] Failed to publish message: {e}")
-            
+            await self.send_to_room(room_id, data, exclude_token)
+
+    async def _subscribe(self, room_id: str):
+        if self._pubsub is None:
+            return
+        try:
+            await self._pubsub.subscribe(f"room:{room_id}")
+            self._has_subscriptions.set()
+        except Exception as e:
+            print(f"[Redis] Failed to subscribe to room {room_id}: {e}")
+
+    async def _unsubscribe(self, room_id: str):
+        if self._pubsub is None:
+            return
+        try:
+            await self._pubsub.unsubscribe(f"room:{room_id}")
+        except Exception as e:
+            print(f"[Redis] Failed to unsubscribe from room {room_id}: {e}")
+        if not self.active_connections:
+            self._has_subscriptions.clear()
+
+    async def _deliver(self, message: dict):
+        room_id = message['channel'].split(':', 1)[1]
+        traceparent = None
+        try:
+            envelope = json.loads(message['data'])
+            data, exclude_token = envelope["data"], envelope.get("exclude")
+            traceparent = envelope.get("traceparent")
+            if envelope.get("published_at"):
+                redis_delivery_seconds.observe(max(0.0, time.time() - envelope["published_at"]))
+        except (ValueError, KeyError, TypeError):
+            data, exclude_token = message['data'], None
+        if traceparent is None:
+            await self.send_to_room(room_id, data, exclude_token)
+            return
+        with start_span("ws.deliver", parent=traceparent, room_id=room_id, pod_id=self.pod_id):
+            await self.send_to_room(room_id, data, exclude_token)
+
+    async def _listen(self):
+        while True:
+            try:
+                # 購読中のチャンネルがなければ待機（get_messageを空回りさせない）
+                if not self.active_connections:
+                    await self._has_subscriptions.wait()
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message['type'] == 'message':
+                    await self._deliver(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Redis] Subscriber error: {e}")
+                await asyncio.sleep(1.0)
+                await self._reset_pubsub()
+
+    async def _reset_pubsub(self):
+        """接続エラー後にPubSubを作り直し、ローカル接続のあるルームを再購読"""
+        try:
+            await self._pubsub.reset()
+        except Exception:
+            pass
+        self._pubsub = self._get_redis().pubsub()
+        for room_id in list(self.active_connections):
+            await self._subscribe(room_id)
+
     async def start_subscriber(self):
         """Redis Pub/Subの購読を開始"""
-        pubsub = self.redis_client.pubsub()
-        pubsub.psubscribe("room:*")
-        
-        async def listen():
-            while True:
-                try:
-                    message = pubsub.get_message(timeout=1.0)
-                    if message and message['type'] == 'pmessage':
-                        channel = message['channel']
-                        room_id = channel.split(':', 1)[1]
-                        data = json.loads(message['data'])
-                        await self.send_to_room(room_id, data)
-                except Exception as e:
-                    print(f"[Redis] Subscriber error: {e}")
-                await asyncio.sleep(0.1)
-        
-        asyncio.create_task(listen())
+        redis_client = self._get_redis()
+        if redis_client is None:
+            print("[Redis] REDIS_URL not set, delivering WebSocket messages within this pod only")
+            return
+        if self._listener_task is not None:
+            return
+        self._pubsub = redis_client.pubsub()
+        for room_id in list(self.active_connections):
+            await self._subscribe(room_id)
+        self._listener_task = asyncio.create_task(self._listen())
+        print("[Redis] Subscriber started")
+
+    async def stop_subscriber(self):
+        """Redis Pub/Subの購読を停止"""
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.reset()
+            except Exception as e:
+                print(f"[Redis] Failed to close subscriber: {e}")
+            self._pubsub = None
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def connection_stats(self) -> dict:
+        """接続数・送信キュー・配信遅延の集計"""
+        writers = [writer for connections in self.active_connections.values() for writer in connections.values()]
+        return {
+            "rooms": len(self.active_connections),
+            "connections": len(writers),
+            "evicted": self.evicted,
+            "queued": sum(writer.queue.qsize() for writer in writers),
+            "dropped": sum(writer.dropped for writer in writers),
+            "max_lag_seconds": max((writer.max_lag for writer in writers), default=0.0),
+            "per_connection": [writer.stats() for writer in writers],
+        }
 
 # グローバルインスタンス
-websocket_manager = WebSocketManager()
\ No newline at end of file
+websocket_manager = WebSocketManager()
+
+registry.gauge("ws_active_rooms", "Rooms with at least one WebSocket on this pod",
+               collect=lambda: len(websocket_manager.active_connections))
+registry.gauge("ws_active_connections", "WebSocket connections on this pod",
+               collect=websocket_manager.connection_count)
+registry.gauge("ws_send_queue_depth", "Messages waiting in WebSocket send queues on this pod",
+               collect=lambda: sum(writer.queue.qsize() for connections in websocket_manager.active_connections.values()
+                                   for writer in connections.values()))
@@ -0,0 +1,77 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+from db.bulk_writer import BatchWriter, iter_pages
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append(("set", ref))
+
+    def update(self, ref, data):
+        self.ops.append(("update", ref))
+
+    def delete(self, ref):
+        self.ops.append(("delete", ref))
+
+    async def commit(self):
+        self.db.in_flight += 1
+        self.db.max_in_flight = max(self.db.max_in_flight, self.db.in_flight)
+        await asyncio.sleep(0.01)
+        self.db.in_flight -= 1
+        self.db.committed.append(self.ops)
+
+class FakeDB:
+    def __init__(self):
+        self.committed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+def test_batch_writer_groups_and_limits_concurrency():
+    async def run():
+        db = FakeDB()
+        writer = BatchWriter(db, "test", batch_size=10, concurrency=2)
+        for i in range(33):
+            await writer.write_group([("set", f"room_{i}", {}), ("update", f"user_{i}", {})])
+        stats = await writer.close()
+        return db, stats
+
+    db, stats = asyncio.run(run())
+    assert stats["committed_ops"] == 66
+    assert stats["failed_ops"] == 0
+    # グループはバッチをまたがない
+    assert all(len(ops) <= 10 and len(ops) % 2 == 0 for ops in db.committed)
+    assert db.max_in_flight <= 2
+
+def test_iter_pages_walks_documents_in_id_order():
+    from standins import FakeFirestore
+
+    async def run():
+        db = FakeFirestore()
+        db.seed("users", {f"user_{i}": {"firebase_uid": str(i), "active": i != 4} for i in range(7)})
+        pages = [[doc.id for doc in docs] async for docs in iter_pages(db.collection("users"), page_size=3)]
+        # 条件付きのクエリもページに分けて最後まで読む
+        active = [doc.id async for docs in iter_pages(db.collection("users").where("active", "==", True), page_size=3) for doc in docs]
+        # ちょうどページの倍数なら、最後に空のページを読んで終わる
+        db.seed("users", {"user_7": {"firebase_uid": "7", "active": True}})
+        reads_before = db.counters.reads
+        full_pages = [len(docs) async for docs in iter_pages(db.collection("users"), page_size=4)]
+        return pages, active, full_pages, db.counters.reads - reads_before
+
+    pages, active, full_pages, reads = asyncio.run(run())
+    assert pages == [["user_0", "user_1", "user_2"], ["user_3", "user_4", "user_5"], ["user_6"]]
+    assert active == ["user_0", "user_1", "user_2", "user_3", "user_5", "user_6"]
+    assert full_pages == [4, 4] and reads == 9
+
+if __name__ == '__main__':
+    test_batch_writer_groups_and_limits_concurrency()
+    test_iter_pages_walks_documents_in_id_order()
@@ -0,0 +1,159 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+from standins import FakeFirestore
+from clients import clients
+from cache.user_cache import user_cache
+
+def _storage():
+    """FakeFirestoreにつないだFirestoreStorage（キャッシュは空にしておく）"""
+    from db.firestore_storage import FirestoreStorage
+    fake_db = FakeFirestore()
+    clients._firestore = fake_db
+    user_cache.cache.local.clear()
+    return FirestoreStorage(), fake_db
+
+def test_create_user_writes_without_reading_first():
+    from db import users
+
+    async def run():
+        storage, fake_db = _storage()
+        original_storage = users.storage
+        users.storage = storage
+        try:
+            await storage.get_current_epoch()
+            reads_before = fake_db.counters.reads
+            created = await users.firestore_create_user("new")
+            reads_for_new_user = fake_db.counters.reads - reads_before
+
+            # キャッシュにない既存ユーザーは作成が失敗してから読む
+            user_cache.cache.local.clear()
+            existing = await users.firestore_create_user("new")
+        finally:
+            users.storage = original_storage
+        return created, reads_for_new_user, existing
+
+    created, reads_for_new_user, existing = asyncio.run(run())
+    assert created["firebase_uid"] == "new"
+    assert reads_for_new_user == 0
+    assert existing["firebase_uid"] == "new" and existing["room_id"] is None
+
+def _seed_legacy_data(fake_db):
+    """エポック導入前の形のデータ（割り当てはusers.room_id、ルームとターンにepochがない）"""
+    fake_db.seed("users", {
+        "user_a": {"firebase_uid": "a", "created_at": None, "room_id": "legacy_room"},
+        "user_b": {"firebase_uid": "b", "created_at": None, "room_id": "legacy_room"},
+        "user_c": {"firebase_uid": "c", "created_at": None, "room_id": None},
+        "user_d": {"firebase_uid": "d", "created_at": None, "room_id": None},
+    })
+    fake_db.seed("rooms", {"legacy_room": {"id": "legacy_room", "users": ["user_a", "user_b"]}})
+    fake_db.seed("turns", {"turn_1": {"id": "turn_1", "room_id": "legacy_room", "created_at": "2025-01-01T00:00:00+09:00"}})
+    # 導入後にマッチングで割り当てられたユーザー（移行で上書きしない）
+    fake_db.seed("assignments", {"initial_user_d": {"firebase_uid": "d", "created_at": None, "room_id": "new_room", "epoch": "initial"}})
+
+def test_legacy_data_is_migrated_into_the_initial_epoch():
+    async def run():
+        storage, fake_db = _storage()
+        _seed_legacy_data(fake_db)
+        before = (await storage.get_user("a"), await storage.get_room("legacy_room"))
+
+        migrated = await storage.migrate_legacy_data()
+        user_cache.cache.local.clear()
+        after = {uid: (await storage.get_user(uid))["room_id"] for uid in ("a", "b", "c", "d")}
+        unassigned = [user["firebase_uid"] for user in await storage.find_unassigned_users(10)]
+        # 移行は1回だけ
+        again = await storage.migrate_legacy_data()
+
+        await storage.activate_epoch("day1")
+        await storage.collect_epoch("initial")
+        remaining = {name: fake_db.count(name) for name in ("rooms", "turns", "assignments", "users")}
+        return before, migrated, after, unassigned, again, remaining
+
+    before, migrated, after, unassigned, again, remaining = asyncio.run(run())
+    user, room = before
+    assert user["room_id"] == "legacy_room" and room["id"] == "legacy_room"
+    assert migrated["assignments"]["committed_ops"] == 3
+    assert after == {"a": "legacy_room", "b": "legacy_room", "c": None, "d": "new_room"}
+    assert unassigned == ["c"]
+    assert again == {}
+    # 初期エポックの削除でエポック導入前のルーム・ターンも消える
+    assert remaining == {"rooms": 0, "turns": 0, "assignments": 0, "users": 4}
+
+def test_legacy_documents_are_collected_after_an_early_reset():
+    async def run():
+        storage, fake_db = _storage()
+        _seed_legacy_data(fake_db)
+        # 移行より先に初期エポックの削除が終わっていた場合
+        await storage.activate_epoch("day1")
+        await storage._save_epochs({**await storage.get_epochs(), "retired": []})
+        await storage.migrate_legacy_data()
+        retired = (await storage.get_epochs())["retired"]
+        await storage.collect_epoch("initial")
+        return retired, fake_db.count("rooms"), fake_db.count("turns")
+
+    assert asyncio.run(run()) == (["initial"], 0, 0)
+
+def test_retired_rooms_do_not_serve_history():
+    from cache.message_cache import room_message_cache
+    import db.rooms as rooms
+
+    async def run():
+        storage, fake_db = _storage()
+        await storage.activate_epoch("day1")
+        fake_db.seed("rooms", {"old": {"id": "old", "users": [], "epoch": "day1"}})
+        await storage.save_turn({"id": "t1", "room_id": "old", "created_at": "2025-01-01T00:00:00+09:00"})
+        original_storage = rooms.storage
+        rooms.storage = storage
+        try:
+            before_cutover = await rooms.firestore_get_messages("old")
+            await storage.activate_epoch("day2")
+            fake_db.seed("rooms", {"new": {"id": "new", "users": [], "epoch": "day2"}})
+            # 削除されるまでの間も、キャッシュに残っていても前のエポックの履歴は返さない
+            after_cutover = await rooms.firestore_get_messages("old")
+            new_room = await rooms.firestore_get_messages("new")
+        finally:
+            rooms.storage = original_storage
+        cached_before_collect = await room_message_cache.cache.get("old")
+        await storage.collect_epoch("day1")
+        return before_cutover, after_cutover, new_room, cached_before_collect, await room_message_cache.cache.get("old")
+
+    before_cutover, after_cutover, new_room, cached_before_collect, cached_after_collect = asyncio.run(run())
+    assert [turn["id"] for turn in before_cutover] == ["t1"]
+    assert after_cutover is None
+    assert new_room == []
+    # 削除したルームの履歴キャッシュも消える
+    assert cached_before_collect is not None and cached_after_collect is None
+
+def test_reset_and_collector_run_on_firestore():
+    import db.rooms as rooms
+
+    async def run():
+        storage, fake_db = _storage()
+        _seed_legacy_data(fake_db)
+        original_storage = rooms.storage
+        rooms.storage = storage
+        try:
+            # 一覧・移行・削除はどれもページ単位の走査（iter_pages）を通る
+            result = await rooms.firestore_reset_all_rooms("day1")
+            collected = await rooms.firestore_collect_old_epochs(pause_seconds=0)
+        finally:
+            rooms.storage = original_storage
+        room_epochs = {doc["epoch"] for doc in fake_db._docs("rooms").values()}
+        return result, collected, room_epochs, fake_db.count("turns"), await storage.get_epochs()
+
+    result, collected, room_epochs, turns, epochs = asyncio.run(run())
+    assert result["created_rooms"] == 2
+    # エポック導入前のルーム・ターンも初期エポックとして消える
+    assert collected["initial"]["rooms"]["committed_ops"] == 1
+    assert room_epochs == {"day1"} and turns == 0
+    assert epochs["current"] == "day1" and epochs["retired"] == []
+
+if __name__ == '__main__':
+    test_create_user_writes_without_reading_first()
+    test_legacy_data_is_migrated_into_the_initial_epoch()
+    test_legacy_documents_are_collected_after_an_early_reset()
+    test_retired_rooms_do_not_serve_history()
+    test_reset_and_collector_run_on_firestore()
@@ -0,0 +1,58 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from scheduler.lease import InMemoryLeaseStore
+
+def test_in_memory_lease_has_a_single_holder():
+    async def run():
+        store = InMemoryLeaseStore()
+        assert await store.acquire("reset", "pod-a", 60)
+        assert not await store.acquire("reset", "pod-b", 60)
+        # 保持者以外は延長・解放できない
+        assert not await store.renew("reset", "pod-b", 60)
+        assert not await store.release("reset", "pod-b")
+        assert await store.renew("reset", "pod-a", 60)
+        holder = await store.holder("reset")
+        assert await store.release("reset", "pod-a")
+        taken_over = await store.acquire("reset", "pod-b", 60)
+        return holder, taken_over
+
+    holder, taken_over = asyncio.run(run())
+    assert holder == "pod-a"
+    assert taken_over
+
+def test_expired_lease_can_be_taken_over():
+    async def run():
+        store = InMemoryLeaseStore()
+        assert await store.acquire("reset", "pod-a", 0.01)
+        await asyncio.sleep(0.02)
+        # 期限切れの元リーダーは延長できず、他のPodが取得できる
+        renewed = await store.renew("reset", "pod-a", 60)
+        acquired = await store.acquire("reset", "pod-b", 60)
+        return renewed, acquired
+
+    renewed, acquired = asyncio.run(run())
+    assert not renewed
+    assert acquired
+
+def test_state_is_copied_and_expires():
+    async def run():
+        store = InMemoryLeaseStore()
+        state = {"assigned_rooms": 1}
+        await store.set_state("checkpoint", state)
+        state["assigned_rooms"] = 2
+        loaded = await store.get_state("checkpoint")
+        await store.set_state("short", {"x": 1}, ttl_seconds=0.01)
+        await asyncio.sleep(0.02)
+        return loaded, await store.get_state("short"), await store.get_state("missing")
+
+    loaded, expired, missing = asyncio.run(run())
+    assert loaded == {"assigned_rooms": 1}
+    assert expired is None and missing is None
+
+if __name__ == '__main__':
+    test_in_memory_lease_has_a_single_holder()
+    test_expired_lease_can_be_taken_over()
+    test_state_is_copied_and_expires()
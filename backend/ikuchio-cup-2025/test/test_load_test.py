@@ -0,0 +1,87 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+from standins import FakeFirestore, DOCUMENT_ID
+from load_test import LatencyRecorder, TrafficDriver, check_reset, compare_with_baseline, percentile
+
+def test_fake_firestore_orders_and_pages_like_firestore():
+    async def run():
+        db = FakeFirestore()
+        db.seed("turns", {
+            f"t{i}": {"id": f"t{i}", "room_id": "room_a" if i % 2 == 0 else "room_b", "created_at": f"2025-01-01T00:00:0{i}"}
+            for i in range(8)
+        })
+        turns = db.collection("turns").where("room_id", "==", "room_a")
+        newest = await turns.order_by("created_at", direction="DESCENDING").order_by("id", direction="DESCENDING").limit(2).get()
+        since = await turns.order_by("created_at").order_by("id").start_after({"created_at": "2025-01-01T00:00:02", "id": "t2"}).get()
+
+        pages = []
+        query = db.collection("turns").select(["id"]).order_by(DOCUMENT_ID).limit(3)
+        page = await query.get()
+        while page:
+            pages.append([doc.id for doc in page])
+            page = await query.start_after(page[-1]).get()
+        return db, newest, since, pages
+
+    db, newest, since, pages = asyncio.run(run())
+    assert [doc.id for doc in newest] == ["t6", "t4"]
+    assert [doc.id for doc in since] == ["t4", "t6"]
+    assert pages == [["t0", "t1", "t2"], ["t3", "t4", "t5"], ["t6", "t7"]]
+    assert db.counters.rpcs == 2 + 4
+    # 空の結果も1読み取りとして数える
+    assert db.counters.reads == 2 + 2 + 8 + 1
+
+def test_compare_with_baseline_flags_regressions():
+    baseline = {
+        "operations": {"GET /api/room": {"rps": 100.0, "p95_ms": 10.0, "p99_ms": 20.0}},
+        "delivery": {"p95_ms": 900.0, "p99_ms": 1200.0},
+        "phases": {"steady": {"reads_per_request": 1.0}, "reset": {"elapsed_seconds": 2.0}},
+    }
+    same = {
+        "operations": {"GET /api/room": {"rps": 95.0, "p95_ms": 11.0, "p99_ms": 20.5}},
+        "delivery": {"p95_ms": 950.0, "p99_ms": 1200.0},
+        "phases": {"steady": {"reads_per_request": 1.1}, "reset": {"elapsed_seconds": 2.1}},
+    }
+    worse = {
+        "operations": {"GET /api/room": {"rps": 50.0, "p95_ms": 30.0, "p99_ms": 20.0}},
+        "delivery": {"p95_ms": 900.0, "p99_ms": 1200.0},
+        "phases": {"steady": {"reads_per_request": 3.0}, "reset": {"elapsed_seconds": 5.0}},
+    }
+    assert compare_with_baseline(same, baseline, tolerance=0.2) == []
+    regressions = compare_with_baseline(worse, baseline, tolerance=0.2)
+    assert len(regressions) == 4
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+
+def test_failed_reset_aborts_the_run():
+    # {"error": ...} の応答は _request がNoneにする
+    assert check_reset(None, 20) is not None
+    assert check_reset({"message": "ok", "created_rooms": 0}, 20) is not None
+    assert check_reset({"message": "Not enough users to create rooms", "created_rooms": 0}, 1) is None
+    assert check_reset({"message": "ok", "created_rooms": 10}, 20) is None
+
+def test_traffic_stops_at_the_deadline():
+    import random
+    import time
+    from types import SimpleNamespace
+
+    class IdleClient:
+        async def request(self, method, url, **kwargs):
+            return SimpleNamespace(status_code=200, json=lambda: [])
+
+    # 送信・ポーリングの間隔がdurationよりずっと長くても、待つのは期限まで
+    args = SimpleNamespace(poll_interval=30.0, send_interval=60.0)
+    driver = TrafficDriver(IdleClient(), args, random.Random(1))
+    driver.rooms = {"a": "room", "b": "room"}
+    started_at = time.perf_counter()
+    asyncio.run(driver.run(0.2, LatencyRecorder()))
+    assert time.perf_counter() - started_at < 1.0
+
+if __name__ == '__main__':
+    test_fake_firestore_orders_and_pages_like_firestore()
+    test_compare_with_baseline_flags_regressions()
+    test_failed_reset_aborts_the_run()
+    test_traffic_stops_at_the_deadline()
@@ -0,0 +1,56 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from matchmaking.queue import InMemoryMatchQueue
+
+def test_in_memory_queue_pairs_in_arrival_order():
+    async def run():
+        queue = InMemoryMatchQueue()
+        assert await queue.enqueue("a")
+        assert not await queue.enqueue("a")  # 二重登録しない
+        assert await queue.pop_pair() is None
+        await queue.enqueue("b")
+        await queue.enqueue("c")
+        first = await queue.pop_pair()
+        remaining = await queue.size()
+        return first, remaining
+
+    first, remaining = asyncio.run(run())
+    assert first == ["a", "b"]
+    assert remaining == 1
+
+def test_unmatched_user_keeps_its_place_in_the_queue():
+    import matchmaking.matchmaker as matchmaker_module
+    from matchmaking.matchmaker import Matchmaker
+
+    attempts = []
+
+    async def create_room_for_pair(user1_id, user2_id):
+        attempts.append((user1_id, user2_id))
+        if "b" in (user1_id, user2_id):
+            # bは既に割り当て済みで、相手だけ未割り当てとして戻ってくる
+            return None, [uid for uid in (user1_id, user2_id) if uid != "b"]
+        return {"id": "room"}, []
+
+    async def run():
+        queue = InMemoryMatchQueue()
+        for uid in ("a", "b", "late"):
+            await queue.enqueue(uid)
+            await asyncio.sleep(0.001)
+        # (a, b) は組めずaが戻され、次に組むのは後から来たlateとの組
+        await Matchmaker(queue).match_available()
+        return attempts
+
+    original = matchmaker_module.firestore_create_room_for_pair
+    matchmaker_module.firestore_create_room_for_pair = create_room_for_pair
+    try:
+        # 戻されたaは後から来たlateより前に並ぶ
+        assert asyncio.run(run()) == [("a", "b"), ("a", "late")]
+    finally:
+        matchmaker_module.firestore_create_room_for_pair = original
+
+if __name__ == '__main__':
+    test_in_memory_queue_pairs_in_arrival_order()
+    test_unmatched_user_keeps_its_place_in_the_queue()
@@ -0,0 +1,139 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+from db.memory_storage import MemoryStorage
+from db.storage import decode_message_cursor
+
+def _turn(turn_id, room_id, second):
+    return {
+        "id": turn_id,
+        "room_id": room_id,
+        "original_sender_id": "a",
+        "original_text": turn_id,
+        "processed_text": turn_id,
+        "created_at": f"2025-01-01T00:00:{second:02d}+09:00",
+        "processed_at": f"2025-01-01T00:00:{second:02d}+09:00",
+    }
+
+def test_users_rooms_and_unassigned_index():
+    async def run():
+        storage = MemoryStorage()
+        for uid in ("a", "b", "c"):
+            assert await storage.create_user({"firebase_uid": uid, "created_at": None, "room_id": None})
+        assert not await storage.create_user({"firebase_uid": "a", "created_at": None, "room_id": None})
+
+        room = {"id": "room_1", "created_at": None, "users": ["user_a", "user_b"]}
+        assigned = await storage.assign_pair("a", "b", room)
+        # 割り当て済みのaとは組めず、未割り当てのcだけが返る
+        rejected = await storage.assign_pair("a", "c", {"id": "room_2", "created_at": None, "users": ["user_a", "user_c"]})
+        unassigned = await storage.find_unassigned_users(10)
+        rooms_for_a = await storage.list_rooms_for_user("a")
+        return storage, assigned, rejected, unassigned, rooms_for_a
+
+    storage, assigned, rejected, unassigned, rooms_for_a = asyncio.run(run())
+    assert assigned[0]["id"] == "room_1" and {user["room_id"] for user in assigned[1]} == {"room_1"}
+    assert rejected == (None, [{"firebase_uid": "c", "created_at": None, "room_id": None}])
+    assert [user["firebase_uid"] for user in unassigned] == ["c"]
+    assert [room["id"] for room in rooms_for_a] == ["room_1"]
+    assert storage.stats()["rooms"] == 1
+
+def test_turns_are_ordered_and_paged_by_cursor():
+    async def run():
+        storage = MemoryStorage()
+        # 完了順とcreated_at順は一致しない
+        for turn_id, second in (("t3", 3), ("t1", 1), ("t2", 2), ("t4", 4)):
+            await storage.create_pending_turn({"id": turn_id, "room_id": "r"})
+            await storage.save_turn(_turn(turn_id, "r", second), pending=True)
+        await storage.save_turn(_turn("x1", "other", 1))
+        # 同じturn_idの再保存は上書き
+        await storage.save_turn(_turn("t2", "r", 2))
+
+        latest = await storage.get_turns("r", limit=2)
+        since = await storage.get_turns("r", since=decode_message_cursor(latest[0]["cursor"]))
+        before = await storage.get_turns("r", before=decode_message_cursor(latest[0]["cursor"]), limit=10)
+        return storage, latest, since, before
+
+    storage, latest, since, before = asyncio.run(run())
+    assert [turn["id"] for turn in latest] == ["t3", "t4"]
+    assert [turn["id"] for turn in since] == ["t4"]
+    assert [turn["id"] for turn in before] == ["t1", "t2"]
+    assert storage.stats()["turns"] == 5
+    assert storage.stats()["pending_turns"] == 0
+
+def test_epoch_cutover_switches_rooms_and_assignments():
+    async def run():
+        storage = MemoryStorage()
+        for uid in ("a", "b", "c"):
+            await storage.create_user({"firebase_uid": uid, "created_at": None, "room_id": None})
+        await storage.assign_pair("a", "b", {"id": "old", "created_at": None, "users": ["user_a", "user_b"]})
+        await storage.save_turn(_turn("t1", "old", 1))
+
+        await storage.prepare_epoch("day2")
+        # 準備中に登録したユーザーは新しいエポックでも未割り当て
+        await storage.create_user({"firebase_uid": "d", "created_at": None, "room_id": None})
+        new_rooms = [{"id": "new", "created_at": None, "users": ["user_b", "user_c"]}]
+        stats = await storage.write_assignments("day2", new_rooms, [
+            {"firebase_uid": "a", "created_at": None, "room_id": None},
+            {"firebase_uid": "b", "created_at": None, "room_id": "new"},
+            {"firebase_uid": "c", "created_at": None, "room_id": "new"},
+        ])
+        # 切り替えまでは前のエポックのまま
+        before_cutover = (await storage.get_user("a"))["room_id"], await storage.get_room("new")
+
+        epochs = await storage.activate_epoch("day2")
+        after_cutover = {
+            "room_a": (await storage.get_user("a"))["room_id"],
+            "room_c": (await storage.get_user("c"))["room_id"],
+            "old_room": await storage.get_room("old"),
+            "old_turns": await storage.get_turns("old"),
+            "current_rooms": [await storage.is_current_room(room_id) for room_id in ("old", "new")],
+            "unassigned": [user["firebase_uid"] for user in await storage.find_unassigned_users(10)],
+        }
+        collected = await storage.collect_epoch("initial")
+        return storage, stats, before_cutover, epochs, after_cutover, collected
+
+    storage, stats, before_cutover, epochs, after_cutover, collected = asyncio.run(run())
+    assert stats["failed_ops"] == 0
+    assert before_cutover == ("old", None)
+    assert epochs == {"current": "day2", "next": None, "retired": ["initial"]}
+    assert after_cutover == {"room_a": None, "room_c": "new", "old_room": None, "old_turns": [],
+                             "current_rooms": [False, True], "unassigned": ["d", "a"]}
+    assert collected == {"rooms": {"deleted": 1}, "turns": {"deleted": 1}, "assignments": {"deleted": 4}}
+    assert asyncio.run(storage.get_turn("t1")) is None
+    assert asyncio.run(storage.get_epochs())["retired"] == []
+    assert storage.stats()["epochs"] == 1
+
+def test_turn_status_is_hidden_after_cutover():
+    import db.rooms as rooms
+
+    async def run():
+        for uid in ("a", "b"):
+            await storage.create_user({"firebase_uid": uid, "created_at": None, "room_id": None})
+        await storage.assign_pair("a", "b", {"id": "old", "created_at": None, "users": ["user_a", "user_b"]})
+        await storage.save_turn(_turn("t1", "old", 1))
+        await storage.create_pending_turn({"id": "p1", "room_id": "old", "status": "pending"})
+        before = [await rooms.firestore_get_turn_status("old", turn_id) for turn_id in ("t1", "p1")]
+        other_room = await rooms.firestore_get_turn_status("new", "t1")
+        await storage.activate_epoch("day2")
+        # 削除前でも前のエポックのルームのターンは返さない
+        after = [await rooms.firestore_get_turn_status("old", turn_id) for turn_id in ("t1", "p1")]
+        return before, other_room, after
+
+    original_storage = rooms.storage
+    rooms.storage = storage = MemoryStorage()
+    try:
+        before, other_room, after = asyncio.run(run())
+    finally:
+        rooms.storage = original_storage
+    assert [result["status"] for result in before] == ["done", "pending"]
+    assert other_room is None
+    assert after == [None, None]
+
+if __name__ == '__main__':
+    test_users_rooms_and_unassigned_index()
+    test_turns_are_ordered_and_paged_by_cursor()
+    test_epoch_cutover_switches_rooms_and_assignments()
+    test_turn_status_is_hidden_after_cutover()
@@ -0,0 +1,31 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from cache.message_cache import RoomMessageCache
+
+def _turn(i):
+    return {"id": f"turn_{i}", "created_at": f"2025-01-01T00:00:{i:02d}+09:00", "processed_text": str(i)}
+
+def test_room_message_cache_write_through_and_window():
+    async def run():
+        cache = RoomMessageCache(window=3)
+        # 読み込み前に保存されたターンも、後からの読み込み結果とマージされる
+        await cache.append("room", _turn(4))
+        assert await cache.get_latest("room", 3) is None
+        await cache.fill("room", [_turn(1), _turn(2), _turn(3)], complete=True)
+        latest = await cache.get_latest("room", 3)
+        since = await cache.get_since("room", {"created_at": _turn(2)["created_at"], "id": "turn_2"}, 10)
+        too_old = await cache.get_since("room", {"created_at": _turn(1)["created_at"], "id": "turn_1"}, 10)
+        return latest, since, too_old, cache.stats()
+
+    latest, since, too_old, stats = asyncio.run(run())
+    assert [t["id"] for t in latest] == ["turn_2", "turn_3", "turn_4"]
+    assert [t["id"] for t in since] == ["turn_3", "turn_4"]
+    # turn_1はウィンドウから外れたので差分取得には答えられない
+    assert too_old is None
+    assert stats["local_bytes"] > 0
+
+if __name__ == '__main__':
+    test_room_message_cache_write_through_and_window()
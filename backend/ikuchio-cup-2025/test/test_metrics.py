@@ -0,0 +1,25 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from metrics import MetricsRegistry
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("op_seconds", "Operation duration", ("operation",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, operation="get_user")
+    histogram.observe(5, operation="get_user")
+    registry.counter("sent_total", "Sent messages").inc(2)
+    registry.gauge("queue_depth", "Jobs by state", ("state",), collect=lambda: {"pending": 3})
+
+    text = asyncio.run(registry.render())
+    assert '# TYPE op_seconds histogram' in text
+    assert 'op_seconds_bucket{operation="get_user",le="0.1"} 1' in text
+    assert 'op_seconds_bucket{operation="get_user",le="+Inf"} 2' in text
+    assert 'op_seconds_count{operation="get_user"} 2' in text
+    assert 'sent_total 2' in text
+    assert 'queue_depth{state="pending"} 3' in text
+
+if __name__ == '__main__':
+    test_registry_renders_prometheus_text()
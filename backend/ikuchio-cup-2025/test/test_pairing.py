@@ -0,0 +1,130 @@
+import sys
+import os
+import asyncio
+import random
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+from matchmaking.pairing import PairHistory, match_users
+
+def _met(pairs):
+    return {frozenset(pair) for pair in pairs}
+
+def test_pairs_are_not_repeated_across_resets():
+    rng = random.Random(3)
+    users = [f"u{i}" for i in range(200)]
+    history = PairHistory()
+    met = set()
+    for round_number in range(10):
+        rng.shuffle(users)
+        # 本番と同じく保存した索引を読み直して使う
+        history = PairHistory.from_bytes(history.to_bytes())
+        pairs, odd, stats = match_users(users, history, f"day{round_number}", rng=rng)
+        assert odd is None
+        assert sorted(uid for pair in pairs for uid in pair) == sorted(users)
+        assert stats["repeats"] == 0
+        assert not met & _met(pairs)
+        met |= _met(pairs)
+
+def test_odd_user_is_carried_to_the_next_reset():
+    rng = random.Random(5)
+    users = [f"u{i}" for i in range(11)]
+    history = PairHistory()
+    _, odd, _ = match_users(users, history, "day1", rng=rng)
+    assert odd is not None and history.carry == [odd]
+
+    rng.shuffle(users)
+    pairs, next_odd, stats = match_users(users, PairHistory.from_bytes(history.to_bytes()), "day2", rng=rng)
+    assert stats["carried"] == 1
+    assert next_odd != odd
+    assert any(odd in pair for pair in pairs)
+
+def test_small_groups_fall_back_to_repeats():
+    history = PairHistory()
+    users = ["a", "b", "c", "d"]
+    repeats = 0
+    # 4人の組み合わせは3通りしかないので、4回目以降は同じペアを許すしかない
+    for round_number in range(5):
+        pairs, odd, stats = match_users(users, history, f"day{round_number}", rng=random.Random(round_number))
+        assert odd is None and len(pairs) == 2
+        repeats += stats["repeats"]
+    assert repeats > 0
+
+def test_same_epoch_does_not_advance_history():
+    history = PairHistory()
+    match_users(["a", "b"], history, "day1")
+    generation_epochs = history.generation_epochs
+    # チェックポイントからのやり直しで同じエポックを組み直しても世代は進まない
+    match_users(["a", "b"], history, "day1")
+    assert history.generation_epochs == generation_epochs
+    assert PairHistory.from_bytes(b"broken").stats()["generations"] == 0
+
+def test_reset_pairs_users_it_has_not_paired_before():
+    from db.memory_storage import MemoryStorage
+    import db.rooms as rooms
+
+    async def run():
+        for uid in ("a", "b", "c", "d"):
+            await storage.create_user({"firebase_uid": uid, "created_at": None, "room_id": None})
+        first = await rooms.firestore_reset_all_rooms("day1")
+        first_rooms = {frozenset(room["users"]) for room in await storage.list_rooms()}
+        second = await rooms.firestore_reset_all_rooms("day2")
+        second_rooms = {frozenset(room["users"]) for room in await storage.list_rooms()}
+        return first, first_rooms, second, second_rooms, await storage.load_pair_history()
+
+    # 他のテストのユーザーと混ざらないよう専用のストレージに差し替える
+    original_storage = rooms.storage
+    rooms.storage = storage = MemoryStorage()
+    try:
+        first, first_rooms, second, second_rooms, saved = asyncio.run(run())
+    finally:
+        rooms.storage = original_storage
+    assert first["created_rooms"] == 2 and second["created_rooms"] == 2
+    assert not first_rooms & second_rooms
+    assert second["stats"]["pairing"]["repeats"] == 0
+    assert PairHistory.from_bytes(saved).stats()["pairs"] == 4
+
+def test_failed_cutover_does_not_record_pairs():
+    from db.memory_storage import MemoryStorage
+    from matchmaking.pairing import pair_key, user_hash
+    import db.rooms as rooms
+
+    async def run():
+        for uid in ("a", "b", "c", "d"):
+            await storage.create_user({"firebase_uid": uid, "created_at": None, "room_id": None})
+        original_activate = storage.activate_epoch
+
+        async def failing_activate(epoch):
+            raise RuntimeError("cutover failed")
+
+        storage.activate_epoch = failing_activate
+        try:
+            await rooms.firestore_reset_all_rooms("day1")
+        except RuntimeError:
+            pass
+        finally:
+            storage.activate_epoch = original_activate
+        after_failure = await storage.load_pair_history()
+        # チェックポイントなしでやり直すと組み合わせを決め直す
+        await rooms.firestore_reset_all_rooms("day1")
+        used = [[uid[len("user_"):] for uid in room["users"]] for room in await storage.list_rooms()]
+        return after_failure, used, PairHistory.from_bytes(await storage.load_pair_history())
+
+    original_storage = rooms.storage
+    rooms.storage = storage = MemoryStorage()
+    try:
+        after_failure, used, history = asyncio.run(run())
+    finally:
+        rooms.storage = original_storage
+    assert after_failure is None
+    # 記録されるのは有効になった2組だけ
+    assert history.stats()["pairs"] == 2
+    assert all(history.seen(pair_key(user_hash(first), user_hash(second))) for first, second in used)
+
+if __name__ == '__main__':
+    test_pairs_are_not_repeated_across_resets()
+    test_odd_user_is_carried_to_the_next_reset()
+    test_small_groups_fall_back_to_repeats()
+    test_same_epoch_does_not_advance_history()
+    test_reset_pairs_users_it_has_not_paired_before()
+    test_failed_cutover_does_not_record_pairs()
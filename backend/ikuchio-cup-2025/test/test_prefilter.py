@@ -0,0 +1,53 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from moderation.prefilter import create_prefilter_pipeline, MASK
+
+def test_short_reactions_skip_gemini():
+    pipeline = create_prefilter_pipeline("reaction,pii,trivial")
+    for text in ["いいねそれ", "すごいね！！", "がち？", "草www"]:
+        result = pipeline.run(text)
+        assert not result.needs_llm
+        assert result.text == text
+    assert pipeline.stats()["skip_ratio"] == 1.0
+
+def test_structured_pii_is_masked_before_gemini():
+    pipeline = create_prefilter_pipeline("reaction,pii,trivial")
+    result = pipeline.run("連絡は 090-1234-5678 か foo@example.com まで")
+    assert result.needs_llm
+    assert "090" not in result.text and "@" not in result.text
+    assert result.text.count(MASK) == 2
+
+    # 伏せ字しか残らない場合はGeminiを呼ばない
+    result = pipeline.run("foo@example.com")
+    assert not result.needs_llm
+    assert result.text == MASK
+
+def test_dates_and_amounts_are_not_masked():
+    pipeline = create_prefilter_pipeline("pii")
+    assert pipeline.run("2025-10-18に10000円使った").text == "2025-10-18に10000円使った"
+
+def test_scores_and_ranges_are_not_masked():
+    pipeline = create_prefilter_pipeline("pii")
+    for text in ["試合は3-2で勝った", "10-20歳くらい", "1-2-3で始めよう", "5-10分待って"]:
+        assert pipeline.run(text).text == text
+
+def test_addresses_are_masked_only_with_address_context():
+    pipeline = create_prefilter_pipeline("pii")
+    assert pipeline.run("渋谷区神宮前1-2-3に住んでる").text == f"渋谷区神宮前{MASK}に住んでる"
+    assert pipeline.run("3丁目4-5の角").text == f"{MASK}の角"
+    assert pipeline.run("12-34番地").text == f"{MASK}番地"
+
+def test_masking_keeps_the_rest_of_the_original_text():
+    pipeline = create_prefilter_pipeline("pii")
+    # 照合は全角・半角を揃えて行うが、伏せ字以外は元のまま残す
+    assert pipeline.run("ｶﾀｶﾅ ０９０-１２３４-５６７８ ３-２").text == f"ｶﾀｶﾅ {MASK} ３-２"
+
+if __name__ == '__main__':
+    test_short_reactions_skip_gemini()
+    test_structured_pii_is_masked_before_gemini()
+    test_dates_and_amounts_are_not_masked()
+    test_scores_and_ranges_are_not_masked()
+    test_addresses_are_masked_only_with_address_context()
+    test_masking_keeps_the_rest_of_the_original_text()
@@ -0,0 +1,120 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ratelimit.token_bucket import Bucket, InMemoryRateLimiter, retry_after_header
+import ratelimit.admission as admission
+from ratelimit.admission import MessageAdmission, AdmissionRejected
+
+def test_bucket_allows_burst_then_refills():
+    async def run():
+        limiter = InMemoryRateLimiter()
+        bucket = Bucket("user:a", 20, 3)
+        burst = [(await limiter.acquire([bucket])).allowed for _ in range(4)]
+        rejected = await limiter.acquire([bucket])
+        await asyncio.sleep(0.06)
+        refilled = await limiter.acquire([bucket])
+        return burst, rejected, refilled
+
+    burst, rejected, refilled = asyncio.run(run())
+    assert burst == [True, True, True, False]
+    assert not rejected.allowed and rejected.bucket.key == "user:a"
+    assert 0 < rejected.retry_after <= 0.05
+    assert refilled.allowed
+    assert retry_after_header(0.05) == "1" and retry_after_header(2.2) == "3"
+
+def test_rejected_room_does_not_spend_user_tokens():
+    async def run():
+        limiter = InMemoryRateLimiter()
+        user = Bucket("user:a", 0.01, 2)
+        full_room = Bucket("room:busy", 0.01, 1)
+        assert (await limiter.acquire([Bucket("user:b", 0.01, 2), full_room])).allowed
+        rejected = await limiter.acquire([user, full_room])
+        # 部屋で断られた分はユーザーのトークンを減らさない
+        other_rooms = [(await limiter.acquire([user, Bucket(f"room:{i}", 0.01, 1)])).allowed for i in range(3)]
+        return rejected, other_rooms
+
+    rejected, other_rooms = asyncio.run(run())
+    assert not rejected.allowed and rejected.bucket.key == "room:busy"
+    assert other_rooms == [True, True, False]
+
+async def _empty_queue():
+    return 0
+
+def _rejection(coroutine):
+    try:
+        asyncio.run(coroutine)
+    except AdmissionRejected as e:
+        return e.status_code, e.reason
+    return None
+
+def test_admission_rate_limits_users_and_rooms():
+    admission.MESSAGE_BURST_PER_USER = 2
+    admission.MESSAGE_BURST_PER_ROOM = 3
+    gate = MessageAdmission(InMemoryRateLimiter(), gemini_waiting=lambda: 0, queue_pending=_empty_queue)
+
+    async def run():
+        results = []
+        for sender in ("a", "a", "a", "b", "b"):
+            try:
+                await gate.admit("room_1", sender)
+                results.append("ok")
+            except AdmissionRejected as e:
+                assert e.status_code == 429 and e.retry_after > 0
+                results.append(e.reason)
+        return results
+
+    assert asyncio.run(run()) == ["ok", "ok", "user", "ok", "room"]
+
+def test_admission_sheds_load_before_rate_limiting():
+    waiting = {"gemini": 0, "queue": 0}
+
+    async def queue_pending():
+        return waiting["queue"]
+
+    gate = MessageAdmission(InMemoryRateLimiter(), gemini_waiting=lambda: waiting["gemini"], queue_pending=queue_pending)
+    waiting["gemini"] = admission.LOAD_SHED_GEMINI_WAITING
+    assert _rejection(gate.admit("room_1", "a")) == (503, "gemini")
+
+    waiting["gemini"] = 0
+    waiting["queue"] = admission.LOAD_SHED_QUEUE_DEPTH
+
+    async def after_queue_refresh():
+        # キューの長さはバックグラウンドで読み直すので、1回目は直前の値（0）で判定する
+        await gate.admit("room_2", "b")
+        await gate._queue_refresh
+        await gate.admit("room_2", "b")
+
+    assert _rejection(after_queue_refresh()) == (503, "queue")
+
+def test_admission_accepts_when_limiter_is_down():
+    class BrokenLimiter:
+        async def acquire(self, buckets):
+            raise ConnectionError("redis is down")
+
+    gate = MessageAdmission(BrokenLimiter(), gemini_waiting=lambda: 0, queue_pending=_empty_queue)
+    assert _rejection(gate.admit("room_1", "a")) is None
+
+def test_admission_reads_queue_depth_from_the_worker_pool():
+    import messaging.worker as worker
+    from messaging.worker import MessageWorkerPool
+
+    class BusyQueue:
+        async def depth(self):
+            return {"pending": 7, "processing": 1, "dead": 0}
+
+    original_pool = worker.message_worker_pool
+    worker.message_worker_pool = MessageWorkerPool(queue=BusyQueue())
+    try:
+        assert asyncio.run(admission._queue_pending()) == 7
+    finally:
+        worker.message_worker_pool = original_pool
+
+if __name__ == '__main__':
+    test_bucket_allows_burst_then_refills()
+    test_rejected_room_does_not_spend_user_tokens()
+    test_admission_rate_limits_users_and_rooms()
+    test_admission_sheds_load_before_rate_limiting()
+    test_admission_accepts_when_limiter_is_down()
+    test_admission_reads_queue_depth_from_the_worker_pool()
@@ -0,0 +1,27 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from messaging.room_events import InMemoryRoomEventLog
+
+def test_in_memory_event_log_replays_after_last_seq():
+    async def run():
+        log = InMemoryRoomEventLog(max_len=3)
+        for i in range(5):
+            await log.append("room", {"type": "new_message", "message_id": str(i)})
+        return (
+            await log.current_seq("room"),
+            await log.read_after("room", 3),
+            await log.read_after("room", 5),
+            await log.read_after("room", 1),  # seq 2はリングバッファから消えている
+        )
+
+    current, after_three, up_to_date, truncated = asyncio.run(run())
+    assert current == 5
+    assert [event["seq"] for event in after_three] == [4, 5]
+    assert up_to_date == []
+    assert truncated is None
+
+if __name__ == '__main__':
+    test_in_memory_event_log_replays_after_last_seq()
@@ -0,0 +1,118 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+import db.rooms
+from db.storage import storage
+from scheduler.lease import InMemoryLeaseStore
+from scheduler.room_scheduler import RoomScheduler
+
+async def _seed_users(count):
+    for i in range(count):
+        await storage.create_user({"firebase_uid": f"u{i}", "created_at": None, "room_id": None})
+
+def test_only_the_lease_holder_runs_the_reset():
+    async def run():
+        store = InMemoryLeaseStore()
+        leader = RoomScheduler(lease_store=store)
+        follower = RoomScheduler(lease_store=store)
+        await store.acquire("room_reset", leader.owner_id, 60)
+        blocked = await follower.run_reset("2025-01-01")
+        await store.release("room_reset", leader.owner_id)
+        return blocked
+
+    assert asyncio.run(run()) is None
+
+def test_another_pod_resumes_from_the_checkpoint():
+    async def run():
+        await _seed_users(7)
+        store = InMemoryLeaseStore()
+        first = RoomScheduler(lease_store=store)
+        second = RoomScheduler(lease_store=store)
+        second.running = True
+
+        db.rooms.RESET_CHUNK_ROOMS = 1
+        original_write = storage.write_assignments
+        writes = []
+
+        async def failing_write(epoch, rooms, users):
+            # 2チャンク目の書き込み中にリーダーが落ちたことにする
+            writes.append(len(rooms))
+            if len(writes) == 2:
+                raise RuntimeError("pod crashed")
+            return await original_write(epoch, rooms, users)
+
+        engine = storage._storage
+        engine.write_assignments = failing_write
+        try:
+            failed = await first.run_reset("2025-01-01")
+        finally:
+            del engine.write_assignments
+        status_after_failure = (await first.get_status())["reset"]
+        # 途中まで書いたルームは切り替えまで見えない
+        visible_after_failure = len(await storage.list_rooms())
+
+        result = await second.reset_until_done("2025-01-01")
+        # 完了済みのリセットは他のPodがもう一度実行しない
+        skipped = await first.run_reset("2025-01-01")
+        collected = await second.collect_old_epochs()
+        return failed, status_after_failure, visible_after_failure, result, skipped, collected, await second.get_status()
+
+    failed, status_after_failure, visible_after_failure, result, skipped, collected, status = asyncio.run(run())
+    assert failed == {"error": "Failed to reset rooms"}
+    assert status_after_failure["state"] == "failed"
+    assert status_after_failure["progress"] == {"assigned_rooms": 1, "total_rooms": 3}
+    assert visible_after_failure == 0
+    assert result["created_rooms"] == 3 and result["stats"]["resumed"]
+    assert skipped == result
+    assert status["reset"]["state"] == "done" and status["reset"]["attempts"] == 2
+    assert status["lease_holder"] is None
+    assert status["epochs"] == {"current": "2025-01-01", "next": None, "retired": []}
+    assert list(collected) == ["initial"]
+    assigned = [user for user in asyncio.run(storage.list_users()) if user["room_id"]]
+    assert len(assigned) == 6
+    assert len(asyncio.run(storage.list_rooms())) == 3
+
+def test_failed_batches_are_retried_before_the_cutover():
+    async def run():
+        await _seed_users(7)
+        scheduler = RoomScheduler(lease_store=InMemoryLeaseStore())
+        scheduler.running = True
+        epoch_before = await storage.get_current_epoch()
+
+        db.rooms.RESET_CHUNK_ROOMS = 1
+        original_write = storage.write_assignments
+        writes = []
+
+        async def partly_failing_write(epoch, rooms, users):
+            # 2チャンク目のバッチだけ失敗したことにする（例外ではなくfailed_opsで返る）
+            writes.append(len(rooms))
+            stats = await original_write(epoch, rooms, users)
+            return {**stats, "failed_ops": 3} if len(writes) == 2 else stats
+
+        engine = storage._storage
+        engine.write_assignments = partly_failing_write
+        try:
+            failed = await scheduler.run_reset("2025-01-02")
+        finally:
+            del engine.write_assignments
+        status_after_failure = (await scheduler.get_status())["reset"]
+        epoch_after_failure = await storage.get_current_epoch()
+        result = await scheduler.reset_until_done("2025-01-02")
+        return epoch_before, failed, status_after_failure, epoch_after_failure, result
+
+    epoch_before, failed, status_after_failure, epoch_after_failure, result = asyncio.run(run())
+    assert failed == {"error": "Failed to reset rooms"}
+    # 失敗したチャンクの先にチェックポイントを進めず、切り替えもしない
+    assert status_after_failure["progress"] == {"assigned_rooms": 1, "total_rooms": 3}
+    assert epoch_after_failure == epoch_before
+    assert result["created_rooms"] == 3 and result["stats"]["assigned"]["failed_ops"] == 0
+    assigned = [user for user in asyncio.run(storage.list_users()) if user["room_id"]]
+    assert len(assigned) == 6
+
+if __name__ == '__main__':
+    test_only_the_lease_holder_runs_the_reset()
+    test_another_pod_resumes_from_the_checkpoint()
+    test_failed_batches_are_retried_before_the_cutover()
@@ -0,0 +1,46 @@
+import sys
+import os
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from cache.tiered_cache import LRUCache, TieredCache
+
+def test_lru_cache_evicts_oldest_and_expires():
+    cache = LRUCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.set("d", 4, ttl_seconds=-1)
+    assert cache.get("d") is None
+
+def test_tiered_cache_without_redis_counts_hits():
+    async def run():
+        cache = TieredCache("test", redis_url="")
+        assert await cache.get("key") is None
+        await cache.set("key", "いいねそれ")
+        assert await cache.get("key") == "いいねそれ"
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["local_hits"] == 1
+    assert stats["misses"] == 1
+
+def test_tiered_cache_add_does_not_overwrite_newer_value():
+    async def run():
+        cache = TieredCache("test", redis_url="")
+        await cache.set_many({"user": {"room_id": "room_new"}})
+        # 割り当て前に読んだ古い値では上書きしない
+        added = await cache.add("user", {"room_id": None})
+        return added, await cache.get("user")
+
+    added, value = asyncio.run(run())
+    assert not added
+    assert value == {"room_id": "room_new"}
+
+if __name__ == '__main__':
+    test_lru_cache_evicts_oldest_and_expires()
+    test_tiered_cache_without_redis_counts_hits()
+    test_tiered_cache_add_does_not_overwrite_newer_value()
@@ -0,0 +1,35 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import tracing
+from tracing import start_span, current_traceparent, parse_traceparent
+
+def test_spans_propagate_through_traceparent():
+    tracing.TRACE_SAMPLE_RATE = 1.0
+    tracing.exporter.kind = 'none'
+    with start_span("send_message") as root:
+        with start_span("db.get_user", new_trace=False) as child:
+            pass
+        carried = current_traceparent()
+
+    # 別Podでの配信はPub/Subで運ばれたtraceparentの子になる
+    with start_span("ws.deliver", parent=carried) as remote:
+        pass
+
+    assert child.trace_id == root.trace_id and child.parent_id == root.span_id
+    assert remote.trace_id == root.trace_id and remote.parent_id == root.span_id
+    assert parse_traceparent(carried) == (root.trace_id, root.span_id, True)
+    assert current_traceparent() is None
+
+def test_unsampled_root_is_not_propagated():
+    tracing.TRACE_SAMPLE_RATE = 0.0
+    with start_span("send_message") as root:
+        assert not root.sampled
+        assert current_traceparent() is None
+    with start_span("db.get_user", new_trace=False) as orphan:
+        assert not orphan.sampled
+
+if __name__ == '__main__':
+    test_spans_propagate_through_traceparent()
+    test_unsampled_root_is_not_propagated()